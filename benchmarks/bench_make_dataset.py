@@ -0,0 +1,224 @@
+"""
+Benchmarks for the functions in src/data/pipeline.py (and their vectorised versions in src/data/reshape.py), and
+for the whole pipeline, on synthetic data at a range of scales. A scale of 1 is about the size of the real data
+(141 countries, 38 years), larger scales add (made up) sub-national units.
+
+For every function and scale we record the best wall time over a few runs, and the peak memory allocated during a
+separate run under tracemalloc, next to the in-memory size of the suicide data (input_mb), as peaks are best read as
+a multiple of it. The lean stages (src/data/lean.py) and the pipeline with --lean are measured next to the default
+ones. Results are written as json, so that runs before and after a change can be compared:
+
+    python benchmarks/bench_make_dataset.py run --scale 1 --scale 10
+    python benchmarks/bench_make_dataset.py compare reports/benchmarks/old.json reports/benchmarks/new.json
+"""
+import datetime
+import json
+import logging
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+from collections import namedtuple
+from contextlib import contextmanager
+from pathlib import Path
+
+import click
+import numpy as np
+import pandas as pd
+
+from src.data import add_country_codes, lean, make_dataset, pipeline, raw_data, reshape, synthetic
+from src.features import build_features
+
+RESULTS_DIR = "./reports/benchmarks"
+
+# a benchmark: name, function, and names of the inputs (see PipelineInputs) it is called with
+Case = namedtuple("Case", ["name", "func", "inputs"])
+
+CASES = [
+    Case("add_age_group_fractions", pipeline.add_age_group_fractions, ["suicides"]),
+    Case("get_age_group_stats", pipeline.get_age_group_stats, ["age_fractions"]),
+    Case("clean_population_stats", pipeline.clean_population_stats, ["population_raw"]),
+    Case("fill_in_missing_populations", pipeline.fill_in_missing_populations,
+         ["suicides", "population", "age_stats"]),
+    Case("clean_meta_data", pipeline.clean_meta_data, ["meta_raw"]),
+    Case("prepare_data_for_choropleth", pipeline.prepare_data_for_choropleth, ["enriched"]),
+    Case("make_df_nicer_format", pipeline.make_df_nicer_format, ["choropleth"]),
+    Case("reshape.choropleth_frame", reshape.choropleth_frame, ["enriched"]),
+    Case("reshape.year_country_frame", reshape.year_country_frame, ["choropleth"]),
+    Case("lean.add_age_group_fractions", lean.add_age_group_fractions, ["suicides"]),
+    Case("lean.get_age_group_stats", lean.get_age_group_stats, ["age_fractions"]),
+    Case("lean.impute_missing_populations", lean.impute_missing_populations, ["suicides", "population", "age_stats"]),
+    Case("lean.choropleth_frame", lean.choropleth_frame, ["enriched"]),
+    Case("build_features.trend_features",
+         lambda df: build_features.trend_features(build_features.series_matrix(df, ["country", "sex", "age"])),
+         ["enriched"]),
+]
+
+
+class PipelineInputs:
+    """
+    The inputs of every pipeline stage for one synthetic data set, computed (once) when first asked for
+    """
+
+    def __init__(self, archive):
+        self.archive = archive
+        self._frames = {}
+
+    def __getitem__(self, name):
+        if name not in self._frames:
+            self._frames[name] = getattr(self, "_" + name)()
+        return self._frames[name]
+
+    def _suicides(self):
+        return raw_data.read_raw(raw_data.SUICIDE_MEMBER, archive=self.archive)
+
+    def _population_raw(self):
+        return raw_data.read_raw(raw_data.POPULATION_MEMBER, archive=self.archive)
+
+    def _meta_raw(self):
+        return raw_data.read_raw(raw_data.META_DATA_MEMBER, archive=self.archive)
+
+    def _age_fractions(self):
+        return pipeline.add_age_group_fractions(self["suicides"])
+
+    def _age_stats(self):
+        return pipeline.get_age_group_stats(self["age_fractions"])
+
+    def _population(self):
+        return pipeline.clean_population_stats(self["population_raw"])
+
+    def _enriched(self):
+        return pipeline.fill_in_missing_populations(self["suicides"], self["population"], self["age_stats"])
+
+    def _choropleth(self):
+        return reshape.choropleth_frame(self["enriched"])
+
+
+def measure(func, args, repeat):
+    """
+    :param func: function to benchmark
+    :param args: list of arguments to call it with
+    :param repeat: int, number of timed runs
+    :return: dictionary with the best wall time in seconds and the peak traced memory in MB
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": min(timings), "peak_mb": peak / 2 ** 20}
+
+
+@contextmanager
+def working_directory(path):
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+
+def run_main(*options):
+    make_dataset.main.main(["all", "--force"] + list(options), standalone_mode=False)
+
+
+def benchmark_scale(scale, repeat, n_years):
+    """
+    Run all benchmarks on a synthetic data set of the given scale, in a temporary directory laid out like the repo
+    :return: list of result dictionaries
+    """
+    logger = logging.getLogger(__name__)
+    n_countries = int(round(synthetic.REAL_SIZE[0] * scale))
+    data = synthetic.make_synthetic_data(n_countries=n_countries, n_years=n_years)
+    rows = len(data.suicides)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir, working_directory(tmp_dir):
+        Path(raw_data.RAW_ARCHIVE).parent.mkdir(parents=True)
+        Path(make_dataset.PROCESSED_FILE).parent.mkdir(parents=True)
+        synthetic.write_raw_archive(data, raw_data.RAW_ARCHIVE)
+        # we know the codes of our made up countries, resolving them with a fuzzy search would dominate every run
+        add_country_codes.write_code_cache(add_country_codes.COUNTRY_CODE_CACHE_FILE, data.codes)
+        del data
+
+        inputs = PipelineInputs(raw_data.RAW_ARCHIVE)
+        input_mb = inputs["suicides"].memory_usage(deep=True).sum() / 2 ** 20
+        for case in CASES:
+            args = [inputs[name] for name in case.inputs]
+            result = measure(case.func, args, repeat)
+            logger.info(f"scale {scale}, {case.name}: {result['seconds']:.3f}s, {result['peak_mb']:.1f}MB")
+            results.append(dict(function=case.name, scale=scale, rows=rows, input_mb=input_mb, **result))
+        del inputs
+
+        for name, options in [("main", []), ("main --lean", ["--lean"])]:
+            result = measure(run_main, options, repeat=1)
+            logger.info(f"scale {scale}, {name}: {result['seconds']:.3f}s, {result['peak_mb']:.1f}MB "
+                        f"({result['peak_mb'] / input_mb:.1f} times the suicide data)")
+            results.append(dict(function=name, scale=scale, rows=rows, input_mb=input_mb, **result))
+    return results
+
+
+@click.group()
+def cli():
+    """ Benchmarks for the make_dataset pipeline. """
+
+
+@cli.command()
+@click.option("--scale", "scales", type=float, multiple=True, default=[1, 10],
+              help="Size of the synthetic data relative to the real data, can be given multiple times.")
+@click.option("--years", "n_years", type=int, default=synthetic.REAL_SIZE[1], show_default=True)
+@click.option("--repeat", type=int, default=3, show_default=True, help="Number of timed runs per benchmark.")
+@click.option("--output", type=click.Path(), default=None, help="Json file to write the results to.")
+def run(scales, n_years, repeat, output):
+    """ Time and memory-profile the pipeline at a range of scales. """
+    results = []
+    for scale in scales:
+        results.extend(benchmark_scale(scale, repeat, n_years))
+
+    if output is None:
+        output = Path(RESULTS_DIR) / f"make_dataset-{datetime.datetime.now():%Y%m%d-%H%M%S}.json"
+    Path(output).parent.mkdir(parents=True, exist_ok=True)
+    report = {
+        "created": datetime.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "results": results,
+    }
+    with open(output, "w") as f:
+        json.dump(report, f, indent=1)
+    click.echo(pd.DataFrame(results).to_string(index=False))
+    click.echo(f"results written to {output}")
+
+
+@cli.command()
+@click.argument("baseline", type=click.Path(exists=True))
+@click.argument("current", type=click.Path(exists=True))
+def compare(baseline, current):
+    """ Compare two result files, showing the ratio current / baseline of time and memory. """
+    frames = []
+    for path in [baseline, current]:
+        with open(path) as f:
+            frames.append(pd.DataFrame(json.load(f)["results"]).set_index(["function", "scale"]))
+    both = frames[0].join(frames[1], how="inner", lsuffix="_baseline", rsuffix="_current")
+    both["time_ratio"] = both["seconds_current"] / both["seconds_baseline"]
+    both["memory_ratio"] = both["peak_mb_current"] / both["peak_mb_baseline"]
+    columns = ["seconds_baseline", "seconds_current", "time_ratio", "peak_mb_baseline", "peak_mb_current",
+               "memory_ratio"]
+    click.echo(both[columns].round(3).to_string())
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    logging.getLogger("src.data.stage_cache").setLevel(logging.WARNING)
+    cli()
@@ -0,0 +1,90 @@
+"""
+Bytes read and time taken by selective queries on the suicide data saved as a single parquet file (read whole, then
+filtered in pandas, as load_dataset did before) and partitioned by year, or by year and region (see
+src/data/hive.py), on synthetic data at a range of scales. A scale of 1 is about the size of the real data, larger
+scales add (made up) sub-national units.
+
+    python benchmarks/bench_partitioned_reads.py --scale 1 --scale 10
+"""
+import logging
+import tempfile
+import time
+from pathlib import Path
+
+import click
+import pandas as pd
+
+from src.data import hive, load_dataset, synthetic
+
+# name of a query -> function of the synthetic data, returning its filters
+QUERIES = {
+    "one year": lambda df: [("year", "==", int(df["year"].max()))],
+    "five years": lambda df: [("year", ">", int(df["year"].max()) - 5)],
+    "one country": lambda df: [("country", "==", df["country"].iloc[0])],
+    "one country, five years": lambda df: [("country", "==", df["country"].iloc[0]),
+                                           ("year", ">", int(df["year"].max()) - 5)],
+}
+PARTITIONINGS = [["year"], ["year", "region"]]
+
+
+def best_time(func, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def benchmark_scale(scale, n_years, row_group_size):
+    """
+    :return: list of dictionaries, one per query and layout, with the bytes read and the best time
+    """
+    n_countries = int(round(synthetic.REAL_SIZE[0] * scale))
+    data = synthetic.make_synthetic_data(n_countries=n_countries, n_years=n_years)
+    regions = data.meta.set_index("Country Code")["Region"]
+    suicides = data.suicides.assign(region=data.suicides["country"].map(data.codes).map(regions))
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        single = Path(tmp_dir) / "enriched_df.parquet"
+        load_dataset.save_dataset(suicides, single, "parquet")
+        layouts = {"single file": None}
+        for partition_by in PARTITIONINGS:
+            directory = Path(tmp_dir) / "_".join(partition_by)
+            hive.write_partitioned(suicides, directory, partition_by, row_group_size=row_group_size)
+            layouts["by " + ", ".join(partition_by)] = directory
+
+        for query, make_filters in QUERIES.items():
+            filters = make_filters(suicides)
+            for layout, directory in layouts.items():
+                if directory is None:
+                    def read():
+                        df = load_dataset.read_dataset(single)
+                        return df[hive.filter_mask(df, filters)]
+                    bytes_read = single.stat().st_size
+                else:
+                    def read():
+                        return hive.read_partitioned(directory, filters=filters)
+                    bytes_read = hive.plan_scan(directory, filters).bytes_read
+                results.append(dict(scale=scale, rows=len(suicides), query=query, layout=layout, rows_out=len(read()),
+                                    bytes_read=bytes_read, seconds=best_time(read)))
+    return results
+
+
+@click.command()
+@click.option("--scale", "scales", type=float, multiple=True, default=[1, 10], show_default=True,
+              help="Size of the synthetic data relative to the real data, repeat for several.")
+@click.option("--n-years", type=int, default=synthetic.REAL_SIZE[1], show_default=True)
+@click.option("--row-group-size", type=int, default=hive.DEFAULT_ROW_GROUP_SIZE, show_default=True)
+def main(scales, n_years, row_group_size):
+    """ Compare selective reads of a single parquet file and of partitioned datasets. """
+    results = pd.DataFrame([result for scale in scales for result in benchmark_scale(scale, n_years, row_group_size)])
+    single = results[results["layout"] == "single file"].set_index(["scale", "query"])["bytes_read"]
+    results["fraction_read"] = results["bytes_read"].values / single.loc[
+        list(zip(results["scale"], results["query"]))].values
+    click.echo(results.to_string(index=False, float_format=lambda x: f"{x:.3f}"))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    main()
@@ -0,0 +1,124 @@
+"""
+Load test of the query service in src/service/server.py. A number of client processes (see src/service/client.py)
+send requests for a mix of country time series, year cross-sections and breakdowns as fast as they can, each over a
+single kept-alive connection, and we report the throughput and latencies.
+
+By default a server is started (in its own process, so that it gets a core to itself) on the processed data of the
+repo, run make_dataset.py first. Pass --port of a running server to test that one instead.
+
+    python benchmarks/load_test_service.py --clients 4 --duration 10
+"""
+import logging
+import os
+import random
+import subprocess
+import sys
+import time
+from multiprocessing import Pool
+from pathlib import Path
+
+import click
+import numpy as np
+
+from src.service.client import DEFAULT_HOST, QueryClient, request_target
+
+SERVER_SCRIPT = Path(__file__).resolve().parents[1] / "src" / "service" / "server.py"
+
+
+def request_targets(host, port, n_countries=50):
+    """
+    :return: list of targets (path and query string) of a realistic mix of requests
+    """
+    with QueryClient(host, port) as client:
+        countries = client.countries()
+        years = sorted(set(client.series(countries["country"][0])["year"]))
+    names = countries["country"][:n_countries]
+    targets = [request_target(f"/countries/{name}", {}) for name in names]
+    targets += [request_target(f"/countries/{name}", {"by": "sex"}) for name in names]
+    targets += [request_target(f"/years/{year}", {}) for year in years]
+    targets += [request_target(f"/years/{year}", {"min_years": 20, "sex": "female"}) for year in years]
+    targets += [request_target("/breakdown", {"country": name}) for name in names]
+    return targets
+
+
+def run_client(args):
+    """
+    Send requests for duration seconds
+    :return: (numpy array of latencies in seconds, dictionary, status -> count)
+    """
+    host, port, targets, duration, revalidate, seed = args
+    rng = random.Random(seed)
+    latencies, statuses = [], {}
+    with QueryClient(host, port, revalidate=revalidate) as client:
+        end = time.perf_counter() + duration
+        while True:
+            start = time.perf_counter()
+            if start > end:
+                break
+            status, _ = client.request(rng.choice(targets))
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+    return np.array(latencies), statuses
+
+
+def wait_for_server(host, port, timeout=60.):
+    end = time.time() + timeout
+    while True:
+        try:
+            with QueryClient(host, port, timeout=1.) as client:
+                return client.health()
+        except OSError:
+            if time.time() > end:
+                raise
+            time.sleep(0.2)
+
+
+@click.command()
+@click.option("--host", default=DEFAULT_HOST, show_default=True)
+@click.option("--port", type=int, default=None, help="Port of a running server. Starts a server if not given.")
+@click.option("--clients", type=click.IntRange(min=1), default=4, show_default=True,
+              help="Number of client processes.")
+@click.option("--duration", type=float, default=10., show_default=True, help="Seconds to send requests for.")
+@click.option("--revalidate", is_flag=True,
+              help="Let the clients remember responses and revalidate them with their ETag, like a browser would.")
+@click.option("--cache-size", type=int, default=None, help="Response cache size of the started server.")
+def main(host, port, clients, duration, revalidate, cache_size):
+    """ Measure the throughput of the query service. """
+    logger = logging.getLogger(__name__)
+    server = None
+    if port is None:
+        port = 8051
+        command = [sys.executable, str(SERVER_SCRIPT), "--host", host, "--port", str(port), "--reload-interval", "0"]
+        if cache_size is not None:
+            command += ["--cache-size", str(cache_size)]
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(SERVER_SCRIPT.parents[2])] + sys.path[1:]))
+        server = subprocess.Popen(command, env=env)
+    try:
+        wait_for_server(host, port)
+        targets = request_targets(host, port)
+        logger.info(f"{clients} clients sending requests for {len(targets)} different targets for {duration}s")
+        with Pool(clients) as pool:
+            results = pool.map(run_client, [(host, port, targets, duration, revalidate, seed)
+                                            for seed in range(clients)])
+        with QueryClient(host, port) as client:
+            health = client.health()
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    latencies = np.concatenate([latency for latency, _ in results]) * 1000
+    statuses = {}
+    for _, client_statuses in results:
+        for status, count in client_statuses.items():
+            statuses[status] = statuses.get(status, 0) + count
+    click.echo(f"requests: {len(latencies)}, {len(latencies) / duration:.0f} per second")
+    click.echo("latency ms: " + ", ".join(f"p{q} {np.percentile(latencies, q):.2f}" for q in [50, 90, 99]) +
+               f", max {latencies.max():.2f}")
+    click.echo(f"statuses: {statuses}, revalidated: {revalidate}")
+    click.echo(f"server cache: {health['cached']} responses, {health['hits']} hits, {health['misses']} misses")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    main()
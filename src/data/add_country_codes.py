@@ -1,5 +1,16 @@
+import json
+import logging
+import os
+from collections import namedtuple
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
 import pycountry
 
+COUNTRY_CODE_CACHE_FILE = "./data/interim/country_codes.json"
+
 COUNTRY_TO_CODE = {
     "Virgin Islands (USA)": "VIR",
     "Iran (Islamic Rep of)": "IRN",
@@ -11,6 +22,11 @@ COUNTRY_TO_CODE = {
     "Reunion": "REU"
     }  # get codes for some countries that are not easily found in pycountry
 
+# result of get_alpha3_codes: the codes (same shape as the input) and a dataframe of the names we could not resolve
+CodeLookup = namedtuple("CodeLookup", ["codes", "unresolved"])
+
+logger = logging.getLogger(__name__)
+
 
 def get_alpha3_code(country_name: str) -> str:
     """
@@ -35,3 +51,119 @@ def get_alpha3_code(country_name: str) -> str:
         # if len(alpha3_fuzzy) > 1:
         #     print(f"Multiple possibilities found for country {country_name} (taking first one): {alpha3_fuzzy}")
         return alpha3_fuzzy[0].alpha_3
+
+
+def _pycountry_version() -> str:
+    return str(getattr(pycountry, "__version__", "n/a"))
+
+
+@lru_cache(maxsize=None)
+def _exact_name_index() -> dict:
+    """
+    Build (once per process) a dictionary from lower-cased country name to alpha-3 code. Names in pycountry take
+    precedence, then our own COUNTRY_TO_CODE, then historic countries. Lookups are case insensitive, like the ones in
+    pycountry itself.
+    :return: dictionary, lower-cased name -> alpha-3 code
+    """
+    index = {}
+    for country in pycountry.historic_countries:
+        index[country.name.lower()] = country.alpha_3
+    for name, code in COUNTRY_TO_CODE.items():
+        index[name.lower()] = code
+    for country in pycountry.countries:
+        index[country.name.lower()] = country.alpha_3
+    return index
+
+
+def _fuzzy_alpha3_code(country_name: str) -> str:
+    """
+    Fall back to the (slow) fuzzy search of pycountry for a name that is not in our exact name index
+    :param country_name: string, name of country we want code for
+    :return: string, the alpha-3 code of the best match, or an empty string if there is no match
+    """
+    try:
+        return pycountry.countries.search_fuzzy(country_name)[0].alpha_3
+    except LookupError:
+        return ""
+
+
+def _read_code_cache(cache_file) -> dict:
+    """
+    Read previously resolved names (misses are stored as empty strings). The cache is discarded if it was written with
+    a different pycountry version, as the fuzzy matches may have changed.
+    :param cache_file: path to json file, or None for no cache
+    :return: dictionary, country name -> alpha-3 code
+    """
+    if cache_file is None or not Path(cache_file).is_file():
+        return {}
+    try:
+        with open(cache_file, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        logger.warning(f"could not read country code cache {cache_file}, ignoring it")
+        return {}
+    if cached.get("pycountry_version") != _pycountry_version():
+        logger.info("pycountry version changed, discarding country code cache")
+        return {}
+    return cached.get("codes", {})
+
+
+def write_code_cache(cache_file, codes: dict):
+    """
+    Add resolved names to the country code cache, tagged with the current pycountry version. Names already in the cache
+    (e.g. written by another process in the meantime) are kept.
+    :param cache_file: path to json file
+    :param codes: dictionary, country name -> alpha-3 code (empty string if there is none)
+    """
+    cache_file = Path(cache_file)
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    merged = _read_code_cache(cache_file)
+    merged.update(codes)
+    tmp_file = cache_file.with_name(f"{cache_file.name}.{os.getpid()}.tmp")
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump({"pycountry_version": _pycountry_version(), "codes": merged}, f, indent=1, sort_keys=True)
+    tmp_file.replace(cache_file)
+
+
+def get_alpha3_codes(country_names, cache_file=COUNTRY_CODE_CACHE_FILE) -> CodeLookup:
+    """
+    Get the alpha-3 codes for a whole collection of country names at once. Every unique name is only resolved once:
+    first in an in-memory index of exact names, then in an on-disk cache of earlier results and only after that with
+    the fuzzy search of pycountry. Newly resolved names (including the ones we could not find) are added to the cache.
+    :param country_names: pd Series, numpy array or list of country names
+    :param cache_file: path to json file used to persist resolved names, None to not use a cache on disk
+    :return: CodeLookup namedtuple. codes: alpha-3 codes, a pd Series (same index as country_names) if a Series was
+        passed in, otherwise a numpy array. Empty string where no code was found. unresolved: pd dataframe with columns
+        country and rows (the number of rows with that name) for all names we could not find a code for
+    """
+    indexer, uniques = pd.factorize(pd.Series(country_names).values)
+    index = _exact_name_index()
+    cached = _read_code_cache(cache_file)
+
+    unique_codes = []
+    newly_resolved = {}
+    for name in uniques:
+        name = str(name)
+        code = index.get(name.lower())
+        if code is None:
+            code = cached.get(name)
+        if code is None:
+            code = _fuzzy_alpha3_code(name)
+            newly_resolved[name] = code
+        unique_codes.append(code)
+
+    if newly_resolved and cache_file is not None:
+        write_code_cache(cache_file, newly_resolved)
+
+    # indexer is -1 for missing names, these get an empty code as well
+    unique_codes = np.array(unique_codes + [""], dtype=object)
+    codes = unique_codes[indexer]
+
+    missing = unique_codes[indexer] == ""
+    unresolved = pd.Series(pd.Series(country_names).values[missing]).fillna("").astype(str).value_counts()
+    unresolved = unresolved.rename_axis("country").rename("rows").reset_index().sort_values("country")
+    unresolved.index = list(range(len(unresolved)))
+
+    if isinstance(country_names, pd.Series):
+        codes = pd.Series(codes, index=country_names.index, name="code")
+    return CodeLookup(codes=codes, unresolved=unresolved)
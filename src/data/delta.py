@@ -0,0 +1,389 @@
+"""
+Delta ingestion: bring the processed datasets up to date with a new release of the raw data by recomputing only the
+(country, year) keys that the release changed, instead of rerunning every stage on all of the history.
+
+After every run we keep a snapshot (in SNAPSHOT_DIR) of what the processed datasets were made from:
+
+- per (country, year): a hash of its rows of suicide data, the total population the population file gives it, and
+  whether any of its populations is missing (and so imputed)
+- the age group fractions (add_age_group_fractions) of every (country, year) with populations, and their sum and
+  count per age-sex group, so that get_age_group_stats is updated by taking out the fractions of the changed keys and
+  adding their new ones
+- the age group statistics the outputs were made with, and the fingerprints of the raw files and the outputs
+
+A new release is diffed against the snapshot. A key is recomputed if its suicide rows changed, if it has imputed
+populations and its total population changed, or if it has imputed populations and the age group statistics changed
+(they are an average over all countries). With the interpolated imputation a country's populations depend on all of
+its years, so all years of a country with a change are recomputed. The recomputed rows replace the rows of those keys
+in the enriched, choropleth and year-country data, which are put in the row order a full run gives.
+
+Without a snapshot that fits (a first run, other settings, or outputs that changed since) we do a full run and take a
+snapshot of it.
+"""
+import json
+import logging
+from collections import namedtuple
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.data import impute, load_dataset, pipeline, raw_data, reshape
+
+SNAPSHOT_DIR = "./data/interim/delta_snapshot"
+SNAPSHOT_FILES = {
+    "keys": "keys.parquet",
+    "fractions": "age_fractions.parquet",
+    "sums": "age_sums.parquet",
+    "age_stats": "age_stats.parquet",
+}
+STATE_FILE = "state.json"
+KEY_COLUMNS = ["country", "year"]
+DELTA_OUTPUTS = ["enriched", "choropleth", "year_country"]  # the outputs with rows per (country, year)
+RAW_MEMBERS = [raw_data.SUICIDE_MEMBER, raw_data.POPULATION_MEMBER, raw_data.META_DATA_MEMBER]
+
+Snapshot = namedtuple("Snapshot", ["keys", "fractions", "sums", "age_stats", "state"])
+# keys (MultiIndex of country, year) to recompute, to remove, and whether the age group statistics changed
+Change = namedtuple("Change", ["refreshed", "removed", "age_stats_changed"])
+
+logger = logging.getLogger(__name__)
+
+
+def key_index(data_frame):
+    """
+    :param data_frame: pd dataframe with columns country and year
+    :return: pd MultiIndex of (country as string, year as int64) of every row
+    """
+    return pd.MultiIndex.from_arrays([data_frame["country"].astype(str).values,
+                                      data_frame["year"].values.astype(np.int64)], names=KEY_COLUMNS)
+
+
+def _group_positions(codes, n_groups):
+    """
+    :param codes: numpy array of ints from 0, the group of every row
+    :param n_groups: int, number of groups
+    :return: (numpy array, the rows sorted on group (stably), numpy array, the first position of every group in it)
+    """
+    order = np.argsort(codes, kind="stable")
+    return order, np.searchsorted(codes[order], np.arange(n_groups))
+
+
+def key_table(suicide_df, df_population):
+    """
+    What the outputs of every (country, year) are made from
+    :param suicide_df: pd dataframe, the raw suicide data
+    :param df_population: pd dataframe, the cleaned population data (see clean_population_stats)
+    :return: pd dataframe, one row per (country, year) with columns country, year, rows_hash (uint64, of the suicide
+        rows in their order), imputed (bool, any population missing) and total_population (nan if unknown)
+    """
+    codes, keys = key_index(suicide_df).factorize()
+    order, starts = _group_positions(codes, len(keys))
+    rank = np.empty(len(codes), dtype=np.int64)
+    rank[order] = np.arange(len(codes)) - np.repeat(starts, np.diff(np.append(starts, len(codes))))
+    rows = suicide_df[["sex", "age", "suicides_no", "population"]].assign(rank=rank)
+    row_hashes = pd.util.hash_pandas_object(rows, index=False).values
+    countries, years = keys.get_level_values(0), keys.get_level_values(1).values  # factorize drops the names
+    missing = np.isnan(suicide_df["population"].values.astype(np.float64))
+    return pd.DataFrame({
+        "country": countries,
+        "year": years,
+        "rows_hash": np.add.reduceat(row_hashes[order], starts) if len(keys) else np.array([], dtype=np.uint64),
+        "imputed": np.bincount(codes, weights=missing, minlength=len(keys)) > 0,
+        "total_population": impute.total_population_lookup(df_population, pd.Series(countries), years),
+    })
+
+
+def age_fraction_table(suicide_df):
+    """
+    :param suicide_df: pd dataframe, (some keys of) the raw suicide data
+    :return: pd dataframe with columns country, year, age, sex (as strings) and fraction_pop, one row per age-sex group
+        of every (country, year) with populations, see add_age_group_fractions
+    """
+    dtypes = {"country": str, "year": np.int64, "age": str, "sex": str, "fraction_pop": np.float64}
+    if suicide_df["population"].isnull().all():
+        return pd.DataFrame(columns=list(dtypes)).astype(dtypes)  # add_age_group_fractions needs some populations
+    fractions = pipeline.add_age_group_fractions(suicide_df)[list(dtypes)]
+    return fractions.astype(dtypes).reset_index(drop=True)
+
+
+def age_sums(fractions):
+    """
+    :param fractions: pd dataframe, see age_fraction_table
+    :return: pd dataframe with index (age, sex) and columns sum and count of the fractions
+    """
+    return fractions.groupby(["age", "sex"])["fraction_pop"].agg(["sum", "count"])
+
+
+def read_snapshot(snapshot_dir=SNAPSHOT_DIR):
+    """
+    :param snapshot_dir: directory of the snapshot
+    :return: Snapshot, or None if there is none
+    """
+    snapshot_dir = Path(snapshot_dir)
+    if not (snapshot_dir / STATE_FILE).is_file():
+        return None
+    tables = {name: pd.read_parquet(snapshot_dir / file_name) for name, file_name in SNAPSHOT_FILES.items()}
+    tables["sums"] = tables["sums"].set_index(["age", "sex"])
+    return Snapshot(state=json.loads((snapshot_dir / STATE_FILE).read_text()), **tables)
+
+
+def write_snapshot(snapshot, snapshot_dir=SNAPSHOT_DIR):
+    """
+    :param snapshot: Snapshot
+    :param snapshot_dir: directory of the snapshot. The state file is written last, a snapshot without one is ignored
+    """
+    snapshot_dir = Path(snapshot_dir)
+    snapshot_dir.mkdir(parents=True, exist_ok=True)
+    if (snapshot_dir / STATE_FILE).exists():
+        (snapshot_dir / STATE_FILE).unlink()
+    tables = snapshot._replace(sums=snapshot.sums.reset_index())._asdict()
+    for name, file_name in SNAPSHOT_FILES.items():
+        tables[name].to_parquet(snapshot_dir / file_name, index=False)
+    (snapshot_dir / STATE_FILE).write_text(json.dumps(snapshot.state, indent=2))
+
+
+def output_fingerprints(output_files):
+    """
+    :param output_files: dictionary, name of an output -> path
+    :return: dictionary, name of an output -> [size, modification time in ns] of its file, None if it is not there
+    """
+    fingerprints = {}
+    for name, path in output_files.items():
+        stat = Path(path).stat() if Path(path).is_file() else None
+        fingerprints[name] = None if stat is None else [stat.st_size, stat.st_mtime_ns]
+    return fingerprints
+
+
+def make_state(archive, output_files, output_format, imputation):
+    return {
+        "raw": {member: raw_data.fingerprint(member, archive) for member in RAW_MEMBERS},
+        "outputs": {name: str(path) for name, path in output_files.items()},
+        "output_format": output_format,
+        "imputation": imputation,
+        "fingerprints": output_fingerprints(output_files),
+    }
+
+
+def full_rebuild_reason(snapshot, output_files, output_format, imputation):
+    """
+    :return: string, why the outputs can't be updated from the snapshot, None if they can
+    """
+    if snapshot is None:
+        return "there is no snapshot of a previous run"
+    state = snapshot.state
+    if state["outputs"] != {name: str(path) for name, path in output_files.items()}:
+        return "the previous run wrote other output files"
+    if (state["output_format"], state["imputation"]) != (output_format, imputation):
+        return "the previous run had another output format or imputation strategy"
+    if state["fingerprints"] != output_fingerprints(output_files):
+        return "the outputs changed since the previous run"
+    return None
+
+
+def _previous(old_keys, new_keys, column):
+    """
+    :return: numpy array, the value in column of the snapshot of every new key, nan if the key is new
+    """
+    positions = key_index(old_keys).get_indexer(key_index(new_keys))
+    values = old_keys[column].values[np.maximum(positions, 0)].astype(np.float64)
+    return np.where(positions >= 0, values, np.nan)
+
+
+def changed_keys(old_keys, new_keys):
+    """
+    :param old_keys: pd dataframe, key_table of the snapshot
+    :param new_keys: pd dataframe, key_table of the new release
+    :return: pd MultiIndex, the keys whose suicide rows are new, changed or removed
+    """
+    old_index, new_index = key_index(old_keys), key_index(new_keys)
+    positions = old_index.get_indexer(new_index)
+    same_rows = (positions >= 0) & (old_keys["rows_hash"].values[np.maximum(positions, 0)] ==
+                                    new_keys["rows_hash"].values)
+    return new_index[~same_rows].append(old_index.difference(new_index))
+
+
+def diff_keys(old_keys, new_keys, changed, imputation, age_stats_changed):
+    """
+    :param old_keys: pd dataframe, key_table of the snapshot
+    :param new_keys: pd dataframe, key_table of the new release
+    :param changed: pd MultiIndex, see changed_keys
+    :param imputation: string, one of impute.STRATEGIES
+    :param age_stats_changed: bool, whether the age group statistics changed
+    :return: Change
+    """
+    new_index = key_index(new_keys)
+    old_total, new_total = _previous(old_keys, new_keys, "total_population"), new_keys["total_population"].values
+    same_total = (old_total == new_total) | (np.isnan(old_total) & np.isnan(new_total))
+    imputed = new_keys["imputed"].values
+
+    refreshed = new_index.isin(changed) | (imputed & ~same_total) | (imputed & age_stats_changed)
+    removed = changed[~changed.isin(new_index)]
+    if imputation == "interpolated":
+        countries = set(new_keys["country"][refreshed]) | set(removed.get_level_values("country"))
+        refreshed |= new_keys["country"].isin(countries).values
+    return Change(refreshed=new_index[refreshed], removed=removed, age_stats_changed=age_stats_changed)
+
+
+def update_age_stats(snapshot, suicide_df, changed):
+    """
+    Update the age group statistics of the snapshot with the age group fractions of the changed keys
+    :param snapshot: Snapshot
+    :param suicide_df: pd dataframe, the new raw suicide data
+    :param changed: pd MultiIndex, keys whose suicide rows changed or were removed
+    :return: (pd dataframe, age fractions, pd dataframe, sums and counts, pd dataframe, age group statistics, bool,
+        whether the statistics changed)
+    """
+    stale = key_index(snapshot.fractions).isin(changed)
+    old_part = snapshot.fractions[stale]
+    new_part = age_fraction_table(suicide_df[key_index(suicide_df).isin(changed)])
+    fractions = pd.concat([snapshot.fractions[~stale], new_part], ignore_index=True)
+
+    def sort(part):
+        return part.sort_values(KEY_COLUMNS + ["age", "sex"]).reset_index(drop=True)
+
+    if len(old_part) == len(new_part) and (len(new_part) == 0 or sort(old_part).equals(sort(new_part))):
+        return fractions, snapshot.sums, snapshot.age_stats, False  # e.g. only suicide numbers were revised
+
+    sums = snapshot.sums.sub(age_sums(old_part), fill_value=0).add(age_sums(new_part), fill_value=0)
+    grouped = (sums["sum"] / sums["count"]).rename("fraction_pop").reset_index()
+    return fractions, sums, pipeline.normalize_age_group_stats(grouped), True
+
+
+def _sorted_rows(data_frame, order):
+    return data_frame.take(order).reset_index(drop=True)
+
+
+def upsert_enriched(old_df, new_rows, new_positions, suicide_df, dropped):
+    """
+    :param old_df: pd dataframe, the enriched data of the previous run
+    :param new_rows: pd dataframe, the recomputed enriched rows
+    :param new_positions: numpy array, the position in suicide_df of every recomputed row
+    :param suicide_df: pd dataframe, the new raw suicide data
+    :param dropped: pd MultiIndex, keys whose rows are recomputed or removed
+    :return: pd dataframe, the enriched data in the row order of suicide_df, like a full run
+    """
+    kept = old_df[~key_index(old_df).isin(dropped)]
+    # a kept key has the same rows, in the same order, as in suicide_df
+    codes, keys = key_index(suicide_df).factorize()
+    order, starts = _group_positions(codes, len(keys))
+    kept_codes = keys.get_indexer(key_index(kept))
+    rank = pd.Series(kept_codes).groupby(kept_codes).cumcount().values
+    positions = np.concatenate([order[starts[kept_codes] + rank], new_positions])
+    combined = pd.concat([kept, new_rows], ignore_index=True, sort=False)
+    return _sorted_rows(combined, np.argsort(positions, kind="stable"))
+
+
+def upsert_rows(old_df, new_rows, dropped, sort_order):
+    """
+    :param old_df: pd dataframe, output of the previous run
+    :param new_rows: pd dataframe, recomputed rows
+    :param dropped: pd MultiIndex, keys whose rows are recomputed or removed
+    :param sort_order: function of a dataframe, returning the positions of its rows in the order of a full run
+    :return: pd dataframe
+    """
+    combined = pd.concat([old_df[~key_index(old_df).isin(dropped)], new_rows], ignore_index=True, sort=False)
+    return _sorted_rows(combined, sort_order(combined))
+
+
+def choropleth_order(data_frame):
+    """
+    The order of the groupby in choropleth_frame: on year, sex and country (categoricals sort like their strings)
+    """
+    return np.lexsort([data_frame[column].astype(str).values for column in ["country", "sex"]] +
+                      [data_frame["year"].values])
+
+
+def year_country_order(data_frame):
+    return reshape.year_country_order(data_frame["year"].values, data_frame["country"].values,
+                                      data_frame["code"].values)
+
+
+def full_run(output_files, output_format, profiler, archive, imputation, force=False, jobs=1,
+             snapshot_dir=SNAPSHOT_DIR):
+    """
+    Run all stages (see pipeline.run_stages) and take a snapshot of what the outputs were made from
+    """
+    state = make_state(archive, output_files, output_format, imputation)  # fingerprints of the raw files first
+    outputs = [(name, output_file, output_format) for name, output_file in output_files.items()]
+    pipeline.run_stages(outputs, pipeline.raw_sources(archive), profiler, force=force, jobs=jobs,
+                        imputation=imputation)
+
+    suicide_df = raw_data.read_raw(raw_data.SUICIDE_MEMBER, archive)
+    df_pop = pipeline.clean_population_stats(raw_data.read_raw(raw_data.POPULATION_MEMBER, archive))
+    fractions = age_fraction_table(suicide_df)
+    # the same statistics as the age_stats stage, which the outputs were made with
+    age_stats = pipeline.get_age_group_stats(pipeline.add_age_group_fractions(suicide_df))
+    state["fingerprints"] = output_fingerprints(output_files)
+    write_snapshot(Snapshot(keys=key_table(suicide_df, df_pop), fractions=fractions, sums=age_sums(fractions),
+                            age_stats=age_stats.astype({"age": str, "sex": str}), state=state), snapshot_dir)
+    logger.info(f"took a snapshot of {len(suicide_df)} rows of suicide data in {snapshot_dir}")
+
+
+def run_delta(output_files, output_format, profiler, archive=raw_data.RAW_ARCHIVE, imputation="global", force=False,
+              jobs=1, snapshot_dir=SNAPSHOT_DIR):
+    """
+    Update the processed datasets with a new release of the raw data, recomputing only the (country, year) keys it
+    changed. Falls back to a full run if the snapshot of the previous run doesn't fit, or with force
+    :param output_files: dictionary, name of output (enriched, meta, choropleth, year_country) -> path
+    :param output_format: string, one of load_dataset.FORMAT_EXTENSIONS
+    :param profiler: StageProfiler, records every call of a stage
+    :param archive: path to the zip archive with the raw data
+    :param imputation: string, how to fill in missing populations, one of impute.STRATEGIES
+    :param force: bool, do a full run and recompute every stage
+    :param jobs: int, number of processes for a full run
+    :param snapshot_dir: directory of the snapshot of the previous run
+    :return: Change, or None after a full run
+    """
+    snapshot = read_snapshot(snapshot_dir)
+    reason = "of --force" if force else full_rebuild_reason(snapshot, output_files, output_format, imputation)
+    if reason is not None:
+        logger.info(f"doing a full run, because {reason}")
+        full_run(output_files, output_format, profiler, archive, imputation, force, jobs, snapshot_dir)
+        return None
+
+    state = make_state(archive, output_files, output_format, imputation)
+    if state["raw"] == snapshot.state["raw"]:
+        logger.info("the raw data did not change since the previous run, nothing to do")
+        return Change(refreshed=key_index(snapshot.keys[:0]), removed=key_index(snapshot.keys[:0]),
+                      age_stats_changed=False)
+
+    read_raw = profiler.wrap("read_raw", raw_data.read_raw)
+    suicide_df = read_raw(raw_data.SUICIDE_MEMBER, archive)
+    df_pop = profiler.call("population", pipeline.clean_population_stats,
+                           [read_raw(raw_data.POPULATION_MEMBER, archive)])
+    new_keys = key_table(suicide_df, df_pop)
+
+    changed = changed_keys(snapshot.keys, new_keys)
+    fractions, sums, age_stats, age_stats_changed = profiler.call("age_stats", update_age_stats,
+                                                                  [snapshot, suicide_df, changed])
+    change = diff_keys(snapshot.keys, new_keys, changed, imputation, age_stats_changed)
+    logger.info(f"recomputing {len(change.refreshed)} and removing {len(change.removed)} of {len(new_keys)} "
+                f"(country, year) keys" + (", the age group statistics changed" if age_stats_changed else ""))
+
+    rows = suicide_df[key_index(suicide_df).isin(change.refreshed)]
+    enriched_df = choropleth_df = year_country_df = None  # pd.concat leaves out the Nones
+    if len(rows) > 0:
+        enrich = profiler.wrap("enriched", pipeline.IMPUTERS[imputation], pipeline.IMPUTED_COLUMNS["enriched"])
+        enriched_df = enrich(rows, df_pop, age_stats)
+        choropleth_df = profiler.call("choropleth", reshape.choropleth_frame, [enriched_df])
+    if choropleth_df is not None and len(choropleth_df) > 0:
+        year_country_df = profiler.call("year_country", pipeline.year_country_with_intervals, [choropleth_df])
+
+    dropped = change.refreshed.append(change.removed)
+    updates = {
+        "enriched": lambda old: upsert_enriched(old, enriched_df, rows.index.values, suicide_df, dropped),
+        "choropleth": lambda old: upsert_rows(old, choropleth_df, dropped, choropleth_order),
+        "year_country": lambda old: upsert_rows(old, year_country_df, dropped, year_country_order),
+    }
+    for name in DELTA_OUTPUTS:
+        updated = updates[name](load_dataset.read_dataset(output_files[name]))
+        load_dataset.save_dataset(updated, output_files[name], output_format)
+        logger.info(f"saved {len(updated)} rows of {name} data to {output_files[name]}")
+    if state["raw"][raw_data.META_DATA_MEMBER] != snapshot.state["raw"][raw_data.META_DATA_MEMBER]:
+        meta = profiler.call("meta", pipeline.clean_meta_data, [read_raw(raw_data.META_DATA_MEMBER, archive)])
+        load_dataset.save_dataset(meta, output_files["meta"], output_format)
+
+    state["fingerprints"] = output_fingerprints(output_files)
+    write_snapshot(Snapshot(keys=new_keys, fractions=fractions, sums=sums, age_stats=age_stats, state=state),
+                   snapshot_dir)
+    return change
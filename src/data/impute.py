@@ -0,0 +1,181 @@
+"""
+Fill in missing populations of the suicide data, the kernel behind the enriched stage. Same output as
+fill_in_missing_populations in pipeline.py (which we keep to test against), but without its two merges on string keys
+that build a wide frame for all rows only to fill in a minority of them. The keys are encoded to integer codes once
+(only the categories of the categorical columns are looked up, not every row), the total populations and age group
+fractions are put in small dense arrays indexed by those codes, and only the rows with a missing population are
+looked up and written.
+
+There are two ways to get the fraction of the population of a country that is in an age-sex group:
+
+- global: the average fraction over all countries and years (get_age_group_stats), as in the readme
+- interpolated: the fraction in the same country, interpolated linearly between the nearest years before and after
+  with a complete age distribution (the nearest year, if there only is one on one side). Countries without any year
+  with a complete age distribution fall back to the global average.
+
+Both take time linear in the number of rows.
+"""
+import numpy as np
+import pandas as pd
+
+STRATEGIES = ("global", "interpolated")
+
+
+def encode(values, labels):
+    """
+    :param values: pd Series, categorical or not
+    :param labels: pd Index of unique labels
+    :return: numpy array of int64, the position of every value in labels, -1 where it is not in labels (or missing)
+    """
+    if values.dtype.name == "category":
+        codes, uniques = values.cat.codes.values, values.cat.categories
+    else:
+        codes, uniques = pd.factorize(values)
+    positions = labels.get_indexer(uniques)
+    return np.where(codes >= 0, positions[codes], -1).astype(np.int64)
+
+
+def encode_years(years, first_year, n_years):
+    """
+    :param years: numpy array of (whole) years, as int or float
+    :param first_year: int, year of position 0
+    :param n_years: int, number of positions
+    :return: numpy array of int64, the position of every year, -1 where it is out of range (or missing)
+    """
+    with np.errstate(invalid="ignore"):
+        positions = np.where(np.isfinite(years), years - first_year, -1).astype(np.int64)
+    return np.where((positions >= 0) & (positions < n_years), positions, -1)
+
+
+def total_population_lookup(df_population, countries, years):
+    """
+    :param df_population: pd dataframe with columns country, year and total_population, one row per country and year
+    :param countries: pd Series, countries to look up
+    :param years: numpy array, years to look up
+    :return: numpy array of floats, total population of every (country, year), nan where unknown
+    """
+    country_codes, labels = pd.factorize(df_population["country"])
+    pop_years = df_population["year"].values
+    first_year = int(np.nanmin(pop_years))
+    n_years = int(np.nanmax(pop_years)) - first_year + 1
+    grid = np.full((len(labels), n_years), np.nan)
+    year_codes = encode_years(pop_years, first_year, n_years)
+    known = (country_codes >= 0) & (year_codes >= 0)
+    grid[country_codes[known], year_codes[known]] = df_population["total_population"].values[known]
+
+    country = encode(countries, pd.Index(labels))
+    year = encode_years(years, first_year, n_years)
+    found = (country >= 0) & (year >= 0)
+    return np.where(found, grid[np.maximum(country, 0), np.maximum(year, 0)], np.nan)
+
+
+def group_codes(sexes, ages, df_age_statistics):
+    """
+    :param sexes: pd Series, sex of every row
+    :param ages: pd Series, age group of every row
+    :param df_age_statistics: pd dataframe with columns sex, age and fraction_pop, one row per age-sex group
+    :return: (numpy array, the age-sex group of every row, -1 if unknown, numpy array, fraction_pop of every group)
+    """
+    sex_labels = pd.Index(np.asarray(pd.unique(df_age_statistics["sex"])))
+    age_labels = pd.Index(np.asarray(pd.unique(df_age_statistics["age"])))
+    fractions = np.full(len(sex_labels) * len(age_labels), np.nan)
+    stats_groups = encode(df_age_statistics["sex"], sex_labels) * len(age_labels) + \
+        encode(df_age_statistics["age"], age_labels)
+    fractions[stats_groups] = df_age_statistics["fraction_pop"].values
+
+    sex, age = encode(sexes, sex_labels), encode(ages, age_labels)
+    return np.where((sex >= 0) & (age >= 0), sex * len(age_labels) + age, -1), fractions
+
+
+def interpolated_fractions(data_frame, group, n_groups, rows):
+    """
+    Age-sex fractions from the age distribution of the same country in the nearest years with a complete one
+    :param data_frame: pd dataframe with columns country, year and population
+    :param group: numpy array, the age-sex group of every row, see group_codes
+    :param n_groups: int, number of age-sex groups
+    :param rows: numpy array of positions of the rows to get the fraction of
+    :return: numpy array of floats, fraction of every row in rows, nan where the country has no complete age
+        distribution in any year
+    """
+    country, _ = pd.factorize(data_frame["country"])
+    years = data_frame["year"].values
+    first_year = int(np.nanmin(years))
+    n_years = int(np.nanmax(years)) - first_year + 1
+    year = encode_years(years, first_year, n_years)
+    n_countries = int(country.max()) + 1
+    cell = np.where((country >= 0) & (year >= 0), country * n_years + year, -1)
+
+    # the age distribution of every (country, year) with a known population for every age-sex group
+    population = data_frame["population"].values.astype(np.float64)
+    valid = (cell >= 0) & (group >= 0)
+    known = valid & ~np.isnan(population)
+    totals = np.bincount(cell[known], weights=population[known], minlength=n_countries * n_years)
+    counts_known = np.bincount(cell[known], minlength=n_countries * n_years)
+    counts_rows = np.bincount(cell[valid], minlength=n_countries * n_years)
+    complete = (counts_known == n_groups) & (counts_rows == n_groups) & (totals > 0)
+    distribution = np.full((n_countries * n_years, n_groups), np.nan)
+    in_complete = known & complete[np.maximum(cell, 0)]
+    distribution[cell[in_complete], group[in_complete]] = population[in_complete] / totals[cell[in_complete]]
+
+    # the nearest complete year at or before and at or after every year, per country
+    complete = complete.reshape(n_countries, n_years)
+    positions = np.arange(n_years)
+    before = np.maximum.accumulate(np.where(complete, positions, -1), axis=1)
+    after = np.minimum.accumulate(np.where(complete, positions, n_years)[:, ::-1], axis=1)[:, ::-1]
+
+    row_country, row_year, row_group = country[rows], year[rows], group[rows]
+    usable = (row_country >= 0) & (row_year >= 0) & (row_group >= 0)
+    row_country, row_year = np.maximum(row_country, 0), np.maximum(row_year, 0)
+    previous, following = before[row_country, row_year], after[row_country, row_year]
+    has_previous, has_following = previous >= 0, following < n_years
+    previous_fraction = distribution[row_country * n_years + np.maximum(previous, 0), row_group]
+    following_fraction = distribution[row_country * n_years + np.minimum(following, n_years - 1), row_group]
+    span = np.where(has_previous & has_following, following - previous, 1)
+    weight = np.where(span > 0, (row_year - previous) / np.maximum(span, 1), 0.)
+    fractions = np.where(has_previous & has_following, previous_fraction + (following_fraction - previous_fraction) *
+                         weight, np.where(has_previous, previous_fraction, following_fraction))
+    return np.where(usable & (has_previous | has_following), fractions, np.nan)
+
+
+def imputed_population(suicide_df, df_population, df_age_statistics, strategy="global"):
+    """
+    The population column of the suicide data, with missing populations filled in with the total population of the
+    country in that year times the fraction of the population in the age-sex group
+    :param suicide_df: pd dataframe, WHO suicide statistics
+    :param df_population: pd dataframe with population statistics per country per year
+    :param df_age_statistics: pd dataframe, relative population size (out of total) in a set of age groups
+    :param strategy: string, one of STRATEGIES, how to get the fraction of the population in an age-sex group
+    :return: numpy array of floats, the population of every row
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f"unknown imputation strategy {strategy}, choose from {STRATEGIES}")
+    population = suicide_df["population"].values.astype(np.float64)
+    missing = np.flatnonzero(np.isnan(population))
+
+    def missing_rows(column):
+        return suicide_df[column].iloc[missing]
+
+    group, global_fractions = group_codes(missing_rows("sex"), missing_rows("age"), df_age_statistics)
+    fractions = np.where(group >= 0, global_fractions[np.maximum(group, 0)], np.nan)
+    if strategy == "interpolated":
+        all_groups, _ = group_codes(suicide_df["sex"], suicide_df["age"], df_age_statistics)
+        interpolated = interpolated_fractions(suicide_df, all_groups, len(global_fractions), missing)
+        fractions = np.where(np.isnan(interpolated), fractions, interpolated)
+
+    totals = total_population_lookup(df_population, missing_rows("country"), missing_rows("year").values)
+    population[missing] = fractions * totals  # population is a copy, astype copies
+    return population
+
+
+def impute_populations(suicide_df, df_population, df_age_statistics, strategy="global"):
+    """
+    Fill in missing populations, see imputed_population
+    :return: pd dataframe, the suicide data with missing population values imputed
+    """
+    columns = {"population": imputed_population(suicide_df, df_population, df_age_statistics, strategy)}
+    for keys, other in [(["sex", "age"], df_age_statistics), (["country"], df_population)]:
+        for key in keys:
+            # like after a merge: a categorical key becomes a column of objects if the other frame has another dtype
+            if suicide_df[key].dtype.name == "category" and suicide_df[key].dtype != other[key].dtype:
+                columns[key] = suicide_df[key].astype(object)
+    return suicide_df.assign(**columns).reset_index(drop=True)
@@ -0,0 +1,150 @@
+"""
+Instrumentation of pipeline stages. A StageProfiler wraps the functions of the stages and records, for every call,
+the wall and CPU time, the growth of the peak resident memory (and optionally the peak traced python memory), the
+number of input and output rows and the number of nulls imputed. The records can be summarised per stage as a table,
+written to json or csv, and every stage can be run under cProfile to find out where inside it the time goes.
+"""
+import cProfile
+import functools
+import json
+import time
+import tracemalloc
+from pathlib import Path
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+PROFILE_COLUMNS = ["stage", "calls", "wall_s", "cpu_s", "rss_delta_mb", "traced_peak_mb", "rows_in", "rows_out",
+                   "nulls_imputed"]
+
+
+def _max_rss_mb():
+    """
+    :return: float, peak resident memory of this process so far in MB, None if we can't tell
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on linux (and in bytes on macos, where this overestimates)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _rows(value):
+    """
+    :return: int, number of rows of value if it is a dataframe or series, otherwise 0
+    """
+    return len(value) if isinstance(value, (pd.DataFrame, pd.Series)) else 0
+
+
+def _nulls(value, column):
+    if isinstance(value, pd.DataFrame) and column in value:
+        return int(value[column].isnull().sum())
+    return 0
+
+
+class StageProfiler:
+    """
+    Collects a record for every call of the functions it wraps
+    """
+
+    def __init__(self, trace_memory=False, cprofile_dir=None):
+        """
+        :param trace_memory: bool, also record the peak memory allocated by python (tracemalloc). This is more
+            precise than the resident memory, but makes the stages a few times slower
+        :param cprofile_dir: directory to write a cProfile dump <stage>.prof of every stage to (covering all calls of the
+            stage), None for no dumps
+        """
+        self.trace_memory = trace_memory
+        self.cprofile_dir = None if cprofile_dir is None else Path(cprofile_dir)
+        self.records = []
+        self._profiles = {}  # stage name -> cProfile.Profile, accumulating over all calls of the stage
+
+    def wrap(self, name, func, imputed_column=None):
+        """
+        :param name: string, name of the stage
+        :param func: function to instrument
+        :param imputed_column: name of a column in which func fills in missing values. The number of imputed nulls is
+            the number of nulls in that column of the first input minus the number in the output
+        :return: function, calls func and records its resource usage
+        """
+        @functools.wraps(func)
+        def instrumented(*args, **kwargs):
+            return self.call(name, func, args, kwargs, imputed_column)
+
+        return instrumented
+
+    def call(self, name, func, args=(), kwargs=None, imputed_column=None):
+        """
+        Call func(*args, **kwargs) and record its resource usage under the name of a stage
+        :return: the output of func
+        """
+        kwargs = kwargs or {}
+        trace_memory = self.trace_memory and not tracemalloc.is_tracing()  # don't interfere with someone else's trace
+        if trace_memory:
+            tracemalloc.start()
+        profile = None
+        if self.cprofile_dir is not None:
+            profile = self._profiles.setdefault(name, cProfile.Profile())
+
+        rss_before = _max_rss_mb()
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            result = profile.runcall(func, *args, **kwargs) if profile is not None else func(*args, **kwargs)
+        finally:
+            wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+            traced_peak = None
+            if trace_memory:
+                traced_peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+                tracemalloc.stop()
+        rss_after = _max_rss_mb()
+
+        if profile is not None:
+            self.cprofile_dir.mkdir(parents=True, exist_ok=True)
+            profile.dump_stats(str(self.cprofile_dir / f"{name}.prof"))
+
+        self.records.append({
+            "stage": name,
+            "wall_s": wall,
+            "cpu_s": cpu,
+            "rss_delta_mb": None if rss_before is None else rss_after - rss_before,
+            "traced_peak_mb": traced_peak,
+            "rows_in": sum(_rows(arg) for arg in args),
+            "rows_out": _rows(result),
+            "nulls_imputed": (_nulls(args[0], imputed_column) - _nulls(result, imputed_column)
+                              if imputed_column is not None and args else 0),
+        })
+        return result
+
+    def summary(self):
+        """
+        :return: pd dataframe with one row per stage (in the order they first ran), summing times, rows and imputed
+            nulls over all calls of the stage, and taking the maximum of the memory figures
+        """
+        if not self.records:
+            return pd.DataFrame(columns=PROFILE_COLUMNS)
+        records = pd.DataFrame(self.records)
+        grouped = records.groupby("stage", sort=False)
+        summary = grouped[["wall_s", "cpu_s", "rows_in", "rows_out", "nulls_imputed"]].sum()
+        summary["calls"] = grouped.size()
+        summary["rss_delta_mb"] = grouped["rss_delta_mb"].max()
+        summary["traced_peak_mb"] = grouped["traced_peak_mb"].max()
+        return summary.reset_index()[PROFILE_COLUMNS]
+
+    def write(self, path):
+        """
+        Write the summary to a json or csv file, depending on the extension of path
+        :param path: path of the output file, ending in .json or .csv
+        """
+        path = Path(path)
+        summary = self.summary()
+        if path.suffix == ".json":
+            rows = json.loads(summary.to_json(orient="records"))  # takes care of numpy types and nans
+            with open(path, "w") as f:
+                json.dump({"stages": rows, "calls": self.records}, f, indent=1)
+        elif path.suffix == ".csv":
+            summary.to_csv(path, index=False)
+        else:
+            raise ValueError(f"profile output must be a .json or .csv file, not {path}")
@@ -0,0 +1,200 @@
+"""
+Lean versions of the stages that handle the full suicide data (the age fractions and statistics, the enriched data and
+the choropleth data), for data sets that barely fit in memory. They give the same numbers as the stages in pipeline.py
+(up to the last few bits of the sums and means, as pandas may sum the groups in another way, e.g. pandas >= 1.3 with
+compensated summation), but:
+
+- they don't copy the data defensively: the enriched data is a shallow copy of the suicide data with a new population
+  column, and only the columns that are needed are copied, of the rows that are needed, instead of dropna copying all
+- sums per group (the total population of every country-year, the age group fractions, the choropleth data) are
+  np.bincounts over an integer group number, instead of a groupby (and a merge to get the sums back to the rows)
+- the enriched data keeps its categorical keys (a merge would turn the country into a column of python strings) and
+  its numeric columns are downcast where no value changes
+
+Together with a StageGraph that lets go of every output once the stages that need it have run (see run_stages with
+lean=True), this keeps the peak memory of the pipeline a small multiple of the size of the suicide data.
+"""
+import numpy as np
+import pandas as pd
+
+from src.data import impute, pipeline, reshape
+from src.data.validation import validate
+
+
+def replace_column(data_frame, column, values):
+    """
+    Replace a column in place, by deleting it and inserting the new values at the same position. Assigning to an
+    existing column writes into the array that holds it when the dtype allows, which would also change the frame a
+    shallow copy was made from.
+    :param data_frame: pd dataframe
+    :param column: name of a column of data_frame
+    :param values: numpy array or pd Series, the new values
+    """
+    position = data_frame.columns.get_loc(column)
+    del data_frame[column]
+    data_frame.insert(position, column, values)
+
+
+def downcast(data_frame, columns=None):
+    """
+    Downcast numeric columns in place where no value changes: integers to the smallest integer type that holds them,
+    and floats to float32 if every value is exactly a float32
+    :param data_frame: pd dataframe
+    :param columns: list of columns to downcast, None for all of them
+    :return: data_frame
+    """
+    for column in data_frame.columns if columns is None else columns:
+        values = data_frame[column].values
+        if not isinstance(values, np.ndarray):
+            continue  # categoricals and other extension arrays
+        if values.dtype.kind in "iu":
+            smaller = pd.to_numeric(values, downcast="integer" if values.dtype.kind == "i" else "unsigned")
+        elif values.dtype == np.float64:
+            with np.errstate(over="ignore", invalid="ignore"):
+                smaller = values.astype(np.float32)
+                if not ((smaller == values) | np.isnan(values)).all():
+                    continue
+        else:
+            continue
+        if smaller.dtype != values.dtype:
+            replace_column(data_frame, column, smaller)
+    return data_frame
+
+
+def group_codes(values):
+    """
+    :param values: numpy array or pd Categorical, the values of a groupby key (without missing values)
+    :return: (numpy array of ints, position of the value of every row in uniques, uniques), with the uniques in the
+        order a groupby sorts them. Some uniques may not occur
+    """
+    if isinstance(values, pd.Categorical):
+        return values.codes, values.categories
+    if values.dtype.kind in "iu" and len(values) and int(values.max()) - int(values.min()) <= len(values):
+        low = values.min()
+        return values - low, np.arange(low, values.max() + 1)
+    return pd.factorize(values, sort=True)
+
+
+def group_index(columns):
+    """
+    Number the groups of a groupby on some columns, like the groupby sorts them
+    :param columns: list of numpy arrays or pd Categoricals, the keys
+    :return: (numpy array of int64, the group of every row, list of the uniques of every key, list of their lengths)
+    """
+    index, all_uniques, sizes = np.zeros(len(columns[0]), dtype=np.int64), [], []
+    for values in columns:
+        codes, uniques = group_codes(values)
+        index *= len(uniques)
+        index += codes
+        all_uniques.append(uniques)
+        sizes.append(len(uniques))
+    return index, all_uniques, sizes
+
+
+def key_values(values, codes, uniques):
+    """
+    :param values: numpy array or pd Categorical, the values of a groupby key
+    :param codes: numpy array of ints, positions in uniques
+    :param uniques: the uniques of the key, from group_codes
+    :return: numpy array or pd Categorical (with the categories of values), the key of every code
+    """
+    if isinstance(values, pd.Categorical):
+        return pd.Categorical.from_codes(codes, dtype=values.dtype)
+    return np.asarray(uniques)[codes]
+
+
+def add_age_group_fractions(data_frame):
+    """
+    Same as pipeline.add_age_group_fractions, but with the total population of every country-year summed with
+    np.bincount instead of merged in, and with only the keys and fraction_pop columns: the population columns are
+    checked and then dropped, as the age group statistics don't need them. The fractions can differ from the ones of
+    pipeline.add_age_group_fractions in the last few bits, as the totals may be summed in a different way.
+    :param data_frame: pd dataframe, the suicide data
+    :return: pd dataframe with the rows with a population, and country, year, sex, age and fraction_pop columns
+    """
+    validate(data_frame, pipeline.SUICIDE_CHECKS, name="suicides")
+
+    known = data_frame["population"].notnull().values
+    df = pd.DataFrame({column: data_frame[column].values[known] for column in ["country", "year", "sex", "age"]})
+    validate(df, pipeline.POPULATION_GROUP_CHECKS, name="suicides with population")
+
+    population = data_frame["population"].values[known]
+    usable = (df["country"].notnull() & df["year"].notnull()).values  # rows with a missing key get no total
+    index, _, sizes = group_index([df[column].values[usable] for column in ["country", "year"]])
+    totals = np.full(len(usable), np.nan)
+    totals[usable] = np.bincount(index, weights=population[usable], minlength=int(np.prod(sizes)))[index]
+    del index
+    fractions = pd.DataFrame({"total_population": totals, "fraction_pop": population / totals})
+    del totals, population
+    validate(fractions, pipeline.AGE_FRACTION_CHECKS, name="age fractions")
+
+    df["fraction_pop"] = fractions["fraction_pop"].values
+    return df
+
+
+def get_age_group_stats(data_frame):
+    """
+    Same as pipeline.get_age_group_stats, with the mean population fraction of every age-sex group summed with
+    np.bincount. Results can differ from the ones of pipeline.get_age_group_stats in the last few bits, as the
+    fractions may be summed in a different way.
+    :param data_frame: pd dataframe, the age fractions
+    :return: pandas dataframe of length 12
+    """
+    validate(data_frame, pipeline.AGE_STATS_INPUT_CHECKS, name="age fractions")
+
+    keys = ["age", "sex"]
+    index, uniques, sizes = group_index([data_frame[column].values for column in keys])
+    counts = np.bincount(index, minlength=int(np.prod(sizes)))
+    sums = np.bincount(index, weights=data_frame["fraction_pop"].values, minlength=len(counts))
+    groups = np.flatnonzero(counts)
+    grouped = pd.DataFrame({column: key_values(data_frame[column].values, codes, column_uniques)
+                            for column, codes, column_uniques in zip(keys, np.unravel_index(groups, sizes), uniques)})
+    grouped["fraction_pop"] = sums[groups] / counts[groups]
+    return pipeline.normalize_age_group_stats(grouped)
+
+
+def impute_populations(suicide_df, df_population, df_age_statistics, strategy="global"):
+    """
+    Same as impute.impute_populations, without copying the suicide data and keeping its categorical keys
+    :return: pd dataframe, the suicide data with missing population values imputed, downcast
+    """
+    population = impute.imputed_population(suicide_df, df_population, df_age_statistics, strategy)
+    enriched = suicide_df.copy(deep=False)
+    replace_column(enriched, "population", population)
+    enriched.reset_index(drop=True, inplace=True)
+    return downcast(enriched)
+
+
+def impute_missing_populations(suicide_df, df_population, df_age_statistics):
+    return impute_populations(suicide_df, df_population, df_age_statistics, strategy="global")
+
+
+def impute_missing_populations_interpolated(suicide_df, df_population, df_age_statistics):
+    return impute_populations(suicide_df, df_population, df_age_statistics, strategy="interpolated")
+
+
+def choropleth_frame(enriched_df):
+    """
+    Same as reshape.choropleth_frame, but without copying the complete rows first: the suicides and populations are
+    summed per year, sex and country with np.bincount (the rates can differ in the last few bits)
+    :param enriched_df: pd dataframe, our enriched data
+    :return: pd dataframe
+    """
+    complete = np.ones(len(enriched_df), dtype=bool)
+    for column in enriched_df.columns:
+        complete &= enriched_df[column].notnull().values
+    keys = ["year", "sex", "country"]
+    index, uniques, sizes = group_index([enriched_df[column].values[complete] for column in keys])
+    n_groups = int(np.prod(sizes))
+    groups = np.flatnonzero(np.bincount(index, minlength=n_groups))
+
+    columns = {column: key_values(enriched_df[column].values, codes, column_uniques)
+               for column, codes, column_uniques in zip(keys, np.unravel_index(groups, sizes), uniques)}
+    for column in ["suicides_no", "population"]:
+        values = enriched_df[column].values
+        sums = np.bincount(index, weights=values[complete], minlength=n_groups)[groups]
+        columns[column] = sums.astype(values.dtype)
+    return reshape.choropleth_rates(pd.DataFrame(columns))
+
+
+IMPUTERS = {"global": impute_missing_populations, "interpolated": impute_missing_populations_interpolated}
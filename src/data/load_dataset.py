@@ -0,0 +1,173 @@
+"""
+Save and load the processed datasets created by make_dataset.py. Besides csv we support two columnar formats (through
+pyarrow): feather (Arrow IPC) and parquet. Both keep the dtypes of the dataframe (categoricals, float32, ..) so that
+consumers don't have to redo type inference, and both can be read memory-mapped and for a subset of the columns only.
+Feather files are written uncompressed, which makes memory-mapped reads of them nearly free.
+
+make_dataset.py can also write the datasets partitioned by year (and region) into a directory of parquet files, see
+hive.py. load_dataset reads those too, and then only reads the partitions a filter needs.
+"""
+import logging
+from pathlib import Path
+
+import pandas as pd
+
+PROCESSED_DIR = "./data/processed"
+
+# name of a processed dataset -> file name (without extension) in the processed data directory
+DATASETS = {
+    "enriched": "enriched_df",
+    "meta": "cleaned_meta",
+    "choropleth": "choropleth_df",
+    "year_country": "year_country_data",
+}
+FORMAT_EXTENSIONS = {"feather": ".feather", "parquet": ".parquet", "csv": ".csv"}
+COLUMNAR_FORMATS = ["feather", "parquet"]
+
+logger = logging.getLogger(__name__)
+
+
+def compact_dtypes(data_frame):
+    """
+    Store string columns as categoricals, which is a lot more compact for our repetitive country, sex and age columns
+    :param data_frame: pd dataframe
+    :return: pd dataframe with object columns converted to categoricals
+    """
+    object_columns = data_frame.columns[data_frame.dtypes == object]
+    if len(object_columns) == 0:
+        return data_frame
+    data_frame = data_frame.copy()
+    for column in object_columns:
+        data_frame[column] = data_frame[column].astype("category")
+    return data_frame
+
+
+def dataset_path(name, output_format, processed_dir=PROCESSED_DIR):
+    """
+    :param name: string, name of a processed dataset (a key of DATASETS)
+    :param output_format: string, one of FORMAT_EXTENSIONS
+    :param processed_dir: directory with the processed data
+    :return: Path of the dataset in the given format
+    """
+    return Path(processed_dir) / (DATASETS[name] + FORMAT_EXTENSIONS[output_format])
+
+
+def partitioned_path(name, processed_dir=PROCESSED_DIR):
+    """
+    :param name: string, name of a processed dataset (a key of DATASETS)
+    :param processed_dir: directory with the processed data
+    :return: Path of the directory of the partitioned version of the dataset, see hive.py
+    """
+    return Path(processed_dir) / DATASETS[name]
+
+
+def save_dataset(data_frame, path, output_format):
+    """
+    Save a processed dataframe. The index is not saved (our processed dataframes all have a meaningless range index)
+    :param data_frame: pd dataframe
+    :param path: path to save to
+    :param output_format: string, "feather", "parquet" or "csv"
+    """
+    if output_format == "csv":
+        data_frame.to_csv(path, index=False)
+        return
+
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(compact_dtypes(data_frame), preserve_index=False)
+    if output_format == "feather":
+        from pyarrow import feather
+        feather.write_feather(table, str(path), compression="uncompressed")
+    elif output_format == "parquet":
+        from pyarrow import parquet
+        parquet.write_table(table, str(path))
+    else:
+        raise ValueError(f"unknown output format {output_format}, choose from {list(FORMAT_EXTENSIONS)}")
+
+
+def read_dataset(path, columns=None, memory_map=True):
+    """
+    Read a processed dataframe from a file, the format is inferred from the file extension
+    :param path: path of a .feather, .parquet or .csv file
+    :param columns: list of column names to read, None to read all columns
+    :param memory_map: bool, whether to memory-map feather/parquet files instead of reading them into memory first
+    :return: pd dataframe
+    """
+    suffix = Path(path).suffix
+    if suffix == ".feather":
+        from pyarrow import feather
+        table = feather.read_table(str(path), columns=columns, memory_map=memory_map)
+    elif suffix == ".parquet":
+        from pyarrow import parquet
+        table = parquet.read_table(str(path), columns=columns, memory_map=memory_map)
+    elif suffix == ".csv":
+        return pd.read_csv(path, usecols=columns, float_precision="round_trip")  # exactly the floats that were saved
+    else:
+        raise ValueError(f"don't know how to read {path}, expected one of {list(FORMAT_EXTENSIONS.values())}")
+    return table.to_pandas()
+
+
+def dataset_source(name, processed_dir=PROCESSED_DIR):
+    """
+    The file load_dataset reads a processed dataset from: the most recently written columnar file, where the partitioned
+    version of the dataset counts as its partitioning file, or else the csv export. Its modification time is that of
+    the data load_dataset returns, e.g. to tell whether something built from the dataset is out of date.
+    :param name: string, name of a processed dataset (a key of DATASETS)
+    :param processed_dir: directory with the processed data
+    :return: Path, None if there is no processed version of the dataset
+    """
+    from src.data import hive
+
+    # the most recently written columnar file, in case the pipeline was run with different formats
+    columnar_paths = [dataset_path(name, output_format, processed_dir) for output_format in COLUMNAR_FORMATS]
+    columnar_paths.append(partitioned_path(name, processed_dir) / hive.PARTITIONING_FILE)
+    columnar_paths = [path for path in columnar_paths if path.is_file()]
+    if columnar_paths:
+        return max(columnar_paths, key=lambda path: path.stat().st_mtime)
+    path = dataset_path(name, "csv", processed_dir)
+    return path if path.is_file() else None
+
+
+def load_dataset(name, columns=None, memory_map=True, processed_dir=PROCESSED_DIR, filters=None):
+    """
+    Load one of the processed datasets, e.g. load_dataset("year_country", columns=["year", "code", "overall_rate"]).
+    A columnar version of the dataset is used if there is one, the csv export is only read as a last resort.
+    :param name: string, name of a processed dataset (a key of DATASETS)
+    :param columns: list of column names to read, None to read all columns
+    :param memory_map: bool, whether to memory-map the file
+    :param processed_dir: directory with the processed data
+    :param filters: only the rows for which these hold, e.g. [("year", ">=", 2010)], see hive.py. Of a partitioned
+        dataset only the partitions and row groups that can have such rows are read
+    :return: pd dataframe
+    """
+    if name not in DATASETS:
+        raise KeyError(f"unknown dataset {name}, choose from {list(DATASETS)}")
+
+    from src.data import hive
+
+    path = dataset_source(name, processed_dir)
+    if path is None:
+        raise FileNotFoundError(f"no processed {name} dataset in {processed_dir}, run make_dataset.py first")
+    if path.name == hive.PARTITIONING_FILE:
+        return hive.read_partitioned(path.parent, columns=columns, filters=filters)
+    if path.suffix != FORMAT_EXTENSIONS["csv"]:
+        return _read_filtered(path, columns, filters, memory_map)
+
+    logger.warning(f"only found the csv export of {name}, dtypes will be inferred. Run make_dataset.py with "
+                   f"--output-format feather or parquet to speed this up")
+    return _read_filtered(path, columns, filters)
+
+
+def _read_filtered(path, columns, filters, memory_map=True):
+    """
+    read_dataset, keeping only the rows for which the filters hold
+    """
+    if not filters:
+        return read_dataset(path, columns=columns, memory_map=memory_map)
+    from src.data import hive
+
+    to_read = None if columns is None else list(dict.fromkeys(list(columns) +
+                                                              hive.filter_columns(hive.normalize_filters(filters))))
+    data_frame = read_dataset(path, columns=to_read, memory_map=memory_map)
+    data_frame = data_frame[hive.filter_mask(data_frame, filters)].reset_index(drop=True)
+    return data_frame if columns is None else data_frame[list(columns)]
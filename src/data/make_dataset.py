@@ -1,246 +1,254 @@
 # useful tutorial on click: https://www.youtube.com/watch?v=kNke39OZ2k0&feature=youtu.be
 
 # -*- coding: utf-8 -*-
+"""
+Command line interface of the data pipeline, with a subcommand per stage:
 
+    python src/data/make_dataset.py all                     # everything, from data/raw to data/processed
+    python src/data/make_dataset.py enrich --output enriched.feather
+    python src/data/make_dataset.py choropleth --input enriched.feather --output choropleth.feather
+
+The stages themselves are in pipeline.py. It is only imported (and with it pandas, numpy and pycountry) once a stage
+runs, so that --help and the argument checks are instant. Keep the imports at the top of this module light.
+"""
 import click
 import logging
-from pathlib import Path
-from dotenv import find_dotenv, load_dotenv
-import pandas as pd
-import numpy as np
 import os
-from src.data import add_country_codes
+from pathlib import Path
 
-INPUT_FILE = "./data/raw/who_suicide_statistics.csv"
-POPULATION_FILE = "./data/raw/total_pop_1960_2018.csv"
-META_DATA = "./data/raw/meta_data.csv"
 PROCESSED_FILE = "./data/processed/enriched_df.csv"
 CHOROPLETH_DATA_FILE = "./data/processed/choropleth_df.csv"
 CLEANED_META_DATA_FILE = "./data/processed/cleaned_meta.csv"
 CONVENIENT_DATA_FILE = "./data/processed/year_country_data.csv"
-
-
-def add_age_group_fractions(data_frame):
-    """
-    Calculate, for each of our 12 age groups, the fraction they represent of the total population size. E.g. the
-    0-5 year old group may represent 0.04 of the total population. We only do this for the countries for which we
-    have population data (i.e. where the population data is not nan), so that later on we can calculate the average
-    age distribution (averaged over the age distributions from different countries).
-    :param data_frame: pandas dataframe
-    :return: pandas dataframe with some nan rows dropped and an extra fraction_pop column
-    """
-    assert "year" in data_frame, "year column must be in dataframe"
-    assert "country" in data_frame, "country column must be in dataframe"
-
-    # get rid of all rows with nan values in the population column
-    data_frame = data_frame.dropna(subset=["population"], how="any", axis=0)
-    assert len(data_frame) % 12 == 0, f"length of data frame must be multiple of 12, not {len(data_frame)}"
-
-    # add total population size column
-    total_pop = data_frame.groupby(["country", "year"])["population"].sum().reset_index() \
-        .rename(columns={"population": "total_population"})
-    assert min(total_pop["total_population"]) > 0, "need valid total population count"
-    df = pd.merge(data_frame, total_pop, how="left", on=["country", "year"])
-
-    # add column for relative pop size of each age group
-    df["fraction_pop"] = df["population"] / df["total_population"]
-    assert ((df["fraction_pop"] >= 0) & df["fraction_pop"] <= 1).sum() == len(df)
-
-    return df
-
-
-def get_age_group_stats(data_frame):
+OUTPUTS = [
+    ("enriched", PROCESSED_FILE),
+    ("meta", CLEANED_META_DATA_FILE),
+    ("choropleth", CHOROPLETH_DATA_FILE),
+    ("year_country", CONVENIENT_DATA_FILE),
+]
+
+# copies of raw_data.RAW_ARCHIVE, load_dataset.FORMAT_EXTENSIONS, impute.STRATEGIES and the validation levels of
+# validation.py, so that we don't need to import those modules (and pandas) to set up the command line interface
+RAW_ARCHIVE = "./data/raw/data.zip"
+FORMAT_EXTENSIONS = {"feather": ".feather", "parquet": ".parquet", "csv": ".csv"}
+IMPUTATION_STRATEGIES = ("global", "interpolated")
+VALIDATION_LEVEL_ENV_VAR = "VALIDATION_LEVEL"
+VALIDATION_LEVELS = ("off", "sampled", "full")
+DEFAULT_VALIDATION_LEVEL = "sampled"
+PARTITION_COLUMNS = ("year", "region")  # columns the processed datasets can be partitioned on, see hive.py
+
+
+def output_format_of(path):
     """
-    We want to know, for each of our age groups (we have 6 of them, for both males and females), what fraction of the
-    total population they form. E.g., on average the 20-35 female age group may form 7% of the total population size.
-    We return a dataframe of length 12 containing the average (averaged over different countries and years) population
-    size fraction of our age-sex groups.
-    :param data_frame: pandas dataframe
-    :return: pandas dataframe of length 12
+    :param path: path of a processed file
+    :return: string, the file format, inferred from the extension of the path
     """
-    assert "fraction_pop" in data_frame, "dataframe needs to have column fraction_pop"
-    assert data_frame["fraction_pop"].isna().sum() == 0, "there are nans in dataframe.."
-
-    grouped = data_frame.groupby(["age", "sex"])["fraction_pop"].mean().reset_index()
-    total_fraction = grouped["fraction_pop"].sum()
-    assert 1.01 >= total_fraction >= 0.99  # check whether overall fraction roughly 1
-
-    # normalize to exactly 1.0 overall fraction
-    grouped["fraction_pop"] = grouped["fraction_pop"] / grouped["fraction_pop"].sum()
-
-    return grouped
-
-
-def clean_population_stats(data_frame):
-    """
-    Clean our population dataframe. Rename some columns, drop some columns etc..
-    :param data_frame: population dataframe
-    :return: pandas dataframe, cleaned
-    """
-    df_pop = data_frame.drop(["Country Code", "Indicator Name", "Indicator Code", "Unnamed: 63"], axis=1)
-    df_pop = df_pop.rename(columns={"Country Name": "country"})
-    df_pop = df_pop.melt(id_vars=["country"], var_name="year", value_name="total_population")
-
-    df_pop["year"] = df_pop["year"].astype("float")
-
-    return df_pop
-
-
-def fill_in_missing_populations(suicide_df, df_population, df_age_statistics):
-    """
-    Some population values were missing in the original suicide dataset (suicide_df), we fill in some of them with
-    data obtained from df_population (containing population sizes for a range of countries). More details are provided
-    in the readme.
-    :param suicide_df: pandas dataframe, WHO suicide statistics
-    :param df_population: pandas dataframe with population statistics per country per year
-    :param df_age_statistics: pandas dataframe, relative population size (out of total) in a set of age groups
-    :return: pandas dataframe, missing population values imputed
-    """
-    added_age_stats = pd.merge(suicide_df, df_age_statistics, how="left", on=["sex", "age"])
-    added_total_pop = pd.merge(added_age_stats, df_population, how="left", on=["country", "year"])
-
-    # now replace any missing values in population with the product of total population and fraction in age group
-    mask = added_total_pop["population"].isnull()
+    formats = {extension: output_format for output_format, extension in FORMAT_EXTENSIONS.items()}
+    suffix = Path(path).suffix
+    if suffix not in formats:
+        raise click.BadParameter(f"{path} should end in one of {', '.join(formats)}", param_hint="--output")
+    return formats[suffix]
 
-    added_total_pop.loc[mask, "population"] = \
-        added_total_pop["fraction_pop"][mask] * added_total_pop["total_population"][mask]
 
-    # drop total population column and fraction_pop columns
-    added_total_pop.drop(columns=["fraction_pop", "total_population"], inplace=True)
+def imputation_option(func):
+    return click.option("--imputation", type=click.Choice(IMPUTATION_STRATEGIES), default="global", show_default=True,
+                        help="How to get the age distribution of a country to fill in its missing populations with: "
+                             "the average over all countries, or its own, interpolated between the nearest years in "
+                             "which it is known.")(func)
 
-    return added_total_pop
 
-
-def make_df_nicer_format(data_frame):
+def run_options(func):
     """
-    Here we take in the dataframe that comes out "prepare_data_for_choropleth" and transform it so that we have
-    one row for every unique (country, year) combination, and columns that gives us the male suicide number and rate,
-    the female suicide number and rate, and the combined suicide rate
-    :param data_frame: pd Dataframe
-    :return: pd Dataframe, restructured.
+    Options shared by all commands that run stages
     """
-    df = data_frame.copy()
-
-    # create a column with no duplicates, so that we can use df.pivot with this column as index.
-    df["year_country_code"] = df["year"].map(str) + "_" + df["country"] + "_" + df["code"]
-
-    suic_rate_by_sex = df.pivot(index="year_country_code", columns="sex", values="suicides per 100,000").reset_index()
-    population_by_sex = df.pivot(index="year_country_code", columns="sex", values="population").reset_index()
-    suicide_num_by_sex = df.pivot(index="year_country_code", columns="sex", values="suicides_no").reset_index()
-
-    combined = pd.merge(suic_rate_by_sex, population_by_sex, on="year_country_code", suffixes=("_rate", "_pop"))
-    combined = pd.merge(combined, suicide_num_by_sex, on="year_country_code")
-    combined = combined.rename(columns={"female": "suicide_num_f", "male": "suicide_num_m"})
-
-    # get year and country columns back
-    combined["split"] = combined["year_country_code"].str.split('_')
-    combined[["year", "country", "code"]] = pd.DataFrame(combined.split.values.tolist())
-
-    combined = combined.drop(columns=["year_country_code", "split"], axis=1)
-    del combined.index.name
-    combined.loc[combined["female_pop"] == 0, "female_pop"] = np.nan
-    combined.loc[combined["male_pop"] == 0, "male_pop"] = np.nan
-
-    combined["overall_rate"] = (combined["suicide_num_f"] + combined["suicide_num_m"]) / (
-                combined["female_pop"] + combined["male_pop"]) * 100000
-
-    # add some extra columns for convenience
-    combined["population"] = combined["female_pop"] + combined["male_pop"]
-    combined["suicides_no"] = combined["suicide_num_f"] + combined["suicide_num_m"]
-
-    return combined
-
-
-def prepare_data_for_choropleth(enriched_df):
+    options = [
+        click.option("--force", is_flag=True, help="Recompute every stage, ignoring previously cached results."),
+        click.option("--jobs", type=click.IntRange(min=1), default=1, show_default=True,
+                     help="Number of processes to run the per-country stages (filling in populations, the choropleth "
+                          "and year-country data) on. The output is the same for any number of jobs."),
+        click.option("--profile-out", type=click.Path(dir_okay=False), default=None,
+                     help="Write the time, memory and row counts of every stage to this .json or .csv file."),
+        click.option("--cprofile-dir", type=click.Path(file_okay=False), default=None,
+                     help="Run every stage under cProfile and write the profiles to <stage>.prof files in this "
+                          "directory."),
+        click.option("--trace-memory", is_flag=True,
+                     help="Also record the peak memory allocated by python in every stage (tracemalloc, slow)."),
+        click.option("--validation", "validation_level", type=click.Choice(VALIDATION_LEVELS),
+                     envvar=VALIDATION_LEVEL_ENV_VAR, default=None,
+                     help="How thoroughly to check the data between stages: not at all, a sample of the rows, or every "
+                          f"row. Defaults to the {VALIDATION_LEVEL_ENV_VAR} environment variable if set, and to "
+                          f"{DEFAULT_VALIDATION_LEVEL} otherwise."),
+    ]
+    for option in reversed(options):
+        func = option(func)
+    return func
+
+
+def make_profiler(validation_level, trace_memory, cprofile_dir):
     """
-    TODO: I'm not really using the output dataframe of this function anymore, combine this function with the one above
-        here.
-    Prepare data for our choropleth world map plot of suicide statistics. We don't care about age groups here, we just
-    want to show the total number of suicides per year per country. An alpha-3 country code needs to be added to
-    be able to use the choropleth plot. Also we re-format some columns so that the plot looks nicer
-    :param enriched_df: pd dataframe, our enriched data, so already applied some transformations on the raw data
-    :return: pd dataframe
+    Set up a run of the pipeline
+    :return: StageProfiler, to record the resource use of every stage
     """
-    df_suicides = enriched_df.copy()
-
-    # drop all rows which have nans, it might happen that the population is Nan but suicides_no is not
-    df_suicides = df_suicides.dropna(how="any")
-
-    # total number of suicides per year per sex per country (so summing over different age groups)
-    df_suicides = df_suicides.groupby(["year", "sex", "country"]).sum().reset_index()
-    df_suicides.loc[df_suicides["population"] == 0, "population"] = np.nan  # otherwise get inf for suicide rate
-    df_suicides["suicides per 100,000"] = df_suicides["suicides_no"] / df_suicides["population"] * 100000
-
-    # little data in 2015 and 2016, drop them for plotting purposes
-    df_suicides = df_suicides[df_suicides["year"] < 2015]
+    from src.data.instrumentation import StageProfiler
 
-    # for choropleth hover option, better to use scientific notation / few decimals
-    df_suicides["suicides per 100,000"] = df_suicides["suicides per 100,000"].apply(lambda x: "%.2f" % x).astype(float)
+    if validation_level is not None:
+        os.environ[VALIDATION_LEVEL_ENV_VAR] = validation_level  # also for the worker processes of --jobs
+    return StageProfiler(trace_memory=trace_memory, cprofile_dir=cprofile_dir)
 
-    # add alpha-3 country codes for choropleth
-    df_suicides["code"] = df_suicides["country"].apply(add_country_codes.get_alpha3_code)
 
-    return df_suicides
-
-
-def clean_meta_data(meta_data_frame):
+def run_stage(name, output, raw_archive=None, inputs=None, imputation="global", force=False, jobs=1, profile_out=None,
+              cprofile_dir=None, trace_memory=False, validation_level=None):
     """
-    Clean the meta data we have. Remove an unnamed column, rename some other columns, drop some columns
-    :param meta_data_frame: pd dataframe
-    :return: cleaned pd dataframe
+    Compute a single stage, and the stages it needs that are not given as inputs, and save its output
+    :param name: name of the stage
+    :param output: path to save the output to, the file format follows from its extension
+    :param raw_archive: path of the raw data archive, if the stage starts from the raw data
+    :param inputs: dictionary, name of a stage -> path of a processed file with its output, to start from instead
+    :param imputation: string, one of IMPUTATION_STRATEGIES
     """
-    meta = meta_data_frame.loc[:, ~meta_data_frame.columns.str.contains("^Unnamed")]
-    meta = meta.rename(columns={"Country Code": "code", "Region": "region", "IncomeGroup": "income"})
-    meta = meta.drop(columns=["SpecialNotes", "TableName"])
-    return meta
-
-
-@click.command()
-def main():
+    output_format = output_format_of(output)
+    profiler = make_profiler(validation_level, trace_memory, cprofile_dir)
+    from src.data import pipeline
+
+    sources = pipeline.raw_sources(raw_archive) if raw_archive is not None else pipeline.dataset_sources(inputs)
+    pipeline.run_stages([(name, output, output_format)], sources, profiler, force=force, jobs=jobs,
+                        imputation=imputation)
+    pipeline.report_profile(profiler, profile_out)
+
+
+@click.group(invoke_without_command=True)
+@click.option("--project-dir", type=click.Path(exists=True, file_okay=False), envvar="PROJECT_DIR", default=".",
+              show_default=True, help="Root directory of the project. All paths, including the defaults (data/raw, "
+                                      "data/processed) and the caches in data/interim, are relative to it.")
+@click.pass_context
+def main(ctx, project_dir):
     """ Runs data processing scripts to turn raw data from (../raw) into
-        cleaned data ready to be analyzed (saved in ../processed).
+        cleaned data ready to be analyzed (saved in ../processed). Stages
+        whose inputs and code did not change since the previous run are
+        loaded from the cache instead of recomputed. Without a command,
+        runs all stages.
+    """
+    os.chdir(project_dir)
+    if ctx.invoked_subcommand is None:
+        ctx.invoke(run_all)
+
+
+@main.command("all")
+@click.option("--raw-archive", type=click.Path(dir_okay=False), default=RAW_ARCHIVE, show_default=True,
+              help="Zip archive with the raw data (or the path it would have, if the raw files are extracted).")
+@click.option("--output-dir", type=click.Path(file_okay=False), default=str(Path(PROCESSED_FILE).parent),
+              show_default=True, help="Directory to save the processed datasets in.")
+@click.option("--output-format", type=click.Choice(list(FORMAT_EXTENSIONS)), default="csv",
+              show_default=True, help="File format of the processed datasets. feather and parquet keep dtypes and "
+                                      "are much faster to load (see src/data/load_dataset.py), csv is for export.")
+@click.option("--partitioned", is_flag=True,
+              help="Process the suicide data a few countries at a time, to keep memory use bounded for large data "
+                   "sets. Outputs are appended per partition, so their rows are ordered by partition first.")
+@click.option("--chunksize", type=int, default=100000, show_default=True,
+              help="Number of rows to read at a time in --partitioned mode, partitions are about this size.")
+@click.option("--partition-by", type=click.Choice(PARTITION_COLUMNS), multiple=True,
+              help="Save the enriched, choropleth and year-country data partitioned on disk on this column, in a "
+                   "directory per value with parquet files (repeat to nest, e.g. --partition-by year --partition-by "
+                   "region). load_dataset then only reads the partitions a filter on year, region or country needs, "
+                   "see src/data/hive.py. A filter on country alone reads every file of a layout by year, more bytes "
+                   "than a single file: partition by year and region as well for those, or don't partition if they "
+                   "are most of the queries. Needs --output-format parquet.")
+@click.option("--delta", is_flag=True,
+              help="Only recompute the (country, year) combinations that changed in the raw data since the previous "
+                   "--delta run, and update them in the outputs (see src/data/delta.py). The first run, or a run with "
+                   "other outputs or settings, processes everything.")
+@click.option("--lean", is_flag=True,
+              help="Copy less, downcast the enriched data and let go of every intermediate result as soon as it is "
+                   "used, to keep the peak memory down (see src/data/lean.py). The numbers are the same, up to the last "
+                   "few bits.")
+@imputation_option
+@run_options
+def run_all(raw_archive, output_dir, output_format, partitioned, chunksize, partition_by, delta, lean, imputation,
+            force, jobs, profile_out, cprofile_dir, trace_memory, validation_level):
+    """ Run all stages, from the raw data to all processed datasets. Prints
+        the time, memory and row counts of every stage that ran.
     """
-    print(os.getcwd())
     logger = logging.getLogger(__name__)
     logger.info("making final data set from raw data")
-
-    logger.info("reading in data...")
-    df = pd.read_csv(INPUT_FILE)
-    df_population = pd.read_csv(POPULATION_FILE, skiprows=4)
-    meta_data = pd.read_csv(META_DATA)
-
-    logger.info("processing data...")
-    age_stats = get_age_group_stats(add_age_group_fractions(df))
-    df_pop = clean_population_stats(df_population)
-    enriched_df = fill_in_missing_populations(df, df_pop, age_stats)
-    meta = clean_meta_data(meta_data)
-
-    logger.info(f"saving enriched dataframe to {PROCESSED_FILE}")
-    enriched_df.to_csv(PROCESSED_FILE, index=False)
-    logger.info("saved enriched dataframe")
-
-    logger.info(f"saving cleaned meta data to {CLEANED_META_DATA_FILE}")
-    meta.to_csv(CLEANED_META_DATA_FILE, index=False)
-    logger.info("saved cleaned meta data")
-
-    logger.info(f"Creating data for choropleth plot, saving to {CHOROPLETH_DATA_FILE}")
-    choropleth_df = prepare_data_for_choropleth(enriched_df)
-    choropleth_df.to_csv(CHOROPLETH_DATA_FILE, index=False)
-    logger.info("saved choropleth dataframe")
-
-    logger.info(f"Creating another dataframe in convenient format, saving to {CONVENIENT_DATA_FILE}")
-    year_country_df = make_df_nicer_format(choropleth_df)
-    year_country_df.to_csv(CONVENIENT_DATA_FILE, index=False)
-    logger.info("saved more convenient dataframe")
+    if partitioned and output_format not in ("csv", "parquet"):
+        raise click.BadParameter("--partitioned can only write csv or parquet", param_hint="--output-format")
+    if partition_by and (output_format != "parquet" or partitioned):
+        raise click.BadParameter("only works with --output-format parquet, and not with --partitioned",
+                                 param_hint="--partition-by")
+    if delta and (partitioned or partition_by):
+        raise click.BadParameter("can't be combined with --partitioned or --partition-by", param_hint="--delta")
+    if lean and (partitioned or delta or jobs > 1):
+        raise click.BadParameter("can't be combined with --partitioned, --delta or --jobs", param_hint="--lean")
+    output_files = {name: (Path(output_dir) / Path(output_file).name).with_suffix(FORMAT_EXTENSIONS[output_format])
+                    for name, output_file in OUTPUTS}
+
+    profiler = make_profiler(validation_level, trace_memory, cprofile_dir)
+    from src.data import pipeline
+
+    if delta:
+        from src.data import delta as delta_ingestion
+        delta_ingestion.run_delta(output_files, output_format, profiler, raw_archive, imputation, force=force,
+                                  jobs=jobs)
+    elif partitioned:
+        pipeline.process_in_partitions(output_files, output_format, chunksize, profiler, raw_archive, imputation)
+    else:
+        outputs = [(name, output_file, output_format) for name, output_file in output_files.items()]
+        pipeline.run_stages(outputs, pipeline.raw_sources(raw_archive), profiler, force=force, jobs=jobs,
+                            imputation=imputation, partition_by=list(dict.fromkeys(partition_by)), lean=lean)
+    pipeline.report_profile(profiler, profile_out)
+
+
+@main.command()
+@click.option("--raw-archive", type=click.Path(dir_okay=False), default=RAW_ARCHIVE, show_default=True,
+              help="Zip archive with the raw data (or the path it would have, if the raw files are extracted).")
+@click.option("--output", type=click.Path(dir_okay=False), default=PROCESSED_FILE, show_default=True,
+              help="File to save the enriched data to, a .feather, .parquet or .csv file.")
+@imputation_option
+@run_options
+def enrich(raw_archive, output, imputation, **options):
+    """ Fill in missing populations of the suicide data. """
+    run_stage("enriched", output, raw_archive=raw_archive, imputation=imputation, **options)
+
+
+@main.command()
+@click.option("--raw-archive", type=click.Path(dir_okay=False), default=RAW_ARCHIVE, show_default=True,
+              help="Zip archive with the raw data (or the path it would have, if the raw files are extracted).")
+@click.option("--output", type=click.Path(dir_okay=False), default=CLEANED_META_DATA_FILE, show_default=True,
+              help="File to save the cleaned meta data to, a .feather, .parquet or .csv file.")
+@run_options
+def meta(raw_archive, output, **options):
+    """ Clean the meta data of the countries (region, income group). """
+    run_stage("meta", output, raw_archive=raw_archive, **options)
+
+
+@main.command()
+@click.option("--input", "input_file", type=click.Path(exists=True, dir_okay=False), default=PROCESSED_FILE,
+              show_default=True, help="Enriched data, as saved by the enrich command.")
+@click.option("--output", type=click.Path(dir_okay=False), default=CHOROPLETH_DATA_FILE, show_default=True,
+              help="File to save the choropleth data to, a .feather, .parquet or .csv file.")
+@run_options
+def choropleth(input_file, output, **options):
+    """ Total suicides and suicide rates per year, sex and country, with the alpha-3 codes of the countries. """
+    run_stage("choropleth", output, inputs={"enriched": input_file}, **options)
+
+
+@main.command("year-country")
+@click.option("--input", "input_file", type=click.Path(exists=True, dir_okay=False), default=CHOROPLETH_DATA_FILE,
+              show_default=True, help="Choropleth data, as saved by the choropleth command.")
+@click.option("--output", type=click.Path(dir_okay=False), default=CONVENIENT_DATA_FILE, show_default=True,
+              help="File to save the year-country data to, a .feather, .parquet or .csv file.")
+@run_options
+def year_country(input_file, output, **options):
+    """ One row per year and country, with the numbers of males and females side by side. """
+    run_stage("year_country", output, inputs={"choropleth": input_file}, **options)
 
 
 if __name__ == "__main__":
+    from dotenv import find_dotenv, load_dotenv
+
     log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
     logging.basicConfig(level=logging.INFO, format=log_fmt)
 
-    # not used in this stub but often useful for finding various files
-    project_dir = Path(__file__).resolve().parents[2]
-
     # find .env automagically by walking up directories until it's found, then
     # load up the .env entries as environment variables
     load_dotenv(find_dotenv())
@@ -0,0 +1,101 @@
+"""
+Run per-country pipeline stages on a process pool. A dataframe is split into shards of complete countries, every
+shard is sent to a worker as an Arrow IPC buffer (compact, keeps dtypes and is much cheaper to (de)serialize than a
+pickled dataframe), and the results are combined in a fixed order, so that the output is the same as that of running
+the stage on the whole dataframe in a single process.
+"""
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+
+def to_ipc(data_frame):
+    """
+    :param data_frame: pd dataframe
+    :return: bytes, the dataframe in the Arrow IPC stream format (without its index)
+    """
+    table = pa.Table.from_pandas(data_frame, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    writer = pa.ipc.new_stream(sink, table.schema)
+    writer.write_table(table)
+    writer.close()
+    return sink.getvalue().to_pybytes()
+
+
+def from_ipc(buffer):
+    """
+    :param buffer: bytes, output of to_ipc
+    :return: pd dataframe
+    """
+    return pa.ipc.open_stream(pa.py_buffer(buffer)).read_all().to_pandas()
+
+
+def shard_positions(keys, n_shards):
+    """
+    Split rows into at most n_shards shards of complete groups (e.g. countries), with about the same number of rows in
+    every shard. The biggest groups are handed out first, each to the shard with the fewest rows so far.
+    :param keys: pd Series, the key (e.g. country) of every row
+    :param n_shards: int, maximum number of shards
+    :return: list of numpy arrays with the (sorted) positions of the rows in each shard, empty shards are left out
+    """
+    group_index, _ = pd.factorize(keys)
+    group_sizes = np.bincount(group_index[group_index >= 0])
+    shard_of_group = np.empty(len(group_sizes), dtype=np.int64)
+    shard_sizes = np.zeros(n_shards, dtype=np.int64)
+    for group in np.argsort(-group_sizes, kind="stable"):
+        shard = int(np.argmin(shard_sizes))
+        shard_of_group[group] = shard
+        shard_sizes[shard] += group_sizes[group]
+
+    row_shards = np.where(group_index >= 0, shard_of_group[np.maximum(group_index, 0)], 0)
+    positions = [np.flatnonzero(row_shards == shard) for shard in range(n_shards)]
+    return [shard for shard in positions if len(shard) > 0]
+
+
+def _run_shard(func, shard_buffer, shared_buffers):
+    """
+    Runs in a worker process: unpack the shard and the shared inputs, apply func and pack up the result
+    """
+    result = func(from_ipc(shard_buffer), *[from_ipc(buffer) for buffer in shared_buffers])
+    return to_ipc(result)
+
+
+def map_shards(executor, n_shards, func, data_frame, shared=(), key="country"):
+    """
+    Apply func to shards of complete groups of data_frame on a process pool
+    :param executor: concurrent.futures.ProcessPoolExecutor
+    :param n_shards: int, number of shards to split data_frame into
+    :param func: module-level function, called as func(shard, *shared) and returning a pd dataframe
+    :param data_frame: pd dataframe to split into shards
+    :param shared: list of pd dataframes every shard needs in full
+    :param key: string, column to shard on
+    :return: (list of result dataframes, list of numpy arrays with the positions of the rows of each shard)
+    """
+    positions = shard_positions(data_frame[key], n_shards)
+    shared_buffers = [to_ipc(shared_frame) for shared_frame in shared]
+    futures = [executor.submit(_run_shard, func, to_ipc(data_frame.iloc[shard]), shared_buffers)
+               for shard in positions]
+    return [from_ipc(future.result()) for future in futures], positions
+
+
+def combine_in_row_order(results, positions):
+    """
+    Combine the results of a func that returns one row for every input row, in the same order, e.g. a left merge.
+    :param results: list of pd dataframes, output of map_shards
+    :param positions: list of numpy arrays, output of map_shards
+    :return: pd dataframe with the rows in the order of the original dataframe
+    """
+    combined = pd.concat(results, ignore_index=True)
+    order = np.argsort(np.concatenate(positions), kind="stable")
+    return combined.take(order).reset_index(drop=True)
+
+
+def combine_ordered(results, order):
+    """
+    Combine results and put them in a canonical order, e.g. the order a groupby would give on the whole dataframe
+    :param results: list of pd dataframes, output of map_shards
+    :param order: function taking the combined dataframe and returning the positions of its rows in sorted order
+    :return: pd dataframe
+    """
+    combined = pd.concat(results, ignore_index=True)
+    return combined.take(order(combined)).reset_index(drop=True)
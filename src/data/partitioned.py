@@ -0,0 +1,125 @@
+"""
+Helpers to run the pipeline out-of-core: read the suicide data in chunks, regroup the chunks into partitions of
+complete countries (no country is split over two partitions), and append the processed partitions to the output
+files one at a time. Peak memory is then bounded by the size of a partition instead of the size of the whole data set.
+"""
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from src.data.load_dataset import compact_dtypes
+
+_DICTIONARY_TYPE = pa.dictionary(pa.int32(), pa.string())
+
+
+def _concat(pieces):
+    """
+    Concatenate pieces of a partition. Categoricals with different categories become object columns in pd.concat,
+    turn those back into categoricals.
+    """
+    combined = pd.concat(pieces, ignore_index=True)
+    for column, dtype in pieces[0].dtypes.items():
+        if dtype.name == "category" and combined[column].dtype.name != "category":
+            combined[column] = combined[column].astype("category")
+    return combined
+
+
+def iter_partitions(chunks, key="country"):
+    """
+    Turn an iterator of chunks of rows into an iterator of partitions that contain all rows for the values of key in
+    them, e.g. all rows of a few countries. The rows need to be grouped by key (the WHO data is sorted on country and
+    year). Every partition holds the complete groups of a chunk, the last group of a chunk is moved to the next
+    partition as it may continue in the next chunk. Partitions are therefore about as large as the chunks.
+    :param chunks: iterator of pd dataframes, e.g. from pd.read_csv with chunksize
+    :param key: string, column to partition on
+    :return: generator of pd dataframes
+    """
+    seen = set()
+    pending = None  # the last group of the previous chunk
+
+    def check_grouped(values, starts):
+        keys = values[np.concatenate([[0], starts])]
+        if len(set(keys)) < len(keys) or seen.intersection(keys):
+            raise ValueError(f"data is not grouped by {key}, some values appear in separate places")
+        seen.update(keys)
+
+    for chunk in chunks:
+        if len(chunk) == 0:
+            continue
+        data = chunk if pending is None else _concat([pending, chunk])
+        values = data[key].astype(str).values
+        # positions where a new group starts
+        starts = np.flatnonzero(values[1:] != values[:-1]) + 1
+        if len(starts) == 0:
+            pending = data
+            continue
+
+        last_start = starts[-1]
+        check_grouped(values[:last_start], starts[:-1])
+        yield data.iloc[:last_start].reset_index(drop=True)
+        pending = data.iloc[last_start:]
+
+    if pending is not None:
+        values = pending[key].astype(str).values
+        check_grouped(values, np.flatnonzero(values[1:] != values[:-1]) + 1)
+        yield pending.reset_index(drop=True)
+
+
+def _uniform_dictionaries(table):
+    """
+    Every partition has its own categories, and depending on how many there are pyarrow stores their codes as int8,
+    int16, .. Give all dictionary (categorical) columns int32 codes, so that all partitions have the same schema.
+    """
+    for i, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type) and field.type != _DICTIONARY_TYPE:
+            chunks = [pa.DictionaryArray.from_arrays(chunk.indices.cast(pa.int32()), chunk.dictionary)
+                      for chunk in table.column(i).chunks]
+            table = table.set_column(i, field.with_type(_DICTIONARY_TYPE), pa.chunked_array(chunks, _DICTIONARY_TYPE))
+    return table
+
+
+class PartitionWriter:
+    """
+    Appends dataframes to a csv or parquet file. The file is only created once the first dataframe is written.
+    """
+
+    def __init__(self, path, output_format):
+        """
+        :param path: path of the output file
+        :param output_format: string, "csv" or "parquet" (feather files can't be appended to)
+        """
+        if output_format not in ("csv", "parquet"):
+            raise ValueError(f"can only write partitions to csv or parquet, not {output_format}")
+        self.path = path
+        self.output_format = output_format
+        self.rows = 0
+        self._started = False
+        self._parquet_writer = None
+
+    def write(self, data_frame):
+        """
+        :param data_frame: pd dataframe to append, with the same columns and dtypes as the ones written before
+        """
+        if self.output_format == "csv":
+            data_frame.to_csv(self.path, index=False, mode="a" if self._started else "w", header=not self._started)
+        else:
+            from pyarrow import parquet
+
+            table = pa.Table.from_pandas(compact_dtypes(data_frame), preserve_index=False)
+            table = _uniform_dictionaries(table)
+            if self._parquet_writer is None:
+                self._parquet_writer = parquet.ParquetWriter(str(self.path), table.schema)
+            self._parquet_writer.write_table(table)
+        self.rows += len(data_frame)
+        self._started = True
+
+    def close(self):
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            self._parquet_writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
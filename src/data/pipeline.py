@@ -0,0 +1,526 @@
+"""
+The stages of the pipeline that turns the raw data into the processed datasets, and the functions to run them. The
+command line interface to all this is in make_dataset.py, which only imports this module (and with it pandas, numpy
+and pycountry) once a stage actually runs.
+"""
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+
+import click
+import numpy as np
+import pandas as pd
+
+from src.data import (add_country_codes, hive, impute, load_dataset, parallel, partitioned, raw_data, reshape,
+                      uncertainty)
+from src.data.stage_cache import Source, Stage, StageGraph
+from src.data.validation import Columns, GroupSize, NotNull, Range, SumsTo, validate
+
+# checks on the frames in add_age_group_fractions and get_age_group_stats, see src/data/validation.py
+SUICIDE_CHECKS = [Columns(["country", "year", "sex", "age", "population"])]
+POPULATION_GROUP_CHECKS = [GroupSize(["country", "year"], multiple=12)]  # all 12 age-sex groups, or none
+AGE_FRACTION_CHECKS = [Range("total_population", low=0, low_inclusive=False), Range("fraction_pop", 0, 1)]
+AGE_STATS_INPUT_CHECKS = [Columns(["age", "sex", "fraction_pop"]), NotNull("fraction_pop")]
+AGE_STATS_CHECKS = [SumsTo("fraction_pop", total=1., tolerance=0.01)]  # roughly 1 before normalising
+
+
+def add_age_group_fractions(data_frame):
+    """
+    Calculate, for each of our 12 age groups, the fraction they represent of the total population size. E.g. the
+    0-5 year old group may represent 0.04 of the total population. We only do this for the countries for which we
+    have population data (i.e. where the population data is not nan), so that later on we can calculate the average
+    age distribution (averaged over the age distributions from different countries).
+    :param data_frame: pandas dataframe
+    :return: pandas dataframe with some nan rows dropped and an extra fraction_pop column
+    """
+    validate(data_frame, SUICIDE_CHECKS, name="suicides")
+
+    # get rid of all rows with nan values in the population column
+    data_frame = data_frame.dropna(subset=["population"], how="any", axis=0)
+    validate(data_frame, POPULATION_GROUP_CHECKS, name="suicides with population")
+
+    # add total population size column
+    total_pop = data_frame.groupby(["country", "year"], observed=True)["population"].sum().reset_index() \
+        .rename(columns={"population": "total_population"})
+    df = pd.merge(data_frame, total_pop, how="left", on=["country", "year"])
+
+    # add column for relative pop size of each age group
+    df["fraction_pop"] = df["population"] / df["total_population"]
+    validate(df, AGE_FRACTION_CHECKS, name="age fractions")
+
+    return df
+
+
+def get_age_group_stats(data_frame):
+    """
+    We want to know, for each of our age groups (we have 6 of them, for both males and females), what fraction of the
+    total population they form. E.g., on average the 20-35 female age group may form 7% of the total population size.
+    We return a dataframe of length 12 containing the average (averaged over different countries and years) population
+    size fraction of our age-sex groups.
+    :param data_frame: pandas dataframe
+    :return: pandas dataframe of length 12
+    """
+    validate(data_frame, AGE_STATS_INPUT_CHECKS, name="age fractions")
+
+    grouped = data_frame.groupby(["age", "sex"], observed=True)["fraction_pop"].mean().reset_index()
+    return normalize_age_group_stats(grouped)
+
+
+def normalize_age_group_stats(grouped):
+    """
+    Check that the average population fractions of our age-sex groups add up to roughly 1, and normalize them so that
+    they add up to exactly 1
+    :param grouped: pandas dataframe with columns age, sex and fraction_pop, one row per age-sex group
+    :return: pandas dataframe, with normalized fraction_pop
+    """
+    validate(grouped, AGE_STATS_CHECKS, name="age group stats")  # check whether overall fraction roughly 1
+
+    # normalize to exactly 1.0 overall fraction
+    grouped["fraction_pop"] = grouped["fraction_pop"] / grouped["fraction_pop"].sum()
+
+    return grouped
+
+
+def get_age_group_stats_partitioned(partitions):
+    """
+    Same as get_age_group_stats(add_age_group_fractions(df)), but for data that comes in partitions (each containing
+    all rows of some countries) instead of in a single dataframe. We keep the sum and count of the population fractions
+    of every age-sex group over the partitions, and only take the mean at the end. Results can differ from the ones of
+    get_age_group_stats in the last few bits, as the fractions are summed in a different order.
+    :param partitions: iterable of pandas dataframes
+    :return: pandas dataframe of length 12
+    """
+    partial_sums = []
+    for partition in partitions:
+        if partition["population"].isnull().all():
+            continue  # nothing to learn about the age distribution here
+        fractions = add_age_group_fractions(partition)
+        fractions = fractions.astype({"age": str, "sex": str})  # categories differ between partitions
+        partial_sums.append(fractions.groupby(["age", "sex"])["fraction_pop"].agg(["sum", "count"]))
+
+    if not partial_sums:
+        raise ValueError("need population data for at least one country")
+    totals = pd.concat(partial_sums).groupby(level=["age", "sex"]).sum()
+    grouped = (totals["sum"] / totals["count"]).rename("fraction_pop").reset_index()
+    return normalize_age_group_stats(grouped)
+
+
+def clean_population_stats(data_frame):
+    """
+    Clean our population dataframe. Rename some columns, drop some columns etc..
+    :param data_frame: population dataframe
+    :return: pandas dataframe, cleaned
+    """
+    df_pop = data_frame.drop(["Country Code", "Indicator Name", "Indicator Code", "Unnamed: 63"], axis=1,
+                             errors="ignore")  # these are not there if the data was read with the raw data schema
+    df_pop = df_pop.rename(columns={"Country Name": "country"})
+    df_pop = df_pop.melt(id_vars=["country"], var_name="year", value_name="total_population")
+
+    df_pop["year"] = df_pop["year"].astype("float")
+
+    return df_pop
+
+
+def fill_in_missing_populations(suicide_df, df_population, df_age_statistics):
+    """
+    Some population values were missing in the original suicide dataset (suicide_df), we fill in some of them with
+    data obtained from df_population (containing population sizes for a range of countries). More details are provided
+    in the readme. The pipeline uses the faster impute_missing_populations, which gives the same output.
+    :param suicide_df: pandas dataframe, WHO suicide statistics
+    :param df_population: pandas dataframe with population statistics per country per year
+    :param df_age_statistics: pandas dataframe, relative population size (out of total) in a set of age groups
+    :return: pandas dataframe, missing population values imputed
+    """
+    added_age_stats = pd.merge(suicide_df, df_age_statistics, how="left", on=["sex", "age"])
+    added_total_pop = pd.merge(added_age_stats, df_population, how="left", on=["country", "year"])
+
+    # now replace any missing values in population with the product of total population and fraction in age group
+    mask = added_total_pop["population"].isnull()
+
+    added_total_pop.loc[mask, "population"] = \
+        added_total_pop["fraction_pop"][mask] * added_total_pop["total_population"][mask]
+
+    # drop total population column and fraction_pop columns
+    added_total_pop.drop(columns=["fraction_pop", "total_population"], inplace=True)
+
+    return added_total_pop
+
+
+def impute_missing_populations(suicide_df, df_population, df_age_statistics):
+    """
+    Same as fill_in_missing_populations, but with the integer-keyed kernel of impute.py. Fills in a missing population
+    with the total population times the average fraction of the population in the age-sex group (over all countries)
+    """
+    return impute.impute_populations(suicide_df, df_population, df_age_statistics, strategy="global")
+
+
+def impute_missing_populations_interpolated(suicide_df, df_population, df_age_statistics):
+    """
+    Like impute_missing_populations, but with the fraction of the population in the age-sex group of the country
+    itself, interpolated between the nearest years in which it is known (see impute.py)
+    """
+    return impute.impute_populations(suicide_df, df_population, df_age_statistics, strategy="interpolated")
+
+
+def make_df_nicer_format(data_frame):
+    """
+    Here we take in the dataframe that comes out "prepare_data_for_choropleth" and transform it so that we have
+    one row for every unique (country, year) combination, and columns that gives us the male suicide number and rate,
+    the female suicide number and rate, and the combined suicide rate
+    :param data_frame: pd Dataframe
+    :return: pd Dataframe, restructured.
+    """
+    df = data_frame.copy()
+    df["sex"] = df["sex"].astype(str)  # pivoting on a categorical gives categorical columns, which we can't rename
+
+    # create a column with no duplicates, so that we can use df.pivot with this column as index.
+    df["year_country_code"] = df["year"].map(str) + "_" + df["country"].astype(str) + "_" + df["code"]
+
+    suic_rate_by_sex = df.pivot(index="year_country_code", columns="sex", values="suicides per 100,000").reset_index()
+    population_by_sex = df.pivot(index="year_country_code", columns="sex", values="population").reset_index()
+    suicide_num_by_sex = df.pivot(index="year_country_code", columns="sex", values="suicides_no").reset_index()
+
+    combined = pd.merge(suic_rate_by_sex, population_by_sex, on="year_country_code", suffixes=("_rate", "_pop"))
+    combined = pd.merge(combined, suicide_num_by_sex, on="year_country_code")
+    combined = combined.rename(columns={"female": "suicide_num_f", "male": "suicide_num_m"})
+
+    # get year and country columns back
+    combined["split"] = combined["year_country_code"].str.split('_')
+    combined[["year", "country", "code"]] = pd.DataFrame(combined.split.values.tolist())
+
+    combined = combined.drop(columns=["year_country_code", "split"], axis=1)
+    combined.index.name = None
+    combined.loc[combined["female_pop"] == 0, "female_pop"] = np.nan
+    combined.loc[combined["male_pop"] == 0, "male_pop"] = np.nan
+
+    combined["overall_rate"] = (combined["suicide_num_f"] + combined["suicide_num_m"]) / (
+                combined["female_pop"] + combined["male_pop"]) * 100000
+
+    # add some extra columns for convenience
+    combined["population"] = combined["female_pop"] + combined["male_pop"]
+    combined["suicides_no"] = combined["suicide_num_f"] + combined["suicide_num_m"]
+
+    return combined
+
+
+def prepare_data_for_choropleth(enriched_df):
+    """
+    TODO: I'm not really using the output dataframe of this function anymore, combine this function with the one above
+        here.
+    Prepare data for our choropleth world map plot of suicide statistics. We don't care about age groups here, we just
+    want to show the total number of suicides per year per country. An alpha-3 country code needs to be added to
+    be able to use the choropleth plot. Also we re-format some columns so that the plot looks nicer
+    :param enriched_df: pd dataframe, our enriched data, so already applied some transformations on the raw data
+    :return: pd dataframe
+    """
+    df_suicides = enriched_df.copy()
+
+    # drop all rows which have nans, it might happen that the population is Nan but suicides_no is not
+    df_suicides = df_suicides.dropna(how="any")
+
+    # total number of suicides per year per sex per country (so summing over different age groups)
+    df_suicides = df_suicides.groupby(["year", "sex", "country"], observed=True)[["suicides_no", "population"]] \
+        .sum().reset_index()
+    df_suicides.loc[df_suicides["population"] == 0, "population"] = np.nan  # otherwise get inf for suicide rate
+    df_suicides["suicides per 100,000"] = df_suicides["suicides_no"] / df_suicides["population"] * 100000
+
+    # little data in 2015 and 2016, drop them for plotting purposes
+    df_suicides = df_suicides[df_suicides["year"] < 2015]
+
+    # for choropleth hover option, better to use scientific notation / few decimals
+    df_suicides["suicides per 100,000"] = df_suicides["suicides per 100,000"].apply(lambda x: "%.2f" % x).astype(float)
+
+    # add alpha-3 country codes for choropleth, resolving every unique country name only once
+    code_lookup = add_country_codes.get_alpha3_codes(df_suicides["country"])
+    df_suicides["code"] = code_lookup.codes
+    if len(code_lookup.unresolved) > 0:
+        logging.getLogger(__name__).warning(f"could not find alpha-3 code for countries:\n{code_lookup.unresolved}")
+
+    return df_suicides
+
+
+def clean_meta_data(meta_data_frame):
+    """
+    Clean the meta data we have. Remove an unnamed column, rename some other columns, drop some columns
+    :param meta_data_frame: pd dataframe
+    :return: cleaned pd dataframe
+    """
+    meta = meta_data_frame.loc[:, ~meta_data_frame.columns.str.contains("^Unnamed")]
+    meta = meta.rename(columns={"Country Code": "code", "Region": "region", "IncomeGroup": "income"})
+    meta = meta.drop(columns=["SpecialNotes", "TableName"], errors="ignore")
+    return meta
+
+
+def year_country_with_intervals(choropleth_df):
+    """
+    :param choropleth_df: pd dataframe, see reshape.choropleth_frame
+    :return: pd dataframe, the year-country data (see reshape.year_country_frame) with the exact 95% interval of the
+        female, male and overall rates in columns <rate>_lower and <rate>_upper
+    """
+    return uncertainty.add_rate_intervals(reshape.year_country_frame(choropleth_df))
+
+
+# the function that fills in missing populations, for every imputation strategy of impute.py
+IMPUTERS = {"global": impute_missing_populations, "interpolated": impute_missing_populations_interpolated}
+
+# the raw data we start from, and the stages of our pipeline. Each stage is a function of the outputs of the sources
+# and stages named in its inputs, its output is cached so that we only recompute stages whose inputs or code changed
+# (the code of the modules the function depends on, see stage_cache.code_files)
+SOURCES = [
+    Source("suicides", raw_data.SUICIDE_MEMBER, raw_data.read_raw, raw_data.fingerprint),
+    Source("population_raw", raw_data.POPULATION_MEMBER, raw_data.read_raw, raw_data.fingerprint),
+    Source("meta_raw", raw_data.META_DATA_MEMBER, raw_data.read_raw, raw_data.fingerprint),
+]
+STAGES = [
+    Stage("age_fractions", add_age_group_fractions, ["suicides"]),
+    Stage("age_stats", get_age_group_stats, ["age_fractions"]),
+    Stage("population", clean_population_stats, ["population_raw"]),
+    Stage("enriched", impute_missing_populations, ["suicides", "population", "age_stats"]),
+    Stage("meta", clean_meta_data, ["meta_raw"]),
+    Stage("choropleth", reshape.choropleth_frame, ["enriched"]),
+    Stage("year_country", year_country_with_intervals, ["choropleth"]),
+]
+# stages that fill in missing values, and the column they fill in (reported as nulls imputed)
+IMPUTED_COLUMNS = {"enriched": "population"}
+
+
+def stages_with_imputation(imputation="global", lean=False):
+    """
+    :param imputation: string, one of impute.STRATEGIES
+    :param lean: bool, use the versions of lean.py of the stages that handle the full suicide data
+    :return: list of Stage, our STAGES with the enriched stage filling in populations with this strategy
+    """
+    if imputation not in IMPUTERS:
+        raise ValueError(f"unknown imputation strategy {imputation}, choose from {list(IMPUTERS)}")
+    funcs = {"enriched": IMPUTERS[imputation]}
+    if lean:
+        from src.data import lean as lean_stages  # lean.py imports this module
+
+        funcs = {"age_fractions": lean_stages.add_age_group_fractions, "age_stats": lean_stages.get_age_group_stats,
+                 "enriched": lean_stages.IMPUTERS[imputation], "choropleth": lean_stages.choropleth_frame}
+    return [stage._replace(func=funcs[stage.name]) if stage.name in funcs else stage for stage in STAGES]
+
+
+def raw_sources(archive=raw_data.RAW_ARCHIVE):
+    """
+    :param archive: path to the zip archive with the raw data
+    :return: list of Source, our SOURCES read from that archive
+    """
+    return [source._replace(reader=partial(source.reader, archive=archive),
+                            fingerprint=partial(source.fingerprint, archive=archive))
+            for source in SOURCES]
+
+
+def dataset_sources(paths):
+    """
+    :param paths: dictionary, name of a stage -> path of a processed .feather, .parquet or .csv file with its output
+    :return: list of Source, to read the output of those stages from file instead of computing it
+    """
+    return [Source(name, str(path), load_dataset.read_dataset) for name, path in paths.items()]
+
+
+def upstream_stages(targets, source_names, all_stages=STAGES):
+    """
+    :param targets: list of names of stages
+    :param source_names: names of the sources we have, these are not computed
+    :param all_stages: list of Stage to choose from
+    :return: list of Stage, the targets and all stages they depend on, in the order of all_stages
+    """
+    stages = {stage.name: stage for stage in all_stages}
+    needed, to_visit = set(), list(targets)
+    while to_visit:
+        name = to_visit.pop()
+        if name in needed or name in source_names:
+            continue
+        if name not in stages:
+            raise KeyError(f"unknown stage {name}, choose from {list(stages)}")
+        needed.add(name)
+        to_visit.extend(stages[name].inputs)
+    return [stage for stage in all_stages if stage.name in needed]
+
+
+def parallel_runners(executor, jobs, imputation="global"):
+    """
+    Versions of the per-country stages that split their input by country over a process pool. Their output is the
+    same as that of the serial stages: rows are put back in the order the serial stage would give.
+    :param executor: concurrent.futures.ProcessPoolExecutor
+    :param jobs: int, number of shards to split the data into
+    :param imputation: string, one of impute.STRATEGIES, see stages_with_imputation
+    :return: dictionary, stage name -> function, to pass as runners to StageGraph
+    """
+    def enriched(suicide_df, df_population, df_age_statistics):
+        results, positions = parallel.map_shards(executor, jobs, IMPUTERS[imputation], suicide_df,
+                                                 shared=[df_population, df_age_statistics])
+        return parallel.combine_in_row_order(results, positions)
+
+    def choropleth(enriched_df):
+        results, _ = parallel.map_shards(executor, jobs, reshape.choropleth_frame, enriched_df)
+        # the order of the groupby in choropleth_frame (categoricals sort on their categories, like in the groupby)
+        return parallel.combine_ordered(results, lambda df: np.lexsort(
+            [df[column].cat.codes if df[column].dtype.name == "category" else df[column]
+             for column in ["country", "sex", "year"]]))
+
+    def year_country(choropleth_df):
+        results, _ = parallel.map_shards(executor, jobs, year_country_with_intervals, choropleth_df)
+        return parallel.combine_ordered(results, lambda df: reshape.year_country_order(
+            df["year"].values, df["country"].values, df["code"].values))
+
+    return {"enriched": enriched, "choropleth": choropleth, "year_country": year_country}
+
+
+def instrumented_graph(profiler, force=False, runners=None, sources=SOURCES, stages=STAGES, release=False):
+    """
+    :param profiler: StageProfiler, records every source that is read and every stage that is run
+    :param force: bool, recompute every stage
+    :param runners: dictionary, stage name -> function to run instead of the func of the stage
+    :param sources: list of Source
+    :param stages: list of Stage
+    :param release: bool, let go of every output once the stages that need it have run, see StageGraph
+    :return: StageGraph of the sources and stages
+    """
+    runners = runners or {}
+    sources = [source._replace(reader=profiler.wrap(source.name, source.reader)) for source in sources]
+    runners = {stage.name: profiler.wrap(stage.name, runners.get(stage.name, stage.func),
+                                         IMPUTED_COLUMNS.get(stage.name))
+               for stage in stages}
+    return StageGraph(sources, stages, force=force, runners=runners, release=release)
+
+
+def region_lookup(choropleth_df, meta_df):
+    """
+    :param choropleth_df: pd dataframe with columns country and code
+    :param meta_df: pd dataframe with columns code and region, see clean_meta_data
+    :return: dictionary, country -> its region (countries without one are left out)
+    """
+    codes = choropleth_df[["country", "code"]].drop_duplicates("country").astype(object)
+    regions = meta_df[["code", "region"]].dropna().drop_duplicates("code").astype(object)
+    return dict(codes.merge(regions, on="code")[["country", "region"]].values)
+
+
+def save_partitioned(data_frame, output_file, partition_by, regions=None):
+    """
+    Save a dataframe partitioned on disk (see hive.py) in a directory named like output_file without its extension.
+    A region partition column is added from the country column
+    :param data_frame: pd dataframe
+    :param output_file: path the dataframe would be saved to unpartitioned
+    :param partition_by: list of columns to partition on, year and/or region
+    :param regions: dictionary, country -> region, see region_lookup. Needed to partition on region
+    :return: Path of the directory of the dataset
+    """
+    if "region" in partition_by and "region" not in data_frame:
+        data_frame = data_frame.assign(region=data_frame["country"].astype(object).map(regions))
+    directory = Path(output_file).with_suffix("")
+    n_partitions = hive.write_partitioned(data_frame, directory, partition_by)
+    logging.getLogger(__name__).info(f"saved {len(data_frame)} rows in {n_partitions} partitions to {directory}")
+    return directory
+
+
+def run_stages(outputs, sources, profiler, force=False, jobs=1, imputation="global", partition_by=(), lean=False):
+    """
+    Compute the output of some stages, and of the stages they depend on that are not in sources, and save them
+    :param outputs: list of (name of a stage, path of the file to save its output to, file format)
+    :param sources: list of Source
+    :param profiler: StageProfiler, records every source that is read and every stage that is run
+    :param force: bool, recompute every stage
+    :param jobs: int, number of processes to run the per-country stages on
+    :param imputation: string, how to fill in missing populations, one of impute.STRATEGIES
+    :param partition_by: list of columns, year and/or region. If given, the outputs with a year and country column
+        are saved partitioned on these (in parquet files, see save_partitioned), the others as usual
+    :param lean: bool, run the stages of lean.py, that copy less and downcast the enriched data, and let go of every
+        output as soon as possible, to keep the peak memory down. Only with jobs=1
+    :return: list of names of the stages that were recomputed
+    """
+    logger = logging.getLogger(__name__)
+    if lean and jobs > 1:
+        raise ValueError("the lean stages only run in a single process")
+    targets = [name for name, _, _ in outputs] + (["choropleth", "meta"] if "region" in partition_by else [])
+    stages = upstream_stages(targets, [source.name for source in sources], stages_with_imputation(imputation, lean))
+    executor = ProcessPoolExecutor(jobs) if jobs > 1 else None
+    try:
+        runners = parallel_runners(executor, jobs, imputation) if executor is not None else None
+        graph = instrumented_graph(profiler, force=force, runners=runners, sources=sources, stages=stages,
+                                   release=lean)
+        regions = region_lookup(graph.get("choropleth"), graph.get("meta")) if "region" in partition_by else None
+        for name, output_file, output_format in outputs:
+            data_frame = graph.get(name)
+            Path(output_file).parent.mkdir(parents=True, exist_ok=True)
+            if partition_by and {"year", "country"} <= set(data_frame.columns):
+                save_partitioned(data_frame, output_file, partition_by, regions)
+                continue
+            logger.info(f"saving {name} dataframe to {output_file}")
+            load_dataset.save_dataset(data_frame, output_file, output_format)
+            logger.info(f"saved {name} dataframe")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    logger.info(f"recomputed stages: {', '.join(graph.recomputed) or 'none'}")
+    return graph.recomputed
+
+
+def process_in_partitions(output_files, output_format, chunksize, profiler, archive=raw_data.RAW_ARCHIVE,
+                          imputation="global"):
+    """
+    Run the pipeline out-of-core: the suicide data is streamed from the raw archive twice, in partitions of complete
+    countries. The first pass computes the age group statistics (a reduction over all countries), the second pass fills
+    in missing populations and makes the choropleth and year-country data one partition at a time, appending every
+    partition to the output files.
+    :param output_files: dictionary, name of output (enriched, meta, choropleth, year_country) -> path
+    :param output_format: string, "csv" or "parquet"
+    :param chunksize: int, number of rows of the suicide data to read at a time
+    :param profiler: StageProfiler, records every call of a stage
+    :param archive: path to the zip archive with the raw data
+    :param imputation: string, how to fill in missing populations, one of impute.STRATEGIES. The interpolated
+        strategy only needs the data of the country itself, so it gives the same results per partition
+    """
+    logger = logging.getLogger(__name__)
+    read_raw = profiler.wrap("read_raw", raw_data.read_raw)
+    enrich = profiler.wrap("enriched", IMPUTERS[imputation], IMPUTED_COLUMNS["enriched"])
+    choropleth_frame = profiler.wrap("choropleth", reshape.choropleth_frame)
+    year_country_frame = profiler.wrap("year_country", year_country_with_intervals)
+
+    def suicide_partitions():
+        return partitioned.iter_partitions(raw_data.read_raw(raw_data.SUICIDE_MEMBER, archive, chunksize=chunksize))
+
+    logger.info("first pass: computing age group statistics")
+    age_stats = profiler.call("age_stats", get_age_group_stats_partitioned, [suicide_partitions()])
+    df_pop = profiler.call("population", clean_population_stats, [read_raw(raw_data.POPULATION_MEMBER, archive)])
+
+    logger.info("second pass: processing the data per partition")
+    for output_file in output_files.values():
+        Path(output_file).parent.mkdir(parents=True, exist_ok=True)
+    writers = {name: partitioned.PartitionWriter(output_files[name], output_format)
+               for name in ["enriched", "choropleth", "year_country"]}
+    try:
+        for partition in suicide_partitions():
+            enriched_df = enrich(partition, df_pop, age_stats)
+            writers["enriched"].write(enriched_df)
+            choropleth_df = choropleth_frame(enriched_df)
+            if len(choropleth_df) > 0:
+                writers["choropleth"].write(choropleth_df)
+                writers["year_country"].write(year_country_frame(choropleth_df))
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    meta = profiler.call("meta", clean_meta_data, [read_raw(raw_data.META_DATA_MEMBER, archive)])
+    load_dataset.save_dataset(meta, output_files["meta"], output_format)
+    for name, writer in writers.items():
+        logger.info(f"saved {writer.rows} rows of {name} data to {writer.path}")
+
+
+def report_profile(profiler, profile_out=None):
+    """
+    Print a table of the resource use of every stage, and optionally write it to a file
+    :param profiler: StageProfiler
+    :param profile_out: path of a .json or .csv file, or None
+    """
+    summary = profiler.summary()
+    if len(summary) == 0:
+        click.echo("no stages ran, everything was loaded from the cache")
+        return
+    click.echo(summary.to_string(index=False, float_format=lambda x: "-" if np.isnan(x) else f"{x:.3f}"))
+    if profile_out is not None:
+        profiler.write(profile_out)
+        logging.getLogger(__name__).info(f"wrote stage profile to {profile_out}")
@@ -0,0 +1,86 @@
+"""
+Read the raw data straight from data/raw/data.zip, without extracting it to disk first. Every raw file has a declared
+schema: only the columns we use are parsed (usecols), and they are parsed into compact dtypes (categoricals for the
+repetitive string columns, small integers for the year, float32 for the suicide counts).
+If the archive is not there we fall back to the extracted file next to where the archive would be.
+"""
+import zipfile
+from pathlib import Path
+
+import pandas as pd
+
+from src.data.stage_cache import hash_file
+
+RAW_ARCHIVE = "./data/raw/data.zip"
+SUICIDE_MEMBER = "who_suicide_statistics.csv"
+POPULATION_MEMBER = "total_pop_1960_2018.csv"
+META_DATA_MEMBER = "meta_data.csv"
+
+# keyword arguments for pd.read_csv per raw file.
+# suicides_no is a float (it has missing values) but always a count well below 2 ** 24, so float32 stores it exactly.
+# population is not: the number of people in an age group can exceed 2 ** 24, so we keep it as float64, float32 would
+# round it. Nullable integers are not an option either, as we impute (fractional) populations later on.
+RAW_SCHEMAS = {
+    SUICIDE_MEMBER: dict(
+        usecols=["country", "year", "sex", "age", "suicides_no", "population"],
+        dtype={"country": "category", "year": "int16", "sex": "category", "age": "category",
+               "suicides_no": "float32", "population": "float64"},
+    ),
+    POPULATION_MEMBER: dict(
+        skiprows=4,
+        # skips Country Code, Indicator Name, Indicator Code and the empty column at the end
+        usecols=lambda column: column == "Country Name" or column.isdigit(),
+    ),
+    META_DATA_MEMBER: dict(
+        usecols=["Country Code", "Region", "IncomeGroup"],
+        dtype={"Region": "category", "IncomeGroup": "category"},
+    ),
+}
+
+
+def _extracted_path(member, archive):
+    return Path(archive).parent / member
+
+
+def read_raw(member, archive=RAW_ARCHIVE, **kwargs):
+    """
+    Read one of the raw data files with its schema, streaming it from the zip archive
+    :param member: string, name of the file in the archive, one of RAW_SCHEMAS
+    :param archive: path to the zip archive with the raw data
+    :param kwargs: extra keyword arguments for pd.read_csv, these override the schema (e.g. chunksize)
+    :return: pd dataframe, or an iterator of dataframes if chunksize is given
+    """
+    read_kwargs = dict(RAW_SCHEMAS[member], **kwargs)
+    if not Path(archive).is_file():
+        return pd.read_csv(_extracted_path(member, archive), **read_kwargs)
+
+    with zipfile.ZipFile(archive) as zipped:
+        if "chunksize" not in read_kwargs:
+            with zipped.open(member) as f:
+                return pd.read_csv(f, **read_kwargs)
+
+    return _read_raw_chunks(member, archive, read_kwargs)
+
+
+def _read_raw_chunks(member, archive, read_kwargs):
+    """
+    Generator over chunks of a member of the archive, keeps the archive open until all chunks are read
+    """
+    with zipfile.ZipFile(archive) as zipped, zipped.open(member) as f:
+        for chunk in pd.read_csv(f, **read_kwargs):
+            yield chunk
+
+
+def fingerprint(member, archive=RAW_ARCHIVE):
+    """
+    Cheap fingerprint of the contents of a raw file, for the stage cache. For a member of the archive we use the crc
+    and size stored in the archive, so nothing needs to be decompressed.
+    :param member: string, name of the file in the archive
+    :param archive: path to the zip archive with the raw data
+    :return: string
+    """
+    if not Path(archive).is_file():
+        return hash_file(_extracted_path(member, archive))
+    with zipfile.ZipFile(archive) as zipped:
+        info = zipped.getinfo(member)
+    return f"zip-{info.CRC:08x}-{info.file_size}"
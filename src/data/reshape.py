@@ -0,0 +1,113 @@
+"""
+Vectorised versions of prepare_data_for_choropleth and make_df_nicer_format in pipeline.py. They return the same
+columns and rows, but without the python-level work: the rates are rounded with numpy instead of formatting every
+value as a string, and the year-country table is made with a single unstack over a (year, country, code) index instead
+of three pivots on a concatenated string key that has to be split up again afterwards.
+"""
+import logging
+
+import numpy as np
+import pandas as pd
+
+from src.data import add_country_codes
+
+# value column in the choropleth dataframe -> prefix/suffix of the per-sex columns in the year-country dataframe
+_SEX_COLUMNS = {
+    "suicides per 100,000": "{sex}_rate",
+    "population": "{sex}_pop",
+    "suicides_no": "suicide_num_{s}",
+}
+_SEXES = ["female", "male"]
+
+
+def round_rates(rates, decimals=2):
+    """
+    Round rates for display. This gives the same result as formatting them with "%.2f" and parsing them again, except
+    on some ties: np.round scales by 10 ** decimals first and rounds half to even, while "%.2f" rounds the exact binary
+    value, e.g. 2.675 (stored as 2.67499999...) becomes 2.68 here and 2.67 with "%.2f"
+    :param rates: pd Series or numpy array of floats
+    :param decimals: int, number of decimals to round to
+    :return: rounded rates, same type as rates
+    """
+    return np.round(rates, decimals)
+
+
+def choropleth_frame(enriched_df):
+    """
+    Same as pipeline.prepare_data_for_choropleth: total suicides, population and suicide rate per year, sex and
+    country, with an alpha-3 country code and without the (thin) years 2015 and 2016
+    :param enriched_df: pd dataframe, our enriched data
+    :return: pd dataframe
+    """
+    df_suicides = enriched_df.dropna(how="any")
+    df_suicides = df_suicides.groupby(["year", "sex", "country"], observed=True)[["suicides_no", "population"]] \
+        .sum().reset_index()
+    return choropleth_rates(df_suicides)
+
+
+def choropleth_rates(df_suicides):
+    """
+    The second half of choropleth_frame
+    :param df_suicides: pd dataframe, total suicides and population per year, sex and country
+    :return: pd dataframe, without the years 2015 and 2016 and with the rate and the alpha-3 code of every row
+    """
+    df_suicides = df_suicides[df_suicides["year"] < 2015].reset_index(drop=True)
+
+    population = df_suicides["population"].where(df_suicides["population"] != 0)  # otherwise get inf for the rate
+    df_suicides["population"] = population
+    df_suicides["suicides per 100,000"] = round_rates(df_suicides["suicides_no"] / population * 100000)
+
+    code_lookup = add_country_codes.get_alpha3_codes(df_suicides["country"])
+    df_suicides["code"] = code_lookup.codes
+    if len(code_lookup.unresolved) > 0:
+        logging.getLogger(__name__).warning(f"could not find alpha-3 code for countries:\n{code_lookup.unresolved}")
+
+    return df_suicides
+
+
+def year_country_order(years, countries, codes):
+    """
+    make_df_nicer_format sorts its rows on the string "year_country_code". Get the same row order without building
+    that string for every row: sort the unique (country, code) pairs on their string key, and then sort the rows on
+    year and the rank of their pair. This assumes 4-digit years, like the original.
+    :return: numpy array, the positions of the rows in sorted order
+    """
+    pair_index, unique_pairs = pd.factorize(pd.MultiIndex.from_arrays([countries, codes]))
+    pair_keys = np.array([f"{country}_{code}" for country, code in unique_pairs])
+    pair_rank = np.empty(len(pair_keys), dtype=np.int64)
+    pair_rank[np.argsort(pair_keys, kind="stable")] = np.arange(len(pair_keys))
+    return np.lexsort((pair_rank[pair_index], years))
+
+
+def year_country_frame(choropleth_df):
+    """
+    Same as pipeline.make_df_nicer_format: one row for every (year, country) combination, with columns for the
+    male and female suicide numbers, rates and populations and the combined rate. The year, country and code columns
+    keep their dtype (make_df_nicer_format turns them into strings).
+    :param choropleth_df: pd dataframe, output of choropleth_frame
+    :return: pd dataframe
+    """
+    keys = ["year", "country", "code"]
+    wide = choropleth_df.set_index(keys + ["sex"])[list(_SEX_COLUMNS)].unstack("sex")
+
+    columns = {}
+    for value_column, name in _SEX_COLUMNS.items():
+        for sex in _SEXES:
+            columns[name.format(sex=sex, s=sex[0])] = wide[(value_column, sex)].values
+
+    combined = pd.DataFrame(columns)
+    index = wide.index
+    for level, key in enumerate(keys):
+        combined[key] = index.get_level_values(level)
+
+    order = year_country_order(combined["year"].values, combined["country"].values, combined["code"].values)
+    combined = combined.take(order)
+    combined.index = np.arange(len(combined))
+
+    combined["female_pop"] = combined["female_pop"].where(combined["female_pop"] != 0)
+    combined["male_pop"] = combined["male_pop"].where(combined["male_pop"] != 0)
+    combined["population"] = combined["female_pop"] + combined["male_pop"]
+    combined["suicides_no"] = combined["suicide_num_f"] + combined["suicide_num_m"]
+    combined["overall_rate"] = combined["suicides_no"] / combined["population"] * 100000
+
+    return combined[list(columns) + keys + ["overall_rate", "population", "suicides_no"]]
@@ -0,0 +1,231 @@
+"""
+A small dependency graph of pipeline stages, where the output of every stage is cached on disk. The cache key of a
+stage is a hash of the source code of the modules its function depends on (its own module and every module of the same
+package that it imports, directly or through other modules, see code_files) and of the keys of its inputs, and the key
+of a raw input file is a hash of its contents. A change in a raw file or in the code therefore only invalidates the
+stages downstream of it, and running the pipeline again only recomputes those stages. Everything else is loaded from
+the cache, and only when it is actually needed.
+"""
+import ast
+import hashlib
+import importlib.util
+import inspect
+import logging
+from collections import Counter, namedtuple
+from functools import lru_cache
+from pathlib import Path
+
+import pandas as pd
+
+STAGE_CACHE_DIR = "./data/interim/stage_cache"
+
+# a raw input of the pipeline: name, path of the file, a function reading that path and optionally a function
+# returning a fingerprint of the contents at that path (default: hash of the file contents)
+Source = namedtuple("Source", ["name", "path", "reader", "fingerprint"])
+Source.__new__.__defaults__ = (None,)
+
+# a stage: name, function producing its output, names of the inputs (positional arguments of func), and optionally
+# some more functions whose modules should be part of the cache key, if the module of func does not import them
+Stage = namedtuple("Stage", ["name", "func", "inputs", "depends_on"])
+Stage.__new__.__defaults__ = ((),)
+
+logger = logging.getLogger(__name__)
+
+
+def hash_file(path, chunk_size=1 << 20):
+    """
+    :param path: path to a file
+    :param chunk_size: int, number of bytes to read at a time
+    :return: string, hex digest of the sha256 hash of the file contents
+    """
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def imported_modules(path):
+    """
+    :param path: path of the source file of a module
+    :return: set of the names of the modules its import statements (also those inside functions) may import, e.g.
+        src.data and src.data.lean for "from src.data import lean"
+    """
+    stat = Path(path).stat()
+    return _imported_modules(str(path), stat.st_mtime_ns, stat.st_size)
+
+
+@lru_cache(maxsize=None)
+def _imported_modules(path, mtime_ns, size):
+    """
+    imported_modules of a version of a file, the file is only parsed again when it changes
+    """
+    names = set()
+    for node in ast.walk(ast.parse(Path(path).read_text(encoding="utf-8"))):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names.add(node.module)
+            names.update(f"{node.module}.{alias.name}" for alias in node.names)
+    return frozenset(names)
+
+
+def code_files(funcs):
+    """
+    The source files some functions depend on: those of their own modules, and of the modules of the same top-level
+    package that those import, and so on
+    :param funcs: list of functions
+    :return: dictionary, module name -> path of its source file, sorted on name
+    """
+    files, todo = {}, []
+    for func in funcs:
+        module = inspect.getmodule(func)
+        todo.append((module.__name__, inspect.getsourcefile(module)))
+    while todo:
+        name, path = todo.pop()
+        if name in files or path is None:
+            continue
+        files[name] = path
+        package = name.split(".")[0]
+        for imported in imported_modules(path):
+            if imported.split(".")[0] != package or imported in files:
+                continue
+            try:
+                spec = importlib.util.find_spec(imported)
+            except (ImportError, ValueError):  # e.g. a function imported from a module, not a module
+                spec = None
+            if spec is not None and spec.origin is not None and Path(spec.origin).is_file():
+                todo.append((imported, spec.origin))
+    return {name: files[name] for name in sorted(files)}
+
+
+def hash_code(*funcs):
+    """
+    :param funcs: functions
+    :return: string, hex digest of the sha256 hash of the source files they depend on, see code_files
+    """
+    sha = hashlib.sha256()
+    for name, path in code_files(funcs).items():
+        sha.update(f"{name}:{hash_file(path)}".encode("utf-8"))
+    return sha.hexdigest()
+
+
+class StageGraph:
+    """
+    Runs the stages needed for a set of targets, loading stage outputs from the cache directory where possible.
+    """
+
+    def __init__(self, sources, stages, cache_dir=STAGE_CACHE_DIR, force=False, runners=None, release=False):
+        """
+        :param sources: list of Source
+        :param stages: list of Stage
+        :param cache_dir: directory to store cached stage outputs in
+        :param force: bool, if True ignore the cache and recompute every stage (outputs are still written to the cache)
+        :param runners: dictionary, stage name -> function to run instead of the func of the stage, e.g. a parallel
+            version of it. It must give exactly the same output, as it is not part of the cache key.
+        :param release: bool, only hold on to an output until every stage that takes it as input got it, to keep memory
+            use down. An output that is asked for again after that is read again (from the cache, for a stage)
+        """
+        self.sources = {source.name: source for source in sources}
+        self.stages = {stage.name: stage for stage in stages}
+        overlap = set(self.sources) & set(self.stages)
+        assert not overlap, f"names used both for a source and a stage: {overlap}"
+        for stage in stages:
+            unknown = [name for name in stage.inputs if name not in self.sources and name not in self.stages]
+            assert not unknown, f"stage {stage.name} has unknown inputs {unknown}"
+
+        self.cache_dir = Path(cache_dir)
+        self.force = force
+        self.runners = runners or {}
+        self.release = release
+        self._consumers = Counter(name for stage in stages for name in stage.inputs)  # stages still to get an output
+        self._keys = {}
+        self._results = {}
+        self.recomputed = []  # names of stages that were not loaded from the cache in this run
+
+    def key(self, name, _visiting=()):
+        """
+        :param name: name of a source or a stage
+        :return: string, cache key of that source or stage
+        """
+        if name in self._keys:
+            return self._keys[name]
+        if name in _visiting:
+            raise ValueError(f"cycle in stage graph: {' -> '.join(_visiting + (name,))}")
+
+        if name in self.sources:
+            source = self.sources[name]
+            key = (source.fingerprint or hash_file)(source.path)
+        else:
+            stage = self.stages[name]
+            sha = hashlib.sha256(name.encode("utf-8"))
+            sha.update(hash_code(stage.func, *stage.depends_on).encode("utf-8"))
+            for input_name in stage.inputs:
+                sha.update(self.key(input_name, _visiting + (name,)).encode("utf-8"))
+            key = sha.hexdigest()
+
+        self._keys[name] = key
+        return key
+
+    def _artifact_path(self, name):
+        return self.cache_dir / f"{name}-{self.key(name)[:20]}.pkl"
+
+    def is_cached(self, name):
+        """
+        :param name: name of a stage
+        :return: bool, whether an up-to-date output of this stage is in the cache
+        """
+        return not self.force and self._artifact_path(name).is_file()
+
+    def get(self, name):
+        """
+        Get the output of a source or stage, computing (and caching) it and any stale stages upstream if needed
+        :param name: name of a source or a stage
+        :return: the output, usually a pandas dataframe
+        """
+        if name in self._results:
+            return self._results[name]
+
+        if name in self.sources:
+            source = self.sources[name]
+            logger.info(f"reading {name} from {source.path}")
+            result = source.reader(source.path)
+        elif self.is_cached(name):
+            logger.info(f"stage {name} is up to date, loading it from the cache")
+            result = pd.read_pickle(self._artifact_path(name))
+            self._consumed(self.stages[name].inputs)
+        else:
+            stage = self.stages[name]
+            inputs = [self.get(input_name) for input_name in stage.inputs]
+            logger.info(f"running stage {name}")
+            result = self.runners.get(name, stage.func)(*inputs)
+            del inputs
+            self._consumed(stage.inputs)
+            self._store(name, result)
+            self.recomputed.append(name)
+
+        if not self.release or self._consumers[name] > 0:
+            self._results[name] = result
+        return result
+
+    def _consumed(self, names):
+        """
+        A stage got (or no longer needs) its inputs, with release let go of the ones no other stage needs any more
+        """
+        for name in names:
+            self._consumers[name] -= 1
+            if self.release and self._consumers[name] <= 0:
+                self._results.pop(name, None)
+
+    def _store(self, name, result):
+        """
+        Write the output of a stage to the cache, removing outdated outputs of the same stage
+        """
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self._artifact_path(name)
+        for old_path in self.cache_dir.glob(f"{name}-*.pkl"):
+            if old_path != path:
+                old_path.unlink()
+        tmp_path = path.with_name(path.name + ".tmp")
+        pd.to_pickle(result, str(tmp_path))
+        tmp_path.replace(path)
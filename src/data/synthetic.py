@@ -0,0 +1,173 @@
+"""
+Generate synthetic raw data with the same shape as our real raw data, at any scale: WHO-style suicide statistics (one
+row per country, year, sex and age group), a World Bank-style wide population file and World Bank-style meta data.
+Useful for tests and benchmarks that should not depend on the real data, and for checking how the pipeline behaves on
+data that is much larger than the real thing.
+
+The first countries get real country names (so that they resolve to alpha-3 codes without a fuzzy search), after that
+we make up sub-national units like "France 2", which share the code of their country.
+"""
+import io
+import zipfile
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+import pycountry
+
+from src.data import raw_data
+
+SEXES = ["female", "male"]
+AGE_GROUPS = ["15-24 years", "25-34 years", "35-54 years", "5-14 years", "55-74 years", "75+ years"]
+
+# rough fraction of the population in each age group (same order as AGE_GROUPS) and suicides per 100,000 per year
+_AGE_FRACTIONS = np.array([0.075, 0.075, 0.14, 0.08, 0.09, 0.025])
+_AGE_RATES = np.array([8., 11., 14., 0.8, 16., 22.])
+_SEX_RATE_FACTOR = {"female": 0.35, "male": 1.3}
+
+# the size of the real data set, in countries and years
+REAL_SIZE = (141, 38)
+
+SyntheticData = namedtuple("SyntheticData", ["suicides", "population", "meta", "codes"])
+
+
+def country_names(n_countries):
+    """
+    :param n_countries: int, number of countries
+    :return: (list of names, list of alpha-3 codes)
+    """
+    countries = sorted(pycountry.countries, key=lambda country: country.name)
+    names, codes = [], []
+    for i in range(n_countries):
+        country = countries[i % len(countries)]
+        copy_number = i // len(countries)
+        names.append(country.name if copy_number == 0 else f"{country.name} {copy_number + 1}")
+        codes.append(country.alpha_3)
+    return names, codes
+
+
+def make_suicide_data(names, years, missing_population=0.12, missing_suicides=0.05, seed=0):
+    """
+    WHO-style suicide statistics, sorted by country, year, sex and age like the real data
+    :param names: list of country names
+    :param years: list of ints, years
+    :param missing_population: float, fraction of (country, year) combinations without population data
+    :param missing_suicides: float, fraction of (country, year) combinations without suicide numbers
+    :param seed: int, random seed
+    :return: pd dataframe with columns country, year, sex, age, suicides_no, population
+    """
+    rng = np.random.RandomState(seed)
+    n_countries, n_years, n_groups = len(names), len(years), len(SEXES) * len(AGE_GROUPS)
+    shape = (n_countries, n_years, len(SEXES), len(AGE_GROUPS))
+
+    base_population = np.exp(rng.uniform(np.log(1e5), np.log(2e8), n_countries))
+    growth = 1 + rng.normal(0.01, 0.005, n_countries)
+    total = base_population[:, None] * growth[:, None] ** np.arange(n_years)[None, :]
+    fractions = _AGE_FRACTIONS[None, None, None, :] * rng.lognormal(0, 0.1, shape)
+    population = np.round(total[:, :, None, None] * fractions / 100) * 100
+
+    rate = _AGE_RATES[None, None, None, :] * np.array([_SEX_RATE_FACTOR[sex] for sex in SEXES])[None, None, :, None]
+    rate = rate * rng.lognormal(0, 0.4, (n_countries, 1, 1, 1))
+    suicides = rng.poisson(population * rate / 100000).astype(float)
+
+    # data is missing for complete (country, year) combinations, as in the real data
+    population[rng.uniform(size=(n_countries, n_years)) < missing_population] = np.nan
+    suicides[rng.uniform(size=(n_countries, n_years)) < missing_suicides] = np.nan
+
+    return pd.DataFrame({
+        "country": np.repeat(names, n_years * n_groups),
+        "year": np.tile(np.repeat(years, n_groups), n_countries),
+        "sex": np.tile(np.repeat(SEXES, len(AGE_GROUPS)), n_countries * n_years),
+        "age": np.tile(AGE_GROUPS, n_countries * n_years * len(SEXES)),
+        "suicides_no": suicides.ravel(),
+        "population": population.ravel(),
+    })
+
+
+def make_population_data(names, codes, years, suicide_df, missing=0.02, seed=0):
+    """
+    World Bank-style wide population data: one row per country, one column per year. The totals are a bit off from the
+    sum over the age groups in the suicide data, like in the real data.
+    :param names: list of country names
+    :param codes: list of alpha-3 codes
+    :param years: list of ints, years
+    :param suicide_df: pd dataframe, output of make_suicide_data
+    :param missing: float, fraction of missing values
+    :param seed: int, random seed
+    :return: pd dataframe with columns Country Name, Country Code, Indicator Name, Indicator Code and one per year
+    """
+    rng = np.random.RandomState(seed + 1)
+    n_groups = len(SEXES) * len(AGE_GROUPS)
+    totals = suicide_df["population"].values.reshape(len(names), len(years), n_groups).sum(axis=2)
+    # for the (country, year) combinations where the age groups are missing, interpolate from the other years
+    totals = pd.DataFrame(totals).interpolate(axis=1, limit_direction="both").values
+    totals = np.round(totals * rng.normal(1, 0.01, totals.shape))
+    totals[rng.uniform(size=totals.shape) < missing] = np.nan
+
+    df_population = pd.DataFrame(totals, columns=[str(year) for year in years])
+    df_population.insert(0, "Country Name", names)
+    df_population.insert(1, "Country Code", codes)
+    df_population.insert(2, "Indicator Name", "Population, total")
+    df_population.insert(3, "Indicator Code", "SP.POP.TOTL")
+    return df_population
+
+
+def make_meta_data(codes, seed=0):
+    """
+    World Bank-style country meta data
+    :param codes: list of alpha-3 codes
+    :param seed: int, random seed
+    :return: pd dataframe with columns Country Code, Region, IncomeGroup, SpecialNotes, TableName
+    """
+    rng = np.random.RandomState(seed + 2)
+    unique_codes = list(dict.fromkeys(codes))
+    regions = ["Europe & Central Asia", "Latin America & Caribbean", "East Asia & Pacific", "Sub-Saharan Africa",
+               "Middle East & North Africa", "North America", "South Asia"]
+    incomes = ["High income", "Upper middle income", "Lower middle income", "Low income"]
+    return pd.DataFrame({
+        "Country Code": unique_codes,
+        "Region": rng.choice(regions, len(unique_codes)),
+        "IncomeGroup": rng.choice(incomes, len(unique_codes)),
+        "SpecialNotes": "",
+        "TableName": [pycountry.countries.get(alpha_3=code).name for code in unique_codes],
+    })
+
+
+def make_synthetic_data(n_countries=REAL_SIZE[0], n_years=REAL_SIZE[1], last_year=2016, seed=0):
+    """
+    Make a full synthetic raw data set
+    :param n_countries: int, number of countries
+    :param n_years: int, number of years, ending at last_year
+    :param last_year: int, last year in the data
+    :param seed: int, random seed
+    :return: SyntheticData namedtuple with the suicide, population and meta dataframes and the codes of the countries
+        (a dictionary of country name -> alpha-3 code)
+    """
+    names, codes = country_names(n_countries)
+    years = list(range(last_year - n_years + 1, last_year + 1))
+    suicides = make_suicide_data(names, years, seed=seed)
+    population = make_population_data(names, codes, years, suicides, seed=seed)
+    meta = make_meta_data(codes, seed=seed)
+    return SyntheticData(suicides=suicides, population=population, meta=meta, codes=dict(zip(names, codes)))
+
+
+def _world_bank_csv(data_frame):
+    """
+    World Bank csv files start with a few lines of information before the header, and end every line with a comma
+    """
+    buffer = io.StringIO()
+    buffer.write('"Data Source","World Development Indicators",\n\n"Last Updated Date","2019-10-02",\n\n')
+    data_frame.assign(**{"": np.nan}).to_csv(buffer, index=False, quoting=1)
+    return buffer.getvalue()
+
+
+def write_raw_archive(data, archive):
+    """
+    Write a synthetic data set as a zip archive that looks like data/raw/data.zip
+    :param data: SyntheticData, output of make_synthetic_data
+    :param archive: path of the zip archive to write
+    """
+    with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_DEFLATED) as zipped:
+        zipped.writestr(raw_data.SUICIDE_MEMBER, data.suicides.to_csv(index=False))
+        zipped.writestr(raw_data.POPULATION_MEMBER, _world_bank_csv(data.population))
+        zipped.writestr(raw_data.META_DATA_MEMBER, data.meta.assign(**{"": np.nan}).to_csv(index=False, quoting=1))
@@ -0,0 +1,161 @@
+"""
+Uncertainty of the suicide rates. We treat the number of suicides in a group as a Poisson count, so that a rate of
+suicides per 100,000 has an interval around it that is wide for small countries and narrow for large ones:
+
+- exact (Garwood) intervals, from quantiles of the gamma distribution. Cheap, and exact for a rate of a single count,
+  which also covers rates of sums of counts (a sum of Poisson counts is a Poisson count)
+- Monte Carlo intervals (a parametric bootstrap): draw Poisson counts around the observed ones for every cell of a
+  group, sum them per group and take quantiles of the resulting rates. Seedable, and also works for statistics that
+  are not a single count, e.g. (in the future) age-standardised rates
+
+Monte Carlo draws are made for a chunk of groups at a time, so that the draws in memory stay within max_bytes however
+many groups and draws there are: millions of draws over all country-years take a few tens of MB.
+
+    rate_intervals(enriched_df, by=["country", "year", "sex"], method="monte_carlo", n_draws=10000, seed=1)
+"""
+import numpy as np
+
+RATE_SCALE = 100000  # suicides per 100,000 people
+DEFAULT_LEVEL = 0.95
+DEFAULT_MAX_BYTES = 64 * 2 ** 20
+METHODS = ("exact", "monte_carlo")
+
+# rate in the year-country data -> its suicide number and population columns
+YEAR_COUNTRY_RATES = {
+    "female_rate": ("suicide_num_f", "female_pop"),
+    "male_rate": ("suicide_num_m", "male_pop"),
+    "overall_rate": ("suicides_no", "population"),
+}
+
+
+def _valid(counts, populations):
+    with np.errstate(invalid="ignore"):
+        return np.isfinite(counts) & (counts >= 0) & np.isfinite(populations) & (populations > 0)
+
+
+def poisson_intervals(counts, populations, level=DEFAULT_LEVEL):
+    """
+    Exact (Garwood) confidence intervals of rates, treating the counts as Poisson
+    :param counts: numpy array of suicide numbers
+    :param populations: numpy array of populations
+    :param level: float, confidence level, e.g. 0.95
+    :return: (numpy array, lower bounds, numpy array, upper bounds) in suicides per 100,000, nan where the count or
+        population is missing (or the population is 0)
+    """
+    from scipy.special import gammaincinv
+
+    counts = np.asarray(counts, dtype=np.float64)
+    populations = np.asarray(populations, dtype=np.float64)
+    valid = _valid(counts, populations)
+    safe_counts = np.where(valid, counts, 0.)
+    tail = (1 - level) / 2
+    with np.errstate(invalid="ignore"):
+        lower = np.where(safe_counts > 0, gammaincinv(np.maximum(safe_counts, 1e-300), tail), 0.)
+    upper = gammaincinv(safe_counts + 1, 1 - tail)
+    scale = np.where(valid, RATE_SCALE / np.where(valid, populations, 1.), np.nan)
+    return lower * scale, upper * scale
+
+
+def _chunks(group_sizes, cells_per_chunk):
+    """
+    :param group_sizes: numpy array, number of cells of every group
+    :param cells_per_chunk: int, maximum number of cells in a chunk (a chunk always holds at least one group)
+    :return: list of (first group, end group) of consecutive groups with at most cells_per_chunk cells together
+    """
+    ends = np.cumsum(group_sizes)
+    chunks, start = [], 0
+    while start < len(group_sizes):
+        offset = ends[start - 1] if start > 0 else 0
+        end = max(int(np.searchsorted(ends, offset + cells_per_chunk, side="right")), start + 1)
+        chunks.append((start, end))
+        start = end
+    return chunks
+
+
+def monte_carlo_intervals(counts, populations, groups=None, level=DEFAULT_LEVEL, n_draws=10000, seed=None,
+                          max_bytes=DEFAULT_MAX_BYTES):
+    """
+    Monte Carlo intervals of the rates of groups of cells: for every draw, a Poisson count around the observed count of
+    every cell, summed over the cells of a group and divided by the population of the group
+    :param counts: numpy array, suicide number of every cell
+    :param populations: numpy array, population of every cell
+    :param groups: numpy array of ints from 0, the group of every cell. None for a group per cell
+    :param level: float, confidence level, e.g. 0.95
+    :param n_draws: int, number of draws per group
+    :param seed: int, seed of the random numbers. The intervals are the same for the same seed and max_bytes
+    :param max_bytes: int, about the most memory to use for the draws at a time
+    :return: (numpy array, lower bounds, numpy array, upper bounds) in suicides per 100,000 of every group. Cells with
+        a missing count or population are left out, groups without any cells left are nan
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    populations = np.asarray(populations, dtype=np.float64)
+    groups = np.arange(len(counts)) if groups is None else np.asarray(groups)
+    n_groups = int(groups.max()) + 1 if len(groups) else 0
+    valid = _valid(counts, populations)
+    counts, populations, groups = counts[valid], populations[valid], groups[valid]
+
+    order = np.argsort(groups, kind="stable")
+    counts, groups = counts[order], groups[order]
+    group_sizes = np.bincount(groups, minlength=n_groups)
+    group_populations = np.bincount(groups, weights=populations[order], minlength=n_groups)
+    starts = np.concatenate([[0], np.cumsum(group_sizes)[:-1]])
+
+    # the draws of a chunk, their sums per group and a copy for the quantiles: at most 3 arrays of cells x draws
+    cells_per_chunk = max(int(max_bytes // (3 * 8 * n_draws)), 1)
+    rng = np.random.default_rng(seed)
+    tail = (1 - level) / 2
+    lower, upper = np.full(n_groups, np.nan), np.full(n_groups, np.nan)
+    for first, end in _chunks(group_sizes, cells_per_chunk):
+        chunk_groups = np.arange(first, end)[group_sizes[first:end] > 0]
+        if len(chunk_groups) == 0:
+            continue
+        cells = slice(starts[chunk_groups[0]], starts[chunk_groups[-1]] + group_sizes[chunk_groups[-1]])
+        draws = rng.poisson(counts[cells][:, None], size=(cells.stop - cells.start, n_draws))
+        sums = np.add.reduceat(draws, starts[chunk_groups] - cells.start, axis=0)
+        del draws
+        quantiles = np.quantile(sums, [tail, 1 - tail], axis=1)
+        scale = RATE_SCALE / group_populations[chunk_groups]
+        lower[chunk_groups], upper[chunk_groups] = quantiles[0] * scale, quantiles[1] * scale
+    return lower, upper
+
+
+def rate_intervals(data_frame, by, method="exact", level=DEFAULT_LEVEL, **monte_carlo_options):
+    """
+    Rates with intervals for every group of rows, e.g. every country, year and sex of the enriched data
+    :param data_frame: pd dataframe with columns suicides_no, population and those in by
+    :param by: list of columns to group on
+    :param method: string, one of METHODS
+    :param level: float, confidence level
+    :param monte_carlo_options: n_draws, seed and max_bytes, see monte_carlo_intervals
+    :return: pd dataframe, one row per group: the columns in by, suicides_no, population (summed over the rows with
+        both numbers), rate, lower and upper (in suicides per 100,000)
+    """
+    if method not in METHODS:
+        raise ValueError(f"unknown method {method}, choose from {METHODS}")
+    by = list(by)
+    data_frame = data_frame.dropna(subset=["suicides_no", "population"])
+    grouped = data_frame.groupby(by, sort=True, observed=True)
+    totals = grouped[["suicides_no", "population"]].sum().reset_index()
+    population = totals["population"].where(totals["population"] > 0)
+    totals["rate"] = totals["suicides_no"] / population * RATE_SCALE
+    if method == "exact":
+        lower, upper = poisson_intervals(totals["suicides_no"].values, totals["population"].values, level)
+    else:
+        lower, upper = monte_carlo_intervals(data_frame["suicides_no"].values, data_frame["population"].values,
+                                             grouped.ngroup().values, level, **monte_carlo_options)
+    return totals.assign(lower=lower, upper=upper)
+
+
+def add_rate_intervals(year_country_df, level=DEFAULT_LEVEL):
+    """
+    :param year_country_df: pd dataframe, the year-country data (see reshape.year_country_frame)
+    :param level: float, confidence level
+    :return: pd dataframe, year_country_df with the exact interval of every rate in YEAR_COUNTRY_RATES in columns
+        <rate>_lower and <rate>_upper
+    """
+    columns = {}
+    for rate, (count_column, population_column) in YEAR_COUNTRY_RATES.items():
+        lower, upper = poisson_intervals(year_country_df[count_column].values,
+                                         year_country_df[population_column].values, level)
+        columns[f"{rate}_lower"], columns[f"{rate}_upper"] = lower, upper
+    return year_country_df.assign(**columns)
@@ -0,0 +1,227 @@
+"""
+Declarative checks on the dataframes flowing through the pipeline, instead of asserts inline in the functions (which
+disappear under python -O). A list of checks is evaluated on a frame in one vectorised pass per check, and all
+violations are collected in a report before anything is raised.
+
+How much is checked is set with the VALIDATION_LEVEL environment variable (or a .env file):
+
+- off: nothing is checked
+- sampled (default): the row checks on a random (but reproducible) sample of SAMPLE_ROWS rows, and every other check
+  (columns, group sizes, sums) on the whole frame, as a sample of rows would break up the groups. Each of those is a
+  single vectorised pass, so this is cheap enough for every run
+- full: every check on every row, as in CI
+"""
+import logging
+import os
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+LEVEL_ENV_VAR = "VALIDATION_LEVEL"
+LEVELS = ("off", "sampled", "full")
+DEFAULT_LEVEL = "sampled"
+SAMPLE_ROWS = 1000
+SAMPLE_SEED = 0  # the same rows are checked in every run of a frame of the same length
+MAX_EXAMPLES = 5
+
+# a failed check: description of the check, the column(s) it is about, the number of offending rows (or groups) and a
+# few examples of offending values
+Violation = namedtuple("Violation", ["check", "column", "rows", "examples"])
+
+logger = logging.getLogger(__name__)
+
+
+def get_level():
+    """
+    :return: string, the validation level set in the environment, one of LEVELS
+    """
+    level = os.environ.get(LEVEL_ENV_VAR, DEFAULT_LEVEL).strip().lower()
+    if level not in LEVELS:
+        raise ValueError(f"{LEVEL_ENV_VAR} must be one of {LEVELS}, not {level}")
+    return level
+
+
+def _examples(values):
+    return [value.item() if hasattr(value, "item") else value for value in list(values)[:MAX_EXAMPLES]]
+
+
+class Columns:
+    """ The frame has all of these columns """
+    aggregate = False
+
+    def __init__(self, names):
+        self.names = list(names)
+
+    def evaluate(self, data_frame):
+        missing = [name for name in self.names if name not in data_frame]
+        if missing:
+            return [Violation("required columns", ", ".join(missing), len(missing), missing[:MAX_EXAMPLES])]
+        return []
+
+
+class _RowCheck:
+    """ A check of every value of a column, violations are the rows where bad_rows is True """
+    aggregate = False
+    description = ""
+
+    def __init__(self, column):
+        self.column = column
+
+    def bad_rows(self, values):
+        raise NotImplementedError
+
+    def evaluate(self, data_frame):
+        if self.column not in data_frame:
+            return [Violation(self.description, self.column, len(data_frame), ["column missing"])]
+        values = data_frame[self.column]
+        bad = np.asarray(self.bad_rows(values))
+        if bad.any():
+            return [Violation(self.description, self.column, int(bad.sum()), _examples(values.values[bad]))]
+        return []
+
+
+class NotNull(_RowCheck):
+    """ The column has no missing values """
+    description = "not null"
+
+    def bad_rows(self, values):
+        return values.isnull().values
+
+
+class Range(_RowCheck):
+    """ The values of the column are within bounds. Missing values pass, use NotNull to rule them out """
+
+    def __init__(self, column, low=None, high=None, low_inclusive=True, high_inclusive=True):
+        super().__init__(column)
+        self.low, self.high = low, high
+        self.low_inclusive, self.high_inclusive = low_inclusive, high_inclusive
+        lower = "" if low is None else f"{low} {'<=' if low_inclusive else '<'} "
+        upper = "" if high is None else f" {'<=' if high_inclusive else '<'} {high}"
+        self.description = f"{lower}value{upper}"
+
+    def bad_rows(self, values):
+        values = values.values.astype(np.float64)
+        bad = np.zeros(len(values), dtype=bool)
+        with np.errstate(invalid="ignore"):  # comparisons with nan are False, which is what we want here
+            if self.low is not None:
+                bad |= values < self.low if self.low_inclusive else values <= self.low
+            if self.high is not None:
+                bad |= values > self.high if self.high_inclusive else values >= self.high
+        return bad
+
+
+class GroupSize:
+    """ Every group of rows with the same keys has a multiple of this many rows, e.g. all 12 age-sex groups """
+    aggregate = True
+
+    def __init__(self, keys, multiple):
+        self.keys = list(keys)
+        self.multiple = multiple
+
+    def evaluate(self, data_frame):
+        sizes = data_frame.groupby(self.keys, observed=True, sort=False).size()
+        bad = sizes[sizes % self.multiple != 0]
+        if len(bad):
+            examples = [f"{key}: {size} rows" for key, size in bad.iloc[:MAX_EXAMPLES].items()]
+            return [Violation(f"group size multiple of {self.multiple}", ", ".join(self.keys), len(bad), examples)]
+        return []
+
+
+class SumsTo:
+    """ The values of the column add up to total, give or take tolerance """
+    aggregate = True
+
+    def __init__(self, column, total=1., tolerance=0.01):
+        self.column = column
+        self.total = total
+        self.tolerance = tolerance
+
+    def evaluate(self, data_frame):
+        total = float(data_frame[self.column].sum())
+        if not abs(total - self.total) <= self.tolerance:
+            return [Violation(f"sums to {self.total} +- {self.tolerance}", self.column, len(data_frame), [total])]
+        return []
+
+
+class ValidationReport:
+    """
+    Outcome of validating a frame
+    """
+
+    def __init__(self, name, level, rows, rows_checked, violations, skipped):
+        """
+        :param name: string, name of the frame
+        :param level: string, validation level, one of LEVELS
+        :param rows: int, number of rows in the frame
+        :param rows_checked: int, number of rows the row checks were evaluated on
+        :param violations: list of Violation
+        :param skipped: list of descriptions of checks that were skipped at this level
+        """
+        self.name = name
+        self.level = level
+        self.rows = rows
+        self.rows_checked = rows_checked
+        self.violations = violations
+        self.skipped = skipped
+
+    @property
+    def ok(self):
+        return not self.violations
+
+    def to_frame(self):
+        """
+        :return: pd dataframe with one row per violation
+        """
+        return pd.DataFrame(self.violations, columns=Violation._fields)
+
+    def __str__(self):
+        summary = f"{self.name}: {len(self.violations)} violation(s) in {self.rows_checked} of {self.rows} rows " \
+                  f"checked at level {self.level}"
+        if self.ok:
+            return summary
+        return f"{summary}\n{self.to_frame().to_string(index=False)}"
+
+    def raise_for_violations(self):
+        if not self.ok:
+            raise ValidationError(self)
+
+
+class ValidationError(ValueError):
+    """ Raised when a frame does not pass its checks, the report has all the violations """
+
+    def __init__(self, report):
+        super().__init__(str(report))
+        self.report = report
+
+
+def validate(data_frame, checks, name="frame", level=None, raise_errors=True):
+    """
+    Evaluate checks on a dataframe
+    :param data_frame: pd dataframe
+    :param checks: list of checks (Columns, NotNull, Range, GroupSize, SumsTo)
+    :param name: string, name of the frame in the report
+    :param level: string, one of LEVELS, None to use get_level()
+    :param raise_errors: bool, raise a ValidationError if there are violations
+    :return: ValidationReport
+    """
+    level = get_level() if level is None else level
+    if level not in LEVELS:
+        raise ValueError(f"validation level must be one of {LEVELS}, not {level}")
+    if level == "off":
+        return ValidationReport(name, level, len(data_frame), 0, [], [type(check).__name__ for check in checks])
+
+    sample = data_frame
+    if level == "sampled" and len(data_frame) > SAMPLE_ROWS:
+        positions = np.sort(np.random.RandomState(SAMPLE_SEED).choice(len(data_frame), SAMPLE_ROWS, replace=False))
+        sample = data_frame.iloc[positions]
+
+    violations = []
+    for check in checks:
+        violations.extend(check.evaluate(data_frame if check.aggregate else sample))
+
+    report = ValidationReport(name, level, len(data_frame), len(sample), violations, [])
+    logger.debug(str(report))
+    if raise_errors:
+        report.raise_for_violations()
+    return report
@@ -0,0 +1,240 @@
+"""
+A (year x country x sex x age) cube of suicide numbers and populations, built once from the enriched data, with all
+its marginals (every combination of the four dimensions summed over the others) rolled up in advance. Queries for a
+slice or a roll-up of the data then only index into a small numpy array instead of grouping the full table again:
+
+    cube = load_cube()
+    cube.rollup(["year", "country"], year=slice(2000, 2010), min_years=20)
+
+The cube is persisted as an npz file next to the processed data, and rebuilt when the enriched data is newer.
+"""
+import itertools
+import logging
+import re
+from pathlib import Path
+
+import click
+import numpy as np
+import pandas as pd
+
+from src.data import load_dataset
+
+CUBE_FILE = "./data/processed/aggregate_cube.npz"
+DIMS = ("year", "country", "sex", "age")
+VALUES = ("suicides_no", "population", "cells")  # cells: number of (year, country, sex, age) cells with data
+
+
+def age_order(ages):
+    """
+    Sort age groups on their lower bound, so that "5-14 years" comes before "15-24 years"
+    :param ages: iterable of age group labels, e.g. "5-14 years" or "75+ years"
+    :return: list of the age groups, sorted
+    """
+    return sorted(ages, key=lambda age: int(re.match(r"\d+", age).group()))
+
+
+def _marginal_name(value, dims):
+    return f"{value}__{'-'.join(dims) or 'total'}"
+
+
+class AggregateCube:
+    """
+    Sums of suicide numbers, populations and cells with data over every combination of year, country, sex and age.
+    Only rows with both a suicide number and a population count, like in the choropleth data.
+    """
+
+    def __init__(self, axes, codes, marginals):
+        """
+        :param axes: dictionary, dimension -> numpy array with the labels along that dimension
+        :param codes: numpy array, alpha-3 code of every country on the country axis (empty string if unknown)
+        :param marginals: dictionary, tuple of dimensions (in the order of DIMS) -> dictionary, value in VALUES ->
+            numpy array with one axis per dimension
+        """
+        # string labels as object arrays: pandas would convert numpy strings to objects in every query otherwise
+        self.axes = {dim: labels.astype(object) if labels.dtype.kind == "U" else labels for dim, labels in axes.items()}
+        self.codes = codes.astype(object)
+        self.marginals = marginals
+        self._positions = {dim: {label: i for i, label in enumerate(labels.tolist())} for dim, labels in axes.items()}
+        self._all_positions = {dim: np.arange(len(labels)) for dim, labels in axes.items()}
+        self._years_with_data = (marginals[("year", "country")]["population"] > 0).sum(axis=0)
+
+    @classmethod
+    def build(cls, enriched_df, codes=None):
+        """
+        :param enriched_df: pd dataframe with columns year, country, sex, age, suicides_no and population
+        :param codes: optional dictionary or pd Series, country name -> alpha-3 code
+        :return: AggregateCube
+        """
+        df = enriched_df.dropna(subset=["suicides_no", "population"])
+        axes, indices = {}, []
+        for dim in DIMS:
+            values = df[dim].astype(int if dim == "year" else str).values
+            labels = np.unique(values)
+            if dim == "age":
+                labels = age_order(labels)
+            labels = np.array(labels, dtype=int if dim == "year" else str)  # no object arrays, they need pickle
+            index = pd.Index(labels).get_indexer(values)
+            axes[dim] = labels
+            indices.append(index)
+
+        shape = tuple(len(axes[dim]) for dim in DIMS)
+        flat_index = np.ravel_multi_index(indices, shape)
+        full = {
+            "suicides_no": np.bincount(flat_index, weights=df["suicides_no"].values, minlength=np.prod(shape)),
+            "population": np.bincount(flat_index, weights=df["population"].values, minlength=np.prod(shape)),
+            "cells": np.bincount(flat_index, minlength=np.prod(shape)),
+        }
+        full = {value: array.reshape(shape) for value, array in full.items()}
+
+        marginals = {}
+        for n_dims in range(len(DIMS) + 1):
+            for dims in itertools.combinations(DIMS, n_dims):
+                summed_axes = tuple(i for i, dim in enumerate(DIMS) if dim not in dims)
+                marginals[dims] = {value: array.sum(axis=summed_axes) for value, array in full.items()}
+
+        codes = pd.Series(codes if codes is not None else {}, dtype=object)
+        country_codes = codes.reindex(axes["country"]).fillna("").values.astype(str)
+        return cls(axes, country_codes, marginals)
+
+    def save(self, path=CUBE_FILE):
+        """
+        :param path: path of the npz file to write
+        """
+        # numpy strings instead of objects, so that loading does not need pickle
+        arrays = {f"axis__{dim}": labels.astype(str) if labels.dtype == object else labels
+                  for dim, labels in self.axes.items()}
+        arrays["codes"] = self.codes.astype(str)
+        for dims, values in self.marginals.items():
+            for value, array in values.items():
+                arrays[_marginal_name(value, dims)] = array
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path=CUBE_FILE):
+        """
+        :param path: path of an npz file written by save
+        :return: AggregateCube
+        """
+        with np.load(path) as arrays:
+            axes = {dim: arrays[f"axis__{dim}"] for dim in DIMS}
+            marginals = {}
+            for n_dims in range(len(DIMS) + 1):
+                for dims in itertools.combinations(DIMS, n_dims):
+                    marginals[dims] = {value: arrays[_marginal_name(value, dims)] for value in VALUES}
+            return cls(axes, arrays["codes"], marginals)
+
+    def _selector_positions(self, dim, selector):
+        """
+        :param dim: a dimension
+        :param selector: a label, a list of labels, or a slice of labels (both ends included, like in df.loc)
+        :return: numpy array of positions along the axis of dim
+        """
+        labels = self.axes[dim]
+        if isinstance(selector, slice):
+            if dim == "age" and (selector.start is not None or selector.stop is not None):
+                raise ValueError("age groups can't be selected with a slice, pass a list instead")
+            start = 0 if selector.start is None else np.searchsorted(labels, selector.start, side="left")
+            stop = len(labels) if selector.stop is None else np.searchsorted(labels, selector.stop, side="right")
+            return np.arange(start, stop)
+        if isinstance(selector, (list, tuple, np.ndarray, pd.Index, pd.Series)):
+            return np.array([self._positions[dim][label] for label in selector], dtype=np.int64)
+        return np.array([self._positions[dim][selector]], dtype=np.int64)
+
+    def coverage(self):
+        """
+        :return: pd Series, number of years with data (cells with a non-zero population) for every country
+        """
+        return pd.Series(self._years_with_data, index=self.axes["country"], name="years")
+
+    def query(self, by=(), min_years=None, **selection):
+        """
+        Same as rollup, but returns numpy arrays instead of a dataframe. Use this where every bit of speed counts, e.g.
+        in a widget callback, as building the dataframe takes longer than the query itself.
+        :return: (dictionary, dimension in by (and code, if country is in by) -> labels, dictionary, value in VALUES
+            -> sums), all flat numpy arrays of the same length, ordered like DIMS
+        """
+        unknown = (set(by) | set(selection)) - set(DIMS)
+        if unknown:
+            raise KeyError(f"unknown dimensions {sorted(unknown)}, choose from {DIMS}")
+        by = tuple(dim for dim in DIMS if dim in by)
+
+        positions = {dim: self._selector_positions(dim, selector) for dim, selector in selection.items()}
+        if min_years is not None:
+            covered = np.flatnonzero(self._years_with_data >= min_years)
+            positions["country"] = np.intersect1d(positions.get("country", covered), covered)
+
+        # start from the smallest marginal that still has all dimensions we keep or select on
+        dims = tuple(dim for dim in DIMS if dim in by or dim in positions)
+        summed_axes = tuple(i for i, dim in enumerate(dims) if dim not in by)
+        index = np.ix_(*[positions.get(dim, self._all_positions[dim]) for dim in dims])
+        sums = {value: array[index].sum(axis=summed_axes).ravel() for value, array in self.marginals[dims].items()}
+
+        kept = [positions.get(dim, self._all_positions[dim]) for dim in by]
+        grid = [axis.ravel() for axis in np.meshgrid(*kept, indexing="ij")] if by else []
+        labels = {dim: self.axes[dim][grid[i]] for i, dim in enumerate(by)}
+        if "country" in by:
+            labels["code"] = self.codes[grid[by.index("country")]]
+        return labels, sums
+
+    def rollup(self, by=(), min_years=None, **selection):
+        """
+        Sum suicide numbers and populations over all dimensions not in by, for the selected labels only
+        :param by: list of dimensions to keep, e.g. ["year", "country"]
+        :param min_years: int, only keep countries with at least this many years of data
+        :param selection: dimension -> a label, list of labels, or slice of labels (both ends included) to select
+        :return: pd dataframe with a column per dimension in by, and columns suicides_no, population, cells,
+            "suicides per 100,000" (nan where there is no population) and, if country is in by, code
+        """
+        labels, sums = self.query(by, min_years, **selection)
+        columns = dict(labels)
+        columns.update(sums)
+        population = np.where(sums["population"] > 0, sums["population"], np.nan)
+        columns["suicides per 100,000"] = sums["suicides_no"] / population * 100000
+        return pd.DataFrame(columns)
+
+    def slice(self, **selection):
+        """
+        :param selection: dimension -> a label, list of labels, or slice of labels (both ends included) to select
+        :return: pd dataframe with one row per (year, country, sex, age) cell in the selection, see rollup
+        """
+        return self.rollup(by=DIMS, **selection)
+
+
+def load_cube(path=CUBE_FILE, rebuild=False, processed_dir=load_dataset.PROCESSED_DIR):
+    """
+    Load the aggregate cube, building it first (from the processed enriched and choropleth data) if it does not exist
+    yet or if the enriched data changed since it was built
+    :param path: path of the npz file
+    :param rebuild: bool, always rebuild the cube
+    :param processed_dir: directory with the processed data
+    :return: AggregateCube
+    """
+    path = Path(path)
+    enriched_file = load_dataset.dataset_source("enriched", processed_dir)
+    enriched_mtime = enriched_file.stat().st_mtime if enriched_file is not None else 0
+    if not rebuild and path.is_file() and enriched_mtime <= path.stat().st_mtime:
+        return AggregateCube.load(path)
+
+    logging.getLogger(__name__).info(f"building aggregate cube {path}")
+    enriched_df = load_dataset.load_dataset("enriched", columns=list(DIMS) + ["suicides_no", "population"],
+                                            processed_dir=processed_dir)
+    choropleth_df = load_dataset.load_dataset("choropleth", columns=["country", "code"], processed_dir=processed_dir)
+    codes = choropleth_df.astype(str).drop_duplicates("country").set_index("country")["code"]
+    cube = AggregateCube.build(enriched_df, codes)
+    cube.save(path)
+    return cube
+
+
+@click.command()
+@click.option("--output", type=click.Path(dir_okay=False), default=CUBE_FILE, show_default=True)
+def main(output):
+    """ Build the aggregate cube from the processed data (run src/data/make_dataset.py first). """
+    cube = load_cube(output, rebuild=True)
+    shape = " x ".join(f"{len(cube.axes[dim])} {dim}" for dim in DIMS)
+    logging.getLogger(__name__).info(f"saved aggregate cube of {shape} to {output}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    main()
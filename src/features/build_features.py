@@ -0,0 +1,316 @@
+"""
+Trend features of every (country, sex) or (country, sex, age) series of suicide rates at once: rolling rates, OLS trend
+slopes with their standard errors, year-over-year changes, and the year in which the trend changed most.
+
+The series are put in a padded (series x year) matrix, with a mask of the years with data, and every feature is
+computed for all series together with numpy: sums over the years are masked sums, rolling windows and the fits of
+the change points are differences of cumulative sums. No python loop over the series, so the time grows linearly
+with their number: trend_features takes about 50 ms for 3,000 series of 60 years and 0.2 s for 12,000, e.g. once we
+add sub-national series (see build_features.trend_features in benchmarks/bench_make_dataset.py).
+
+    matrix = series_matrix(load_dataset("enriched"), by=["country", "sex"])
+    features = trend_features(matrix)       # one row per series
+    yearly = yearly_features(matrix)        # one row per series and year with data
+
+profile_features puts the rates of the age-sex groups of every country (or country-decade) next to the trend of its
+overall rate, the vectors that similarity_index.py searches for similar countries in.
+"""
+import logging
+from collections import namedtuple
+from pathlib import Path
+
+import click
+import numpy as np
+import pandas as pd
+
+from src.data import load_dataset
+from src.features.aggregate_cube import age_order
+
+FEATURES_FILE = "./data/processed/trend_features.csv"
+RATE_SCALE = 100000  # rates are suicides per 100,000 people
+PROFILE_TRENDS = ["slope", "mean_change"]  # trend features of the overall rate in the profile of a country
+
+# keys: pd dataframe with the columns the series are grouped on, one row per series. years: numpy array of all years
+# from the first to the last. suicides and population: (series x year) float arrays, summed over all rows of the
+# series in a year, nan in years without data. A year has data if at least one row has both numbers
+SeriesMatrix = namedtuple("SeriesMatrix", ["keys", "years", "suicides", "population"])
+# least squares lines: number of points, slope, intercept, sum of squared residuals and sum of squared deviations of x
+Fit = namedtuple("Fit", ["n", "slope", "intercept", "residuals", "x_spread"])
+
+
+def series_matrix(data_frame, by=("country", "sex")):
+    """
+    :param data_frame: pd dataframe with columns year, suicides_no, population and those in by, e.g. the enriched data
+    :param by: list of columns that identify a series, e.g. ["country", "sex", "age"]
+    :return: SeriesMatrix, of the rows with both a suicide number and a population (like the choropleth data)
+    """
+    by = list(by)
+    data_frame = data_frame.loc[data_frame["suicides_no"].notnull() & data_frame["population"].notnull(),
+                                by + ["year", "suicides_no", "population"]]
+    grouped = data_frame.groupby(by, sort=True, observed=True)
+    series = grouped.ngroup().values
+    keys = grouped.size().index.to_frame(index=False)
+    n_series = len(keys)
+
+    year_values = data_frame["year"].values.astype(np.int64)
+    first_year, last_year = (year_values.min(), year_values.max()) if len(year_values) else (0, -1)
+    years = np.arange(first_year, last_year + 1)
+    cells = series * len(years) + (year_values - first_year)
+    size = n_series * len(years)
+    counts = np.bincount(cells, minlength=size).reshape(n_series, len(years))
+
+    def cell_sums(column):
+        sums = np.bincount(cells, weights=data_frame[column].values.astype(np.float64), minlength=size)
+        return np.where(counts > 0, sums.reshape(n_series, len(years)), np.nan)
+
+    return SeriesMatrix(keys, years, cell_sums("suicides_no"), cell_sums("population"))
+
+
+def has_data(matrix):
+    """
+    :return: (series x year) bool array, the years with data of every series
+    """
+    return ~np.isnan(matrix.population) & (np.nan_to_num(matrix.population) > 0)
+
+
+def rates(matrix):
+    """
+    :return: (series x year) array of suicides per 100,000, nan in years without data
+    """
+    mask = has_data(matrix)
+    return np.where(mask, matrix.suicides / np.where(mask, matrix.population, 1.) * RATE_SCALE, np.nan)
+
+
+def _window_sums(values, window):
+    """
+    :param values: (series x year) array, 0 where there is no data
+    :param window: int, number of years
+    :return: (series x year) array, the sum over the window of years ending at every year
+    """
+    cumulative = np.concatenate([np.zeros((len(values), 1)), np.cumsum(values, axis=1)], axis=1)
+    start = np.maximum(np.arange(values.shape[1]) + 1 - window, 0)
+    return cumulative[:, 1:] - cumulative[:, start]
+
+
+def rolling_rates(matrix, window=5, min_years=None):
+    """
+    Suicide rate over a window of years: the total number of suicides over the total population in the years with data
+    :param matrix: SeriesMatrix
+    :param window: int, number of years, the window ends at (and includes) the year
+    :param min_years: int, minimum number of years with data in the window, defaults to half the window (rounded up)
+    :return: (series x year) array of suicides per 100,000, nan where the window has too few years with data
+    """
+    min_years = (window + 1) // 2 if min_years is None else min_years
+    mask = has_data(matrix)
+    n_years = _window_sums(mask.astype(np.float64), window)
+    suicides = _window_sums(np.where(mask, matrix.suicides, 0.), window)
+    population = _window_sums(np.where(mask, matrix.population, 0.), window)
+    enough = (n_years >= min_years) & (population > 0)
+    return np.where(enough, suicides / np.where(enough, population, 1.) * RATE_SCALE, np.nan)
+
+
+def year_over_year(matrix):
+    """
+    :param matrix: SeriesMatrix
+    :return: ((series x year) array, change in rate since the year before, (series x year) array, that change relative
+        to the rate of the year before). nan if either year has no data (or the year before had a rate of 0)
+    """
+    rate = rates(matrix)
+    previous = np.concatenate([np.full((len(rate), 1), np.nan), rate[:, :-1]], axis=1)
+    change = rate - previous
+    with np.errstate(divide="ignore", invalid="ignore"):
+        relative = np.where(previous > 0, change / previous, np.nan)
+    return change, relative
+
+
+def _fit_lines(n, sx, sy, sxx, sxy, syy):
+    """
+    Least squares lines through sets of points, from sums over the points
+    :param n: array, number of points of every line
+    :param sx: array, sum of x, and likewise the sums of y, x * x, x * y and y * y
+    :return: Fit, arrays with a value per line, nan where there are fewer than 2 points (or all at the same x)
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x_spread = sxx - sx * sx / n
+        xy_spread = sxy - sx * sy / n
+        y_spread = syy - sy * sy / n
+        valid = (n >= 2) & (x_spread > 0)
+        slope = np.where(valid, xy_spread / x_spread, np.nan)
+        intercept = np.where(valid, (sy - slope * sx) / n, np.nan)
+        residuals = np.where(valid, np.maximum(y_spread - slope * xy_spread, 0.), np.nan)
+    return Fit(n, slope, intercept, residuals, x_spread)
+
+
+def _point_sums(matrix, mask):
+    """
+    :param matrix: SeriesMatrix
+    :param mask: (series x year) bool array, the points (year, rate) to sum over
+    :return: list of (series x year) arrays, the terms of the sums of _fit_lines (1, x, y, x * x, x * y, y * y) of
+        every point, 0 outside the mask. x is the year relative to the middle of the years, for precision
+    """
+    centre = (matrix.years[0] + matrix.years[-1]) / 2 if len(matrix.years) else 0.
+    ones = mask.astype(np.float64)
+    x = (matrix.years - centre).astype(np.float64) * ones
+    y = np.where(mask, rates(matrix), 0.)
+    return [ones, x, y, x * x, x * y, y * y]
+
+
+def trend_slopes(matrix, first_year=None, last_year=None):
+    """
+    OLS fit of the rate on the year, for every series, over the years with data between first_year and last_year
+    :param matrix: SeriesMatrix
+    :param first_year: int, first year to fit on, None for the first year of the data
+    :param last_year: int, last year to fit on, None for the last year of the data
+    :return: pd dataframe, the keys and n_years, slope (change in suicides per 100,000 per year), slope_se (its
+        standard error, nan with fewer than 3 years) and intercept (the fitted rate in the middle year of the data)
+    """
+    mask = has_data(matrix)
+    if first_year is not None:
+        mask &= matrix.years >= first_year
+    if last_year is not None:
+        mask &= matrix.years <= last_year
+    fit = _fit_lines(*[term.sum(axis=1) for term in _point_sums(matrix, mask)])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope_se = np.where(fit.n > 2, np.sqrt(fit.residuals / (fit.n - 2) / fit.x_spread), np.nan)
+    return matrix.keys.assign(n_years=fit.n.astype(np.int64), slope=fit.slope, slope_se=slope_se,
+                              intercept=fit.intercept)
+
+
+def change_points(matrix, min_years=4):
+    """
+    The year in which the trend of every series changed most: the split of its years into an earlier and a later
+    part, each with its own OLS line, that fits the rates best. Every split of every series is evaluated at once, from
+    cumulative sums over the years
+    :param matrix: SeriesMatrix
+    :param min_years: int, minimum number of years with data on either side of the split
+    :return: pd dataframe, the keys and change_year (first year of the later part), slope_before, slope_after and
+        fit_gain: the fraction of the squared residuals of a single line that the split removes. nan if the series has
+        too few years to split
+    """
+    terms = _point_sums(matrix, has_data(matrix))
+    # the sums over the years before every split, a split at position k being years[:k] and years[k:]
+    before = [np.cumsum(term, axis=1)[:, :-1] for term in terms]
+    totals = [term.sum(axis=1) for term in terms]
+    after = [total[:, None] - sums for total, sums in zip(totals, before)]
+    fit_before, fit_after, fit_single = _fit_lines(*before), _fit_lines(*after), _fit_lines(*totals)
+
+    residuals = fit_before.residuals + fit_after.residuals
+    residuals[(fit_before.n < min_years) | (fit_after.n < min_years) | np.isnan(residuals)] = np.inf
+    # a column of impossible splits, so that argmin works for series of a single year too
+    residuals = np.concatenate([residuals, np.full((len(residuals), 1), np.inf)], axis=1)
+    best = residuals.argmin(axis=1)
+    found = np.isfinite(residuals[np.arange(len(best)), best])
+    best = np.where(found, best, 0)
+    rows = np.arange(len(best))
+
+    def at_best(values):
+        return np.where(found, values[rows, best], np.nan) if values.shape[1] else np.full(len(best), np.nan)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        gain = np.where(fit_single.residuals > 0, 1 - residuals[rows, best] / fit_single.residuals, 0.)
+    change_year = matrix.years[1:][best] if len(matrix.years) > 1 else np.zeros(len(best))
+    return matrix.keys.assign(change_year=np.where(found, change_year, np.nan), slope_before=at_best(fit_before.slope),
+                              slope_after=at_best(fit_after.slope), fit_gain=np.where(found, gain, np.nan))
+
+
+def trend_features(matrix, recent_years=5, min_change_years=4):
+    """
+    :param matrix: SeriesMatrix
+    :param recent_years: int, number of years at the end of the data that the recent rate is over
+    :param min_change_years: int, minimum number of years on either side of a change point, see change_points
+    :return: pd dataframe, one row per series: the keys, first_year, last_year, overall_rate (over all years with
+        data), recent_rate, mean_change (the mean year-over-year change), the columns of trend_slopes and those of
+        change_points
+    """
+    mask = has_data(matrix)
+    suicides, population = np.where(mask, matrix.suicides, 0.), np.where(mask, matrix.population, 0.)
+    recent = matrix.years > matrix.years[-1] - recent_years if len(matrix.years) else np.zeros(0, dtype=bool)
+    change, _ = year_over_year(matrix)
+    positions = np.arange(len(matrix.years))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        overall_rate = suicides.sum(axis=1) / population.sum(axis=1) * RATE_SCALE
+        recent_population = population[:, recent].sum(axis=1)
+        recent_rate = np.where(recent_population > 0, suicides[:, recent].sum(axis=1) / recent_population *
+                               RATE_SCALE, np.nan)
+        n_changes = (~np.isnan(change)).sum(axis=1)
+        mean_change = np.where(n_changes > 0, np.nansum(change, axis=1) / n_changes, np.nan)
+    any_data = mask.any(axis=1)
+    first = np.where(any_data, matrix.years[np.where(mask, positions, len(positions) - 1).min(axis=1)], -1)
+    last = np.where(any_data, matrix.years[np.where(mask, positions, 0).max(axis=1)], -1)
+
+    features = matrix.keys.assign(first_year=first, last_year=last, overall_rate=overall_rate,
+                                  recent_rate=recent_rate, mean_change=mean_change)
+    slopes = trend_slopes(matrix)
+    points = change_points(matrix, min_change_years)
+    for frame in [slopes, points]:
+        for column in frame.columns.drop(matrix.keys.columns):
+            features[column] = frame[column].values
+    return features[any_data].reset_index(drop=True)
+
+
+def yearly_features(matrix, window=5):
+    """
+    :param matrix: SeriesMatrix
+    :param window: int, number of years of the rolling rate, see rolling_rates
+    :return: pd dataframe, one row per series and year with data: the keys, year, suicides_no, population, rate,
+        rolling_rate, change and relative_change (see year_over_year)
+    """
+    mask = has_data(matrix)
+    series, year = np.nonzero(mask)
+    change, relative = year_over_year(matrix)
+    columns = {column: matrix.keys[column].values[series] for column in matrix.keys.columns}
+    columns.update(year=matrix.years[year], suicides_no=matrix.suicides[mask], population=matrix.population[mask],
+                   rate=rates(matrix)[mask], rolling_rate=rolling_rates(matrix, window)[mask], change=change[mask],
+                   relative_change=relative[mask])
+    return pd.DataFrame(columns)
+
+
+def profile_features(data_frame, by=("country",), decades=False):
+    """
+    The age-sex profile of the suicide rate of every country: the rate of each age-sex group over all its years with
+    data, and the slope and mean year-over-year change (see trend_features) of its overall rate
+    :param data_frame: pd dataframe with columns year, sex, age, suicides_no, population and those in by, e.g. the
+        enriched data
+    :param by: list of columns that identify a unit to profile, e.g. ["country"]
+    :param decades: bool, profile every decade of a unit separately, with an extra key column decade (e.g. 1990)
+    :return: pd dataframe, one row per unit with data: the keys, a column "<sex> <age>" with the rate of every age-sex
+        group (nan if the unit has no data for it) and the PROFILE_TRENDS columns
+    """
+    by = list(by)
+    if decades:
+        data_frame = data_frame.assign(decade=data_frame["year"].values // 10 * 10)
+        by = by + ["decade"]
+    groups = trend_features(series_matrix(data_frame, by + ["sex", "age"]))
+    groups = groups.astype({"sex": str, "age": str})
+    ages = age_order(groups["age"].unique())
+    rates = groups.set_index(by + ["sex", "age"])["overall_rate"].unstack(["sex", "age"])
+    rates = rates.reindex(columns=pd.MultiIndex.from_product([sorted(groups["sex"].unique()), ages]))
+    rates.columns = [f"{sex} {age}" for sex, age in rates.columns]
+
+    trends = trend_features(series_matrix(data_frame, by)).set_index(by)[PROFILE_TRENDS]
+    return rates.join(trends, how="inner").reset_index()
+
+
+@click.command()
+@click.option("--by", default="country,sex", show_default=True,
+              help="Comma separated columns of the enriched data that identify a series, e.g. country,sex,age.")
+@click.option("--output", type=click.Path(dir_okay=False), default=FEATURES_FILE, show_default=True,
+              help="File to save the features to, a .feather, .parquet or .csv file.")
+@click.option("--recent-years", type=int, default=5, show_default=True,
+              help="Number of years at the end of the data to compute the recent rate over.")
+def main(by, output, recent_years):
+    """ Compute the trend features of every series in the processed enriched data (run make_dataset.py first). """
+    by = [column.strip() for column in by.split(",")]
+    enriched_df = load_dataset.load_dataset("enriched", columns=by + ["year", "suicides_no", "population"])
+    features = trend_features(series_matrix(enriched_df, by), recent_years=recent_years)
+    formats = {extension: output_format for output_format, extension in load_dataset.FORMAT_EXTENSIONS.items()}
+    if Path(output).suffix not in formats:
+        raise click.BadParameter(f"{output} should end in one of {', '.join(formats)}", param_hint="--output")
+    Path(output).parent.mkdir(parents=True, exist_ok=True)
+    load_dataset.save_dataset(features, output, formats[Path(output).suffix])
+    logging.getLogger(__name__).info(f"saved trend features of {len(features)} series to {output}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    main()
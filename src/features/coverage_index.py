@@ -0,0 +1,238 @@
+"""
+An index of which (country, year, age-sex group) cells the WHO data covers, built once from the raw suicide data and
+the enriched data, so that coverage questions (which countries have enough complete years, which years have data for
+enough countries, which populations were imputed) don't need a groupby over the full table every time:
+
+    index = load_index()
+    index.countries_with_years(20)
+    index.years_with_coverage(0.5)
+
+Every layer of the index is a bitset over the cells: for every country and age-sex group, the bits of the years,
+packed 8 to a byte with np.packbits. Questions are answered with bitwise ands over the layers and a popcount. The index
+is persisted as an npz file next to the processed data, and rebuilt when the raw or enriched data is newer.
+"""
+import logging
+from pathlib import Path
+
+import click
+import numpy as np
+import pandas as pd
+
+from src.data import load_dataset, raw_data
+from src.features.aggregate_cube import age_order
+
+INDEX_FILE = "./data/processed/coverage_index.npz"
+KEYS = ("country", "year", "age", "sex")
+# rows: there is a row for the cell in the WHO data, suicides: with a suicide number, population: with a population,
+# imputed: without a population in the WHO data, but with one filled in in the enriched data
+LAYERS = ("rows", "suicides", "population", "imputed")
+POPCOUNT = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint8)  # number of bits set in a byte
+
+
+def cell_bits(df, axes, column=None):
+    """
+    :param df: pd dataframe with the KEYS columns
+    :param axes: dictionary, key -> numpy array with its labels along the index
+    :param column: name of a column of df, None for all rows
+    :return: numpy array of bools of shape (countries, age-sex groups, years), True for the cells with a row of df
+        (with a value in column)
+    """
+    df = df.dropna(subset=list(KEYS) + ([column] if column is not None else []))
+    country = pd.Index(axes["country"]).get_indexer(df["country"].astype(str).values)
+    year = pd.Index(axes["year"]).get_indexer(df["year"].astype(int).values)
+    age = pd.Index(axes["age"]).get_indexer(df["age"].astype(str).values)
+    sex = pd.Index(axes["sex"]).get_indexer(df["sex"].astype(str).values)
+    known = (country >= 0) & (year >= 0) & (age >= 0) & (sex >= 0)
+    shape = (len(axes["country"]), len(axes["age"]) * len(axes["sex"]), len(axes["year"]))
+    group = age * len(axes["sex"]) + sex
+    bits = np.zeros(np.prod(shape), dtype=bool)
+    bits[np.ravel_multi_index((country[known], group[known], year[known]), shape)] = True
+    return bits.reshape(shape)
+
+
+class CoverageIndex:
+    """
+    Bitsets of the (country, age-sex group, year) cells with WHO data, one per layer in LAYERS
+    """
+
+    def __init__(self, axes, layers):
+        """
+        :param axes: dictionary, key in KEYS -> numpy array with its labels (the years a range without gaps)
+        :param layers: dictionary, layer in LAYERS -> numpy array of uint8 of shape (countries, age-sex groups, bytes),
+            the bits of the years of every cell, packed with np.packbits
+        """
+        self.axes = {key: labels.astype(object) if labels.dtype.kind == "U" else labels for key, labels in axes.items()}
+        self.layers = layers
+        self.n_years = len(axes["year"])
+
+    @classmethod
+    def build(cls, suicide_df, enriched_df=None):
+        """
+        :param suicide_df: pd dataframe, the WHO suicide data (with the populations that were not imputed)
+        :param enriched_df: optional pd dataframe, the enriched data, for the imputed layer
+        :return: CoverageIndex
+        """
+        keys = suicide_df.dropna(subset=list(KEYS))
+        years = keys["year"].astype(int)
+        axes = {
+            "country": np.array(sorted(keys["country"].astype(str).unique()), dtype=str),
+            "year": np.arange(years.min(), years.max() + 1) if len(keys) else np.array([], dtype=int),
+            "age": np.array(age_order(keys["age"].astype(str).unique()), dtype=str),
+            "sex": np.array(sorted(keys["sex"].astype(str).unique()), dtype=str),
+        }
+        bits = {"rows": cell_bits(keys, axes), "suicides": cell_bits(keys, axes, "suicides_no"),
+                "population": cell_bits(keys, axes, "population")}
+        bits["imputed"] = np.zeros_like(bits["rows"])
+        if enriched_df is not None:
+            bits["imputed"] = cell_bits(enriched_df, axes, "population") & bits["rows"] & ~bits["population"]
+        return cls(axes, {layer: np.packbits(bits[layer], axis=-1) for layer in LAYERS})
+
+    def save(self, path=INDEX_FILE):
+        """
+        :param path: path of the npz file to write
+        """
+        # numpy strings instead of objects, so that loading does not need pickle
+        arrays = {f"axis__{key}": labels.astype(str) if labels.dtype == object else labels
+                  for key, labels in self.axes.items()}
+        arrays.update({f"layer__{layer}": bits for layer, bits in self.layers.items()})
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path=INDEX_FILE):
+        """
+        :param path: path of an npz file written by save
+        :return: CoverageIndex
+        """
+        with np.load(path) as arrays:
+            return cls({key: arrays[f"axis__{key}"] for key in KEYS},
+                       {layer: arrays[f"layer__{layer}"] for layer in LAYERS})
+
+    @property
+    def groups(self):
+        """
+        :return: pd MultiIndex of the (age, sex) groups, in the order of the second axis of the layers
+        """
+        return pd.MultiIndex.from_product([self.axes["age"], self.axes["sex"]], names=["age", "sex"])
+
+    def cells(self, imputed=False):
+        """
+        :param imputed: bool, count imputed populations as populations
+        :return: numpy array of uint8 of shape (countries, age-sex groups, bytes), the packed bits of the cells with a
+            suicide number and a population
+        """
+        population = self.layers["population"] | self.layers["imputed"] if imputed else self.layers["population"]
+        return self.layers["suicides"] & population
+
+    def complete_years(self, imputed=False):
+        """
+        :param imputed: bool, count imputed populations as populations
+        :return: numpy array of uint8 of shape (countries, bytes), the packed bits of the years in which all age-sex
+            groups of a country have a suicide number and a population
+        """
+        return np.bitwise_and.reduce(self.cells(imputed), axis=1)
+
+    def years_per_country(self, imputed=False):
+        """
+        :param imputed: bool, count imputed populations as populations
+        :return: pd Series, number of complete years (see complete_years) of every country
+        """
+        return pd.Series(self._complete_year_counts(imputed), index=self.axes["country"], name="years")
+
+    def countries_with_years(self, min_years, imputed=False):
+        """
+        :param min_years: int
+        :param imputed: bool, count imputed populations as populations
+        :return: numpy array of the countries with at least min_years complete years
+        """
+        return self.axes["country"][self._complete_year_counts(imputed) >= min_years]
+
+    def year_coverage(self, imputed=False):
+        """
+        :param imputed: bool, count imputed populations as populations
+        :return: pd Series, the fraction of the countries with a complete year (see complete_years), for every year
+        """
+        return pd.Series(self._complete_country_shares(imputed), index=self.axes["year"], name="coverage")
+
+    def years_with_coverage(self, min_share, imputed=False):
+        """
+        :param min_share: float between 0 and 1
+        :param imputed: bool, count imputed populations as populations
+        :return: numpy array of the years in which at least a fraction min_share of the countries has a complete year
+        """
+        return self.axes["year"][self._complete_country_shares(imputed) >= min_share]
+
+    def partial_years(self, layer="population"):
+        """
+        Country-years with some but not all age-sex groups in a layer, e.g. a population for only a few age groups
+        :param layer: one of LAYERS
+        :return: pd dataframe with columns country and year
+        """
+        bits = self.layers[layer]
+        some = np.bitwise_or.reduce(bits, axis=1) & ~np.bitwise_and.reduce(bits, axis=1)
+        country, year = np.nonzero(np.unpackbits(some, axis=1)[:, :self.n_years])
+        return pd.DataFrame({"country": self.axes["country"][country], "year": self.axes["year"][year]})
+
+    def _complete_year_counts(self, imputed):
+        return POPCOUNT[self.complete_years(imputed)].sum(axis=1, dtype=np.int64)
+
+    def _complete_country_shares(self, imputed):
+        complete = np.unpackbits(self.complete_years(imputed), axis=1)[:, :self.n_years]
+        return complete.sum(axis=0) / max(len(self.axes["country"]), 1)
+
+    def imputed_cells(self):
+        """
+        :return: pd dataframe with columns country, year, age and sex, the cells with an imputed population
+        """
+        bits = np.unpackbits(self.layers["imputed"], axis=2)[:, :, :self.n_years]
+        country, group, year = np.nonzero(bits)
+        n_sexes = len(self.axes["sex"])
+        return pd.DataFrame({"country": self.axes["country"][country], "year": self.axes["year"][year],
+                             "age": self.axes["age"][group // n_sexes], "sex": self.axes["sex"][group % n_sexes]})
+
+
+def load_index(path=INDEX_FILE, rebuild=False, archive=raw_data.RAW_ARCHIVE, processed_dir=load_dataset.PROCESSED_DIR):
+    """
+    Load the coverage index, building it first (from the raw suicide data and the processed enriched data) if it does
+    not exist yet or if either changed since it was built
+    :param path: path of the npz file
+    :param rebuild: bool, always rebuild the index
+    :param archive: path to the zip archive with the raw data
+    :param processed_dir: directory with the processed data
+    :return: CoverageIndex
+    """
+    path = Path(path)
+    inputs = [Path(archive), load_dataset.dataset_source("enriched", processed_dir)]
+    inputs_mtime = max([file.stat().st_mtime for file in inputs if file is not None and file.is_file()], default=0)
+    if not rebuild and path.is_file() and inputs_mtime <= path.stat().st_mtime:
+        return CoverageIndex.load(path)
+
+    logging.getLogger(__name__).info(f"building coverage index {path}")
+    suicide_df = raw_data.read_raw(raw_data.SUICIDE_MEMBER, archive=archive)
+    try:
+        enriched_df = load_dataset.load_dataset("enriched", columns=list(KEYS) + ["population"],
+                                                processed_dir=processed_dir)
+    except FileNotFoundError:
+        enriched_df = None  # no imputed layer until make_dataset.py ran
+    index = CoverageIndex.build(suicide_df, enriched_df)
+    index.save(path)
+    return index
+
+
+@click.command()
+@click.option("--output", type=click.Path(dir_okay=False), default=INDEX_FILE, show_default=True)
+@click.option("--raw-archive", type=click.Path(exists=True, dir_okay=False), default=raw_data.RAW_ARCHIVE,
+              show_default=True)
+def main(output, raw_archive):
+    """ Build the coverage index from the raw and the processed data (run src/data/make_dataset.py first). """
+    index = load_index(output, rebuild=True, archive=raw_archive)
+    logger = logging.getLogger(__name__)
+    logger.info(f"saved coverage index of {len(index.axes['country'])} countries, {index.n_years} years and "
+                f"{len(index.groups)} age-sex groups to {output}")
+    logger.info(f"{(index.years_per_country() > 0).sum()} countries with complete years, "
+                f"{len(index.imputed_cells())} cells with an imputed population")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    main()
@@ -0,0 +1,301 @@
+"""
+A store of external indicators (GDP, sunshine hours, the human development indicators, ..) keyed by alpha-3 country
+code and year, to join onto our suicide data. Every source file is read and normalised once: wide World Bank-style
+files (one column per year) are melted, country names are resolved to codes, and the result is written as a long
+(code, year, value) table sorted on code and year, with missing values dropped. An index (json) records which rows of
+which file hold which indicator, and a fingerprint of every source so that it is only read again when it changes.
+
+Joins look up many indicators at once with a binary search on the sorted keys, either on the exact year (left join)
+or on the most recent earlier year with data (as-of join). Indicators without a year (e.g. sunshine hours) are joined
+on the code only.
+
+    store = IndicatorStore()
+    store.ingest_world_bank(GDP_FILE, name="gdp_per_capita")
+    store.ingest_sunshine(SUNSHINE_FILE)
+    df = store.join(year_country_df, ["gdp_per_capita", "sunshine_year"], how="asof", tolerance=3)
+"""
+import io
+import json
+import logging
+import re
+import zipfile
+from pathlib import Path
+
+import click
+import numpy as np
+import pandas as pd
+
+from src.data import add_country_codes, load_dataset
+from src.data.stage_cache import hash_file
+
+STORE_DIR = "./data/interim/indicators"
+INDEX_FILE = "index.json"
+INDEX_VERSION = 1
+STATIC_YEAR = 0  # year of indicators that don't change over time
+_YEAR_FACTOR = 10000  # keys are code position * _YEAR_FACTOR + year
+
+GDP_FILE = "./data/raw/API_NY.GDP.PCAP.PP.KD_DS2_en_csv_v2_443996.zip"
+SUNSHINE_FILE = "./data/raw/asia_sunshine.txt"
+INDICATORS_EXCEL_FILE = "./data/raw/2018_all_indicators.xlsx"
+
+logger = logging.getLogger(__name__)
+
+
+def _year_columns(columns):
+    """
+    :return: list of the columns that are years, e.g. "1990" or 1990 (but not 9999, used for "all years" in the
+        Excel data)
+    """
+    return [column for column in columns if re.fullmatch(r"(18|19|20)\d\d", str(column).strip())]
+
+
+def melt_wide(data_frame, code_column, indicator_column=None, indicator=None):
+    """
+    Turn a wide table with one column per year into a long one
+    :param data_frame: pd dataframe with a code column and one column per year
+    :param code_column: name of the column with alpha-3 codes
+    :param indicator_column: name of the column with the name of the indicator of every row, or None if all rows hold
+        the same indicator
+    :param indicator: string, name of the indicator if indicator_column is None
+    :return: pd dataframe with columns indicator, code, year and value, without missing values
+    """
+    years = _year_columns(data_frame.columns)
+    id_vars = [code_column] + ([indicator_column] if indicator_column is not None else [])
+    long = data_frame[id_vars + years].melt(id_vars=id_vars, var_name="year", value_name="value")
+    long = long.rename(columns={code_column: "code", indicator_column: "indicator"})
+    if indicator_column is None:
+        long["indicator"] = indicator
+    long["year"] = long["year"].astype(str).str.strip().astype(int)
+    long["value"] = pd.to_numeric(long["value"], errors="coerce")
+    return long.dropna(subset=["code", "value"])[["indicator", "code", "year", "value"]]
+
+
+def read_world_bank(path):
+    """
+    Read a World Bank indicator file as downloaded: a csv, or a zip with the csv and some meta data files
+    :param path: path of the csv or zip file
+    :return: pd dataframe, the wide table
+    """
+    path = Path(path)
+    if path.suffix == ".zip":
+        with zipfile.ZipFile(path) as archive:
+            member = next(name for name in archive.namelist() if not name.startswith("Metadata"))
+            with archive.open(member) as f:
+                return pd.read_csv(io.TextIOWrapper(f, encoding="utf-8-sig"), skiprows=4)
+    return pd.read_csv(path, skiprows=4, encoding="utf-8-sig")
+
+
+class IndicatorStore:
+    """
+    Normalised indicator tables on disk, one feather file per source, and an index of what is where
+    """
+
+    def __init__(self, store_dir=STORE_DIR):
+        """
+        :param store_dir: directory of the store, created when the first source is ingested
+        """
+        self.store_dir = Path(store_dir)
+        self.index = {"version": INDEX_VERSION, "sources": {}}
+        index_file = self.store_dir / INDEX_FILE
+        if index_file.is_file():
+            with open(index_file) as f:
+                index = json.load(f)
+            if index.get("version") == INDEX_VERSION:
+                self.index = index
+        self._tables = {}
+
+    @property
+    def indicators(self):
+        """
+        :return: dictionary, indicator name -> name of the source it comes from
+        """
+        return {indicator: source for source, entry in self.index["sources"].items()
+                for indicator in entry["indicators"]}
+
+    def _is_current(self, name, path):
+        entry = self.index["sources"].get(name)
+        return entry is not None and entry["fingerprint"] == hash_file(path)
+
+    def add(self, name, path, long_df, static=False):
+        """
+        Store the indicators of a source, replacing what was stored for it before
+        :param name: string, name of the source
+        :param path: path of the source file (its fingerprint is stored, see is_current)
+        :param long_df: pd dataframe with columns indicator, code, year and value
+        :param static: bool, whether the indicators don't depend on the year (year is ignored)
+        """
+        others = {indicator for indicator, source in self.indicators.items() if source != name}
+        duplicates = set(long_df["indicator"]) & others
+        if duplicates:
+            raise ValueError(f"indicators {sorted(duplicates)} are already in the store from another source")
+
+        df = long_df.assign(code=long_df["code"].astype(str).str.strip(), indicator=long_df["indicator"].astype(str))
+        if static:
+            df = df.assign(year=STATIC_YEAR)
+        df = df.sort_values(["indicator", "code", "year"], kind="mergesort")
+        if df.duplicated(["indicator", "code", "year"]).any():
+            raise ValueError(f"source {name} has more than one value for some (indicator, code, year)")
+        df = df.reset_index(drop=True).astype({"year": np.int16, "value": np.float64})
+
+        starts = np.flatnonzero(np.r_[True, df["indicator"].values[1:] != df["indicator"].values[:-1]])
+        stops = np.r_[starts[1:], len(df)]
+        indicators = {df["indicator"].iat[start]: {"start": int(start), "stop": int(stop), "static": static}
+                      for start, stop in zip(starts, stops)}
+
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        file_name = f"{re.sub(r'[^0-9A-Za-z_.-]', '_', name)}.feather"
+        load_dataset.save_dataset(df[["code", "year", "value"]], self.store_dir / file_name, "feather")
+        self.index["sources"][name] = {"path": str(path), "fingerprint": hash_file(path), "file": file_name,
+                                       "indicators": indicators}
+        self._tables.pop(name, None)
+        self._write_index()
+        logger.info(f"stored {len(indicators)} indicator(s) with {len(df)} values from {path}")
+
+    def _write_index(self):
+        tmp_file = self.store_dir / (INDEX_FILE + ".tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(self.index, f, indent=1, sort_keys=True)
+        tmp_file.replace(self.store_dir / INDEX_FILE)
+
+    def ingest_world_bank(self, path, name=None, force=False):
+        """
+        :param path: path of a World Bank indicator csv, or the zip it comes in
+        :param name: string, name of the indicator (and source), default the World Bank indicator code
+        :param force: bool, read the file even if it did not change since it was last ingested
+        """
+        name = name or Path(path).name.split("_")[1]  # API_<indicator code>_DS2_...
+        if not force and self._is_current(name, path):
+            return
+        wide = read_world_bank(path)
+        self.add(name, path, melt_wide(wide, "Country Code", indicator=name))
+
+    def ingest_sunshine(self, path, name="sunshine", force=False):
+        """
+        Monthly and yearly sunshine hours of cities, averaged per country. The file is tab separated, with thousands
+        separators and trailing spaces
+        :param path: path of the sunshine table
+        :param name: string, name of the source, the indicators are called <name>_<month> and <name>_year
+        :param force: bool, read the file even if it did not change since it was last ingested
+        """
+        if not force and self._is_current(name, path):
+            return
+        df = pd.read_csv(path, sep="\t", thousands=",", encoding="utf-8")
+        df.columns = [column.strip() for column in df.columns]
+        df["Country"] = df["Country"].str.strip()
+        value_columns = [column for column in df.columns if column not in ("Country", "City", "Ref.")]
+        df[value_columns] = df[value_columns].apply(pd.to_numeric, errors="coerce")
+        means = df.groupby("Country")[value_columns].mean()
+
+        code_lookup = add_country_codes.get_alpha3_codes(means.index.to_series())
+        if len(code_lookup.unresolved) > 0:
+            logger.warning(f"could not find alpha-3 codes for countries in {path}:\n{code_lookup.unresolved}")
+        means["code"] = code_lookup.codes.values
+        means = means[means["code"] != ""].groupby("code").mean()
+
+        long = means.reset_index().melt(id_vars=["code"], var_name="indicator", value_name="value")
+        long["indicator"] = name + "_" + long["indicator"].str.lower()
+        self.add(name, path, long.dropna(subset=["value"]).assign(year=STATIC_YEAR), static=True)
+
+    def ingest_excel(self, path, name=None, sheet_name=0, code_column="iso3", indicator_column="indicator_name",
+                     force=False):
+        """
+        An Excel sheet with one row per (country, indicator) and one column per year, like the human development
+        indicators. Reading Excel is slow, so this is where the store saves the most time
+        :param path: path of the Excel file
+        :param name: string, name of the source, default the file name
+        :param sheet_name: name or number of the sheet
+        :param code_column: name of the column with alpha-3 codes
+        :param indicator_column: name of the column with the indicator names
+        :param force: bool, read the file even if it did not change since it was last ingested
+        """
+        name = name or Path(path).stem
+        if not force and self._is_current(name, path):
+            return
+        wide = pd.read_excel(path, sheet_name=sheet_name)
+        long = melt_wide(wide, code_column, indicator_column=indicator_column)
+        # a few indicators are split by dimension (e.g. sex) in rows with the same name, keep the first
+        self.add(name, path, long.drop_duplicates(["indicator", "code", "year"]))
+
+    def _table(self, source):
+        if source not in self._tables:
+            path = self.store_dir / self.index["sources"][source]["file"]
+            self._tables[source] = load_dataset.read_dataset(path)
+        return self._tables[source]
+
+    def get(self, indicator):
+        """
+        :param indicator: string, name of an indicator
+        :return: pd dataframe with columns code, year and value, sorted on code and year
+        """
+        source = self.indicators.get(indicator)
+        if source is None:
+            raise KeyError(f"unknown indicator {indicator}, ingest its source first")
+        entry = self.index["sources"][source]["indicators"][indicator]
+        return self._table(source).iloc[entry["start"]:entry["stop"]].reset_index(drop=True)
+
+    def join(self, data_frame, indicators, how="left", tolerance=None, code_column="code", year_column="year"):
+        """
+        Add indicators as columns to a dataframe with a code and a year column
+        :param data_frame: pd dataframe, e.g. the year-country data
+        :param indicators: list of indicator names
+        :param how: "left" for the value of the same year, "asof" for the value of the most recent year with data
+        :param tolerance: int, in an as-of join only use values at most this many years old, None for no limit
+        :param code_column: name of the column with alpha-3 codes
+        :param year_column: name of the column with years
+        :return: pd dataframe, copy of data_frame with a column per indicator (nan where there is no value)
+        """
+        if how not in ("left", "asof"):
+            raise ValueError(f"how must be left or asof, not {how}")
+        codes = data_frame[code_column].astype(str).values
+        years = pd.to_numeric(data_frame[year_column], errors="coerce").fillna(-1).values.astype(np.int64)
+
+        result = data_frame.copy()
+        for indicator in indicators:
+            table = self.get(indicator)
+            static = self.index["sources"][self.indicators[indicator]]["indicators"][indicator]["static"]
+            result[indicator] = _lookup(table, codes, years, static, how, tolerance)
+        return result
+
+
+def _lookup(table, codes, years, static, how, tolerance):
+    """
+    Binary search of (code, year) keys in a table sorted on code and year
+    :return: numpy array of values, nan where there is none
+    """
+    table_codes = table["code"].astype(str).values
+    unique_codes, table_code_index = np.unique(table_codes, return_inverse=True)
+    code_index = pd.Index(unique_codes).get_indexer(codes)
+    if static:
+        years = np.full(len(codes), STATIC_YEAR)
+
+    table_keys = table_code_index.astype(np.int64) * _YEAR_FACTOR + table["year"].values.astype(np.int64)
+    keys = code_index.astype(np.int64) * _YEAR_FACTOR + years
+    positions = np.searchsorted(table_keys, keys, side="right") - 1
+    found = (code_index >= 0) & (years >= 0) & (positions >= 0)
+    positions = np.where(found, positions, 0)
+    found &= table_code_index[positions] == code_index
+
+    table_years = table["year"].values.astype(np.int64)[positions]
+    if how == "left" or static:
+        found &= table_years == years
+    elif tolerance is not None:
+        found &= years - table_years <= tolerance
+    return np.where(found, table["value"].values[positions], np.nan)
+
+
+@click.command()
+@click.option("--store-dir", type=click.Path(file_okay=False), default=STORE_DIR, show_default=True)
+@click.option("--force", is_flag=True, help="Read every source again, even if it did not change.")
+def main(store_dir, force):
+    """ Ingest the external data in data/raw into the indicator store. """
+    store = IndicatorStore(store_dir)
+    store.ingest_world_bank(GDP_FILE, name="gdp_per_capita", force=force)
+    store.ingest_sunshine(SUNSHINE_FILE, force=force)
+    if Path(INDICATORS_EXCEL_FILE).is_file():
+        store.ingest_excel(INDICATORS_EXCEL_FILE, name="human_development", force=force)
+    logger.info(f"indicator store has {len(store.indicators)} indicators")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    main()
@@ -0,0 +1,344 @@
+"""
+Which countries look like Lithuania? A nearest-neighbour index over the age-sex profiles of the countries (or
+country-decades), see build_features.profile_features, built once and persisted next to the processed data:
+
+    index = load_similarity_index()
+    index.similar("Lithuania", k=5)
+
+Every column of the profiles is standardised, so that the rates of the age-sex groups and the trends weigh alike, and
+countries are compared with the cosine or the euclidean distance between their vectors. The index keeps the nearest
+neighbours of every country, found with batched matrix products over the whole set, so a query is a lookup. For large
+(e.g. sub-national) sets, an approximate index skips that step: it hashes the vectors with random hyperplanes (with
+several hash tables), and a query only ranks the vectors that share a bucket with it in at least one of the tables.
+
+The index is rebuilt when the enriched data (or the code that makes the profiles or the index) changes, not when it
+was only written again.
+"""
+import hashlib
+import logging
+from pathlib import Path
+
+import click
+import numpy as np
+import pandas as pd
+
+from src.data import load_dataset
+from src.data.stage_cache import hash_code, hash_file
+from src.features import build_features
+
+INDEX_FILE = "./data/processed/similarity_index.npz"
+METRICS = ("cosine", "euclidean")
+N_NEIGHBOURS = 20  # neighbours kept of every unit in the exact index, more are searched for when asked
+MAX_CHUNK_BYTES = 64 * 2 ** 20  # largest block of distances computed at once
+N_TABLES = 8  # hash tables of the approximate index
+N_PLANES = 12  # random hyperplanes (bits of the bucket) of every hash table
+
+
+def standardise(values, means, scales):
+    """
+    :param values: (units x features) array, nan where unknown
+    :return: (units x features) array of z-scores, 0 (the mean) where unknown
+    """
+    return np.nan_to_num((values - means) / scales)
+
+
+def search(queries, points, metric, k, exclude=None, max_bytes=MAX_CHUNK_BYTES):
+    """
+    Exact nearest neighbours, in blocks of queries
+    :param queries: (queries x features) array
+    :param points: (points x features) array, rows of unit length for the cosine distance
+    :param metric: one of METRICS
+    :param k: int, number of neighbours
+    :param exclude: optional array with a position in points for every query, to leave out (the query itself)
+    :param max_bytes: int, largest block of distances to compute at once
+    :return: ((queries x k) array of positions in points, (queries x k) array of distances), nearest first. Fewer than k
+        columns if there are fewer points
+    """
+    k = min(k, len(points) - (exclude is not None))
+    squared_norms = (points ** 2).sum(axis=1)
+    chunk = max(1, max_bytes // (8 * max(len(points), 1)))
+    positions, distances = np.zeros((len(queries), max(k, 0)), dtype=np.int64), np.zeros((len(queries), max(k, 0)))
+    for start in range(0, len(queries) if k > 0 else 0, chunk):
+        block = distance_block(queries[start:start + chunk], points, squared_norms, metric)
+        if exclude is not None:
+            block[np.arange(len(block)), exclude[start:start + chunk]] = np.inf
+        nearest = np.argpartition(block, k - 1, axis=1)[:, :k] if k < len(points) else \
+            np.tile(np.arange(len(points)), (len(block), 1))
+        nearest_distances = np.take_along_axis(block, nearest, axis=1)
+        order = np.argsort(nearest_distances, axis=1, kind="stable")
+        positions[start:start + chunk] = np.take_along_axis(nearest, order, axis=1)
+        distances[start:start + chunk] = np.take_along_axis(nearest_distances, order, axis=1)
+    return positions, distances
+
+
+def distance_block(queries, points, squared_norms, metric):
+    """
+    :return: (queries x points) array of distances
+    """
+    products = queries @ points.T
+    if metric == "cosine":
+        return 1 - products
+    return np.sqrt(np.maximum((queries ** 2).sum(axis=1)[:, None] + squared_norms - 2 * products, 0.))
+
+
+def hash_codes(points, planes):
+    """
+    :param points: (points x features) array
+    :param planes: (tables x planes x features) array, the normals of the random hyperplanes
+    :return: (tables x points) array of int64, the bucket of every point in every table: the side of every hyperplane
+        it lies on, as bits
+    """
+    bits = np.einsum("tpf,nf->tnp", planes, points) > 0
+    return bits.astype(np.int64) @ (1 << np.arange(planes.shape[1], dtype=np.int64))
+
+
+class SimilarityIndex:
+    """
+    Standardised profile vectors of a set of units (countries or country-decades), with their nearest neighbours (or
+    the hash tables to find them with)
+    """
+
+    def __init__(self, keys, columns, means, scales, points, metric, neighbours=None, distances=None, planes=None,
+                 fingerprint=""):
+        """
+        :param keys: pd dataframe, the keys of every unit (e.g. country), one row per unit
+        :param columns: list of the names of the profile features
+        :param means: array, mean of every feature over the units, and likewise their standard deviations in scales
+        :param points: (units x features) array, the standardised profiles, of unit length for the cosine distance
+        :param metric: one of METRICS
+        :param neighbours: (units x n) array, positions of the nearest units of every unit (exact index), or None
+        :param distances: (units x n) array, their distances
+        :param planes: (tables x planes x features) array, the hyperplanes of the approximate index, or None
+        :param fingerprint: string, identifies the data and settings the index was built from, see index_fingerprint
+        """
+        if metric not in METRICS:
+            raise ValueError(f"unknown metric {metric}, choose from {METRICS}")
+        self.keys = keys.reset_index(drop=True)
+        self.columns = list(columns)
+        self.means, self.scales, self.points = means, scales, points
+        self.metric = metric
+        self.neighbours, self.distances = neighbours, distances
+        self.planes = planes
+        self.fingerprint = fingerprint
+        self._positions = {key: i for i, key in enumerate(self._key_tuples(self.keys))}
+        self._buckets = None
+        if planes is not None:
+            codes = hash_codes(points, planes)
+            order = np.argsort(codes, axis=1, kind="stable")
+            self._buckets = (order, np.take_along_axis(codes, order, axis=1))
+
+    @classmethod
+    def build(cls, profiles, key_columns, metric="cosine", n_neighbours=N_NEIGHBOURS, approximate=False,
+              n_tables=N_TABLES, n_planes=N_PLANES, seed=0, fingerprint=""):
+        """
+        :param profiles: pd dataframe, the key columns and a column per feature, see build_features.profile_features
+        :param key_columns: list of the key columns of profiles
+        :param metric: one of METRICS
+        :param n_neighbours: int, number of nearest neighbours to keep of every unit (exact index only)
+        :param approximate: bool, build hash tables instead of finding the neighbours of every unit
+        :param n_tables: int, number of hash tables of the approximate index
+        :param n_planes: int, number of hyperplanes of every hash table
+        :param seed: int, seed of the random hyperplanes
+        :param fingerprint: string, see index_fingerprint
+        :return: SimilarityIndex
+        """
+        columns = [column for column in profiles.columns if column not in key_columns]
+        values = profiles[columns].values.astype(np.float64)
+        with np.errstate(invalid="ignore"):
+            means = np.nan_to_num(np.nanmean(values, axis=0)) if len(values) else np.zeros(len(columns))
+            scales = np.nan_to_num(np.nanstd(values, axis=0)) if len(values) else np.ones(len(columns))
+        scales[scales == 0] = 1.
+        points = cls._points(standardise(values, means, scales), metric)
+
+        neighbours = distances = planes = None
+        if approximate:
+            planes = np.random.default_rng(seed).normal(size=(n_tables, n_planes, len(columns)))
+        else:
+            neighbours, distances = search(points, points, metric, n_neighbours, exclude=np.arange(len(points)))
+        return cls(profiles[key_columns], columns, means, scales, points, metric, neighbours, distances, planes,
+                   fingerprint)
+
+    @staticmethod
+    def _points(standardised, metric):
+        if metric != "cosine":
+            return standardised
+        norms = np.sqrt((standardised ** 2).sum(axis=1, keepdims=True))
+        return standardised / np.where(norms > 0, norms, 1.)
+
+    @staticmethod
+    def _key_tuples(keys):
+        return [tuple(row) for row in keys.astype(object).values.tolist()]
+
+    def save(self, path=INDEX_FILE):
+        """
+        :param path: path of the npz file to write
+        """
+        # numpy strings instead of objects, so that loading does not need pickle
+        arrays = {f"key__{column}": self.keys[column].values.astype(str) if self.keys[column].dtype == object
+                  else self.keys[column].values for column in self.keys.columns}
+        arrays.update(key_columns=np.array(self.keys.columns, dtype=str), columns=np.array(self.columns, dtype=str),
+                      means=self.means, scales=self.scales, points=self.points, metric=np.array(self.metric),
+                      fingerprint=np.array(self.fingerprint))
+        for name in ["neighbours", "distances", "planes"]:
+            if getattr(self, name) is not None:
+                arrays[name] = getattr(self, name)
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path=INDEX_FILE):
+        """
+        :param path: path of an npz file written by save
+        :return: SimilarityIndex
+        """
+        with np.load(path) as arrays:
+            keys = pd.DataFrame({column: arrays[f"key__{column}"] for column in arrays["key_columns"].tolist()})
+            optional = {name: arrays[name] if name in arrays.files else None
+                        for name in ["neighbours", "distances", "planes"]}
+            return cls(keys, arrays["columns"].tolist(), arrays["means"], arrays["scales"], arrays["points"],
+                       str(arrays["metric"]), fingerprint=str(arrays["fingerprint"]), **optional)
+
+    def position(self, key):
+        """
+        :param key: the key of a unit, e.g. "Lithuania", or ("Lithuania", 1990) for country-decades
+        :return: int, its row in the index
+        """
+        key = key if isinstance(key, tuple) else (key,)
+        if key not in self._positions:
+            raise KeyError(f"no profile of {key} in the similarity index")
+        return self._positions[key]
+
+    def similar(self, key, k=5):
+        """
+        :param key: the key of a unit, see position
+        :param k: int, number of similar units
+        :return: pd dataframe, the keys of the k units nearest to it (not itself), nearest first, and their distance
+        """
+        position = self.position(key)
+        if self.neighbours is not None and k <= self.neighbours.shape[1]:
+            positions, distances = self.neighbours[position, :k], self.distances[position, :k]
+        else:
+            positions, distances = self._search(self.points[[position]], k, exclude=np.array([position]))
+            positions, distances = positions[0], distances[0]
+        return self._similar_frame(positions, distances)
+
+    def query(self, profiles, k=5):
+        """
+        Units similar to profiles that need not be in the index, e.g. of a country-decade against the countries
+        :param profiles: pd dataframe with the feature columns of the index (others are ignored)
+        :param k: int, number of similar units of every profile
+        :return: pd dataframe, for every profile (its row number in column query) the keys of the k units nearest to
+            it, nearest first, and their distance
+        """
+        missing = set(self.columns) - set(profiles.columns)
+        if missing:
+            raise KeyError(f"profiles without the columns {sorted(missing)} of the similarity index")
+        values = profiles[self.columns].values.astype(np.float64)
+        positions, distances = self._search(self._points(standardise(values, self.means, self.scales), self.metric), k)
+        return self._similar_frame(positions.ravel(), distances.ravel(),
+                                   query=np.repeat(np.arange(len(profiles)), positions.shape[1]))
+
+    def _similar_frame(self, positions, distances, **columns):
+        columns.update({column: self.keys[column].values[positions] for column in self.keys.columns})
+        columns["distance"] = distances
+        return pd.DataFrame(columns)
+
+    def _search(self, queries, k, exclude=None):
+        """
+        Nearest neighbours of some queries: exact, or among the units sharing a bucket with them in the approximate
+        index (exact for a query with fewer than k such units)
+        :return: ((queries x k) array of positions, (queries x k) array of distances)
+        """
+        if self._buckets is None:
+            return search(queries, self.points, self.metric, k, exclude)
+        order, sorted_codes = self._buckets
+        codes = hash_codes(queries, self.planes)
+        k = min(k, len(self.points) - (exclude is not None))
+        positions, distances = np.zeros((len(queries), k), dtype=np.int64), np.zeros((len(queries), k))
+        for i, query_codes in enumerate(codes.T):
+            starts = [np.searchsorted(table, code, side="left") for table, code in zip(sorted_codes, query_codes)]
+            stops = [np.searchsorted(table, code, side="right") for table, code in zip(sorted_codes, query_codes)]
+            candidates = np.unique(np.concatenate([table[start:stop]
+                                                   for table, start, stop in zip(order, starts, stops)]))
+            if exclude is not None:
+                candidates = candidates[candidates != exclude[i]]
+            if len(candidates) < k:
+                candidates = np.arange(len(self.points))
+                candidates = candidates[candidates != exclude[i]] if exclude is not None else candidates
+            found, found_distances = search(queries[[i]], self.points[candidates], self.metric, k)
+            positions[i], distances[i] = candidates[found[0]], found_distances[0]
+        return positions, distances
+
+
+def index_fingerprint(processed_dir=load_dataset.PROCESSED_DIR, **settings):
+    """
+    :param processed_dir: directory with the processed data
+    :param settings: keyword arguments the index is built with
+    :return: string, a hash of the files of the enriched data, the code that makes the profiles and the index, and
+        the settings
+    """
+    files = [load_dataset.dataset_path("enriched", output_format, processed_dir)
+             for output_format in load_dataset.FORMAT_EXTENSIONS]
+    partitioned = load_dataset.partitioned_path("enriched", processed_dir)
+    files += sorted(partitioned.rglob("*")) if partitioned.is_dir() else []
+    parts = [f"{file.name}:{hash_file(file)}" for file in files if file.is_file()]
+    parts += [hash_code(load_similarity_index)]  # this module, build_features.py and the modules they import
+    parts += [f"{name}={value}" for name, value in sorted(settings.items())]
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+def load_similarity_index(path=INDEX_FILE, rebuild=False, decades=False, metric="cosine", approximate=False,
+                          processed_dir=load_dataset.PROCESSED_DIR):
+    """
+    Load the similarity index, building it first (from the processed enriched data) if it does not exist yet or if it
+    was built from other data or with other settings
+    :param path: path of the npz file
+    :param rebuild: bool, always rebuild the index
+    :param decades: bool, index every decade of a country separately, see build_features.profile_features
+    :param metric: one of METRICS
+    :param approximate: bool, build an approximate index, see SimilarityIndex.build
+    :param processed_dir: directory with the processed data
+    :return: SimilarityIndex
+    """
+    path = Path(path)
+    fingerprint = index_fingerprint(processed_dir, decades=decades, metric=metric, approximate=approximate)
+    if not rebuild and path.is_file():
+        index = SimilarityIndex.load(path)
+        if index.fingerprint == fingerprint:
+            return index
+
+    logging.getLogger(__name__).info(f"building similarity index {path}")
+    enriched_df = load_dataset.load_dataset("enriched", columns=["country", "year", "sex", "age", "suicides_no",
+                                                                 "population"], processed_dir=processed_dir)
+    profiles = build_features.profile_features(enriched_df, decades=decades)
+    key_columns = ["country", "decade"] if decades else ["country"]
+    index = SimilarityIndex.build(profiles.astype({"country": str}), key_columns, metric=metric,
+                                  approximate=approximate, fingerprint=fingerprint)
+    index.save(path)
+    return index
+
+
+@click.command()
+@click.argument("country")
+@click.option("-k", "k", type=click.IntRange(min=1), default=5, show_default=True, help="Number of similar countries.")
+@click.option("--decade", type=int, default=None,
+              help="Compare this decade of the country (e.g. 1990) with every decade of every country.")
+@click.option("--metric", type=click.Choice(METRICS), default="cosine", show_default=True)
+@click.option("--approximate", is_flag=True, help="Use the approximate (hashed) index, for large sets.")
+@click.option("--index-file", type=click.Path(dir_okay=False), default=INDEX_FILE, show_default=True)
+@click.option("--rebuild", is_flag=True, help="Rebuild the index even if the enriched data did not change.")
+def main(country, k, decade, metric, approximate, index_file, rebuild):
+    """ Print the countries whose suicide rates by age and sex look most like those of COUNTRY. """
+    index = load_similarity_index(index_file, rebuild=rebuild, decades=decade is not None, metric=metric,
+                                  approximate=approximate)
+    key = country if decade is None else (country, decade)
+    try:
+        similar = index.similar(key, k)
+    except KeyError as error:
+        raise click.BadParameter(str(error.args[0]), param_hint="COUNTRY")
+    click.echo(similar.to_string(index=False))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    main()
@@ -0,0 +1,143 @@
+"""
+Score the year-country data with a bundle of models from train_model.py: the predicted suicide rate of every
+(country, year, sex), with the model of its group (by default the feature set with the lowest cross-validated error).
+
+The data is streamed in chunks (csv chunks, parquet row groups or slices of a memory-mapped feather file), every chunk
+is joined with the meta data and the indicators, scored with a few array operations and appended to the output, so
+memory use is bounded by the chunk size however large the table is.
+
+    python src/models/predict_model.py --input data/processed/year_country_data.parquet --output predictions.parquet
+"""
+import logging
+from pathlib import Path
+
+import click
+import numpy as np
+import pandas as pd
+
+from src.data import load_dataset, partitioned
+from src.features.indicator_store import STORE_DIR, IndicatorStore
+from src.models import train_model
+
+YEAR_COUNTRY_FILE = "./data/processed/year_country_data.csv"
+META_FILE = "./data/processed/cleaned_meta.csv"
+PREDICTIONS_FILE = "./data/processed/rate_predictions.csv"
+DEFAULT_CHUNKSIZE = 100000
+
+logger = logging.getLogger(__name__)
+
+
+def iter_chunks(path, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    :param path: path of a .csv, .parquet or .feather file
+    :param chunksize: int, maximum number of rows of a chunk
+    :return: generator of pd dataframes
+    """
+    suffix = Path(path).suffix
+    if suffix == ".csv":
+        yield from pd.read_csv(path, chunksize=chunksize, float_precision="round_trip")
+        return
+    if suffix == ".parquet":
+        from pyarrow import parquet
+        parquet_file = parquet.ParquetFile(str(path))
+        tables = (parquet_file.read_row_group(i) for i in range(parquet_file.num_row_groups))
+    elif suffix == ".feather":
+        from pyarrow import feather
+        tables = [feather.read_table(str(path), memory_map=True)]
+    else:
+        raise ValueError(f"don't know how to read {path}, expected a .csv, .parquet or .feather file")
+    for table in tables:
+        for offset in range(0, table.num_rows, chunksize):
+            yield table.slice(offset, chunksize).to_pandas()
+
+
+def feature_set_index(bundle, feature_set):
+    """
+    :param bundle: ModelBundle
+    :param feature_set: string, names of the features joined by train_model.FEATURE_SET_SEPARATOR
+    :return: int, position of the feature set in the bundle
+    """
+    names = train_model.feature_set_names(bundle.feature_sets, bundle.features)
+    if feature_set not in names:
+        raise ValueError(f"the models have no feature set {feature_set}, choose from {names}")
+    return names.index(feature_set)
+
+
+def predict(bundle, frame, feature_set=None):
+    """
+    :param bundle: ModelBundle
+    :param frame: pd dataframe with the group columns and indicators of the models, see train_model.model_frame
+    :param feature_set: string, the feature set to use for all groups, None for the best one of every group
+    :return: (numpy array, predicted rate of every row, numpy array, position of the feature set used for every row).
+        nan (and -1) for rows of groups without a model, and nan for rows with a feature of the set missing
+    """
+    known = pd.MultiIndex.from_arrays(list(bundle.group_keys.T))
+    group = known.get_indexer(pd.MultiIndex.from_arrays([frame[column].astype(str).values
+                                                        for column in bundle.group_by]))
+    has_group = group >= 0
+    if feature_set is None:
+        sets = np.where(has_group, bundle.best[np.maximum(group, 0)], -1)
+    else:
+        sets = np.where(has_group, feature_set_index(bundle, feature_set), -1)
+
+    x = np.column_stack([train_model.feature_values(frame, feature) for feature in bundle.features])
+    x = (x - bundle.means) / bundle.scales
+    coefficients = bundle.coefficients[np.maximum(group, 0), np.maximum(sets, 0)]
+    missing = (np.isnan(x) & bundle.feature_sets[np.maximum(sets, 0)]).any(axis=1)
+    predicted = coefficients[:, 0] + (np.nan_to_num(x) * coefficients[:, 1:]).sum(axis=1)
+    return np.where(has_group & ~missing, predicted, np.nan), sets
+
+
+def score_file(bundle, input_path, output_path, meta_df, store, chunksize=DEFAULT_CHUNKSIZE, feature_set=None):
+    """
+    Score a year-country file chunk by chunk, and append the predictions to the output
+    :param bundle: ModelBundle
+    :param input_path: path of the year-country data
+    :param output_path: path of a .csv or .parquet file to write the predictions to
+    :param meta_df: pd dataframe, the cleaned meta data
+    :param store: IndicatorStore with the indicators of the models
+    :param chunksize: int, number of rows of the year-country data to score at a time
+    :param feature_set: string, see predict
+    :return: int, number of rows written
+    """
+    output_format = Path(output_path).suffix.lstrip(".")
+    names = np.array(train_model.feature_set_names(bundle.feature_sets, bundle.features) + [""])
+    features = list(bundle.features)
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    with partitioned.PartitionWriter(output_path, output_format) as writer:
+        for chunk in iter_chunks(input_path, chunksize):
+            frame = train_model.model_frame(chunk, meta_df, store, features)
+            predicted, sets = predict(bundle, frame, feature_set)
+            scored = frame[["country", "code", "year", "region", "income", "sex", "rate"]].assign(
+                predicted=predicted, residual=frame["rate"].values - predicted, feature_set=names[sets])
+            writer.write(scored)
+    return writer.rows
+
+
+@click.command()
+@click.option("--model", "model_file", type=click.Path(exists=True, dir_okay=False), default=train_model.MODEL_FILE,
+              show_default=True, help="Models saved by train_model.py.")
+@click.option("--input", "input_file", type=click.Path(exists=True, dir_okay=False), default=YEAR_COUNTRY_FILE,
+              show_default=True, help="Year-country data, a .csv, .parquet or .feather file.")
+@click.option("--meta", "meta_file", type=click.Path(exists=True, dir_okay=False), default=META_FILE,
+              show_default=True, help="Cleaned meta data, for the region and income group of the countries.")
+@click.option("--store-dir", type=click.Path(file_okay=False), default=STORE_DIR, show_default=True)
+@click.option("--output", type=click.Path(dir_okay=False), default=PREDICTIONS_FILE, show_default=True,
+              help="File to write the predictions to, a .csv or .parquet file.")
+@click.option("--chunksize", type=click.IntRange(min=1), default=DEFAULT_CHUNKSIZE, show_default=True)
+@click.option("--feature-set", default=None,
+              help=f"Features of the models to use, joined by {train_model.FEATURE_SET_SEPARATOR}. Default the best "
+                   f"set of every group.")
+def main(model_file, input_file, meta_file, store_dir, output, chunksize, feature_set):
+    """ Predict the suicide rate of every country, year and sex with the trained models. """
+    if Path(output).suffix not in (".csv", ".parquet"):
+        raise click.BadParameter(f"{output} should end in .csv or .parquet", param_hint="--output")
+    bundle = train_model.load_bundle(model_file)
+    rows = score_file(bundle, input_file, output, load_dataset.read_dataset(meta_file), IndicatorStore(store_dir),
+                      chunksize, feature_set)
+    logger.info(f"wrote {rows} predictions to {output}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    main()
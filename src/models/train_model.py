@@ -0,0 +1,354 @@
+"""
+Fit many small linear models of the suicide rate at once: one per group of country-years (e.g. per region, income
+group and sex) and per set of features (e.g. log GDP per capita and sunshine hours, from the indicator store), with
+ridge regression (ordinary least squares for a penalty of 0) and k-fold cross-validation.
+
+Nothing is fitted one model at a time. Everything a linear fit needs is in the augmented Gram matrix Z'Z of the rows
+z = [1, x_1, .., x_k, y] of a group: X'X, X'y, y'y and the number of rows are blocks of it. We compute these matrices
+for every (fold, group, pattern of missing features) in a single pass over the rows. The Gram matrix of a feature set is
+then the sum, over the patterns in which all of its features are there, of its rows and columns, and the fits of all
+groups and folds of a feature set are one batched solve. The error on a held-out fold follows from the Gram matrix of
+the fold, without going back to the rows: SSE = y'y - 2 b'X'y + b'X'X b. Feature sets are spread over a process pool.
+
+Features are standardised (over all rows) before fitting, so that the penalty treats them alike, the intercept is not
+penalised. Folds are made of whole countries, as the years of a country are far from independent.
+
+The models are saved as a compact npz bundle for predict_model.py:
+
+    python src/models/train_model.py --feature log_gdp_per_capita --feature sunshine_year --group-by region
+"""
+import itertools
+import logging
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import click
+import numpy as np
+import pandas as pd
+
+from src.data import load_dataset
+from src.features.indicator_store import STORE_DIR, IndicatorStore
+
+MODEL_FILE = "./models/rate_models.npz"
+RATE_COLUMNS = {"female": "female_rate", "male": "male_rate", "all": "overall_rate"}  # sex -> its rate column
+GROUP_COLUMNS = ("region", "income", "sex")
+DEFAULT_FEATURES = ("log_gdp_per_capita",)
+LOG_PREFIX = "log_"  # a feature log_<indicator> is the log of the indicator
+FEATURE_SET_SEPARATOR = "+"
+DEFAULT_PENALTY = 1.
+MAX_CHUNK_BYTES = 64 * 2 ** 20
+
+# a set of fitted models, one per group and feature set. Arrays of groups x feature sets (x features + 1) for the
+# coefficients (intercept first, standardised features, 0 for features not in the set), the number of rows the model
+# was fitted on, its cross-validated root mean squared error and its r2. best is the feature set with the lowest error
+# of every group, feature_sets a feature sets x features array of booleans
+ModelBundle = namedtuple("ModelBundle", ["group_by", "group_keys", "features", "means", "scales", "feature_sets",
+                                         "coefficients", "n", "cv_rmse", "r2", "best", "penalty"])
+
+logger = logging.getLogger(__name__)
+
+
+def indicator_of(feature):
+    return feature[len(LOG_PREFIX):] if feature.startswith(LOG_PREFIX) else feature
+
+
+def feature_values(data_frame, feature):
+    """
+    :param data_frame: pd dataframe with the indicators as columns
+    :param feature: string, a column of data_frame or log_<column>
+    :return: numpy array of floats, nan where missing (or not positive, for a log)
+    """
+    if feature in data_frame:
+        return data_frame[feature].values.astype(np.float64)
+    values = data_frame[indicator_of(feature)].values.astype(np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(values > 0, np.log(np.where(values > 0, values, 1.)), np.nan)
+
+
+def model_frame(year_country_df, meta_df, store, features, sexes=tuple(RATE_COLUMNS)):
+    """
+    The rows to fit the models on (or to score): one per (country, year, sex), with the rate, the region and income
+    group of the country and the indicators of the features
+    :param year_country_df: pd dataframe, the year-country data
+    :param meta_df: pd dataframe, the cleaned meta data (code, region, income)
+    :param store: IndicatorStore with the indicators of the features
+    :param features: list of feature names, see feature_values
+    :param sexes: list of keys of RATE_COLUMNS
+    :return: pd dataframe with columns country, code, year, region, income, sex, rate and one per indicator
+    """
+    indicators = list(dict.fromkeys(indicator_of(feature) for feature in features))
+    df = store.join(year_country_df[["country", "code", "year"] + [RATE_COLUMNS[sex] for sex in sexes]], indicators)
+    meta = meta_df[["code", "region", "income"]].drop_duplicates("code")
+    df = df.assign(code=df["code"].astype(str)).merge(meta.assign(code=meta["code"].astype(str)), on="code",
+                                                      how="left")
+    parts = [df.assign(sex=sex, rate=df[RATE_COLUMNS[sex]]) for sex in sexes]
+    columns = ["country", "code", "year", "region", "income", "sex", "rate"] + indicators
+    return pd.concat(parts, ignore_index=True)[columns]
+
+
+def all_feature_sets(features, max_size=None):
+    """
+    :param features: list of feature names
+    :param max_size: int, largest number of features in a set, None for all
+    :return: numpy array of bools, every non-empty set of features (at most max_size) x features
+    """
+    sizes = range(1, (max_size or len(features)) + 1)
+    combinations = [combination for size in sizes for combination in itertools.combinations(range(len(features)), size)]
+    feature_sets = np.zeros((len(combinations), len(features)), dtype=bool)
+    for i, combination in enumerate(combinations):
+        feature_sets[i, list(combination)] = True
+    return feature_sets
+
+
+def feature_set_names(feature_sets, features):
+    return [FEATURE_SET_SEPARATOR.join(np.asarray(features)[feature_set]) for feature_set in feature_sets]
+
+
+def augmented_grams(x, y, cells, n_cells):
+    """
+    :param x: numpy array, rows x features, nan where missing
+    :param y: numpy array, the target of every row
+    :param cells: numpy array of ints, the cell (fold, group and missing pattern) of every row
+    :param n_cells: int, number of cells
+    :return: numpy array, cells x (features + 2) x (features + 2), the sum of z z' over the rows of every cell, with
+        z = [1, x (0 where missing), y]
+    """
+    z = np.column_stack([np.ones(len(y)), np.nan_to_num(x), y])
+    order = np.argsort(cells, kind="stable")
+    sorted_cells = cells[order]
+    starts = np.flatnonzero(np.r_[True, sorted_cells[1:] != sorted_cells[:-1]]) if len(cells) else np.array([], int)
+    grams = np.zeros((n_cells, z.shape[1], z.shape[1]))
+    if len(starts):
+        products = z[order][:, :, None] * z[order][:, None, :]
+        grams[sorted_cells[starts]] = np.add.reduceat(products, starts, axis=0)
+    return grams
+
+
+def _squared_errors(beta, grams):
+    """
+    :param beta: numpy array, ... x p, coefficients
+    :param grams: numpy array, ... x p + 1 x p + 1, augmented Gram matrices of the rows to evaluate on (target last)
+    :return: numpy array, the sum of squared errors of the predictions of the coefficients on the rows
+    """
+    xx, xy, yy = grams[..., :-1, :-1], grams[..., :-1, -1], grams[..., -1, -1]
+    return yy - 2 * np.einsum("...i,...i->...", beta, xy) + np.einsum("...i,...ij,...j->...", beta, xx, beta)
+
+
+def set_grams(by_pattern, pattern_codes, set_codes, n_features):
+    """
+    :param by_pattern: numpy array, patterns x ..., the Gram matrices of the rows of every missing pattern
+    :param pattern_codes: numpy array of ints, the features there in every pattern as bits
+    :param set_codes: numpy array of ints, the features of every feature set as bits
+    :param n_features: int
+    :return: numpy array, feature sets x ..., the sum over the patterns with all features of every set
+    """
+    if n_features * 2 ** n_features > len(set_codes) * len(pattern_codes):
+        usable = (pattern_codes[None] & set_codes[:, None]) == set_codes[:, None]
+        return (usable.astype(np.float64) @ by_pattern.reshape(len(pattern_codes), -1)).reshape(
+            (len(set_codes),) + by_pattern.shape[1:])
+    # few features: sum over the supersets of every code at once, one feature at a time
+    sums = np.zeros((2 ** n_features,) + by_pattern.shape[1:])
+    sums[pattern_codes] = by_pattern
+    for bit in range(n_features):
+        halves = sums.reshape((-1, 2, 2 ** bit) + by_pattern.shape[1:])
+        halves[:, 0] += halves[:, 1]
+    return sums[set_codes]
+
+
+def _fit_chunk(folds, feature_sets, penalty):
+    """
+    fit_feature_sets for the Gram matrices of some feature sets, sets x folds x groups x size x size. Every feature set
+    is fitted in the space of all features, the features that are not in the set are decoupled (their rows and columns
+    of the Gram matrix set to those of the identity, with 0 on the right hand side) so that their coefficients are 0,
+    and all of them are one batched solve
+    """
+    size = folds.shape[-1]
+    used = np.column_stack([np.ones(len(feature_sets), dtype=bool), feature_sets, np.ones(len(feature_sets), bool)])
+    folds *= (used[:, :, None] & used[:, None, :])[:, None, None]
+    total = folds.sum(axis=1)
+    train = np.concatenate([total[:, None] - folds, total[:, None]], axis=1)  # the folds left out, and all of them
+    n_train = train[..., 0, 0]
+    n_parameters = feature_sets.sum(axis=1) + 1
+    enough = n_train > (n_parameters[:, None, None] + 1 if penalty == 0 else 1)
+
+    a = train[..., :-1, :-1]
+    diagonal = np.column_stack([np.zeros(len(feature_sets)), np.where(feature_sets, penalty, 1.)])
+    a[..., np.arange(size - 1), np.arange(size - 1)] += diagonal[:, None, None]
+    a[~enough] = np.eye(size - 1)  # placeholders, the results are dropped
+    b = train[..., :-1, -1]
+    try:
+        beta = np.linalg.solve(a, b[..., None])[..., 0]
+    except np.linalg.LinAlgError:
+        beta = np.einsum("...ij,...j->...i", np.linalg.pinv(a), b)  # collinear features without a penalty
+    beta[~enough] = np.nan
+
+    sse = _squared_errors(beta[:, :-1], folds)  # of every fold, with the model fitted on the other folds
+    n_held = folds[..., 0, 0]
+    tested = enough[:, :-1] & (n_held > 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cv_rmse = np.sqrt(np.where(tested, sse, 0).sum(axis=1) / np.where(tested, n_held, 0).sum(axis=1))
+        n, full_beta = total[..., 0, 0], beta[:, -1]
+        r2 = 1 - _squared_errors(full_beta, total) / (total[..., -1, -1] - total[..., 0, -1] ** 2 / n)
+    fitted = enough[:, -1]
+    return full_beta, n, np.where(fitted & tested.any(axis=1), cv_rmse, np.nan), np.where(fitted, r2, np.nan)
+
+
+def fit_feature_sets(grams, patterns, feature_sets, penalty, max_bytes=MAX_CHUNK_BYTES):
+    """
+    Fit the models of some feature sets, for every group and fold at once
+    :param grams: numpy array, folds x groups x patterns x (features + 2) x (features + 2), see augmented_grams
+    :param patterns: numpy array of bools, patterns x features, which features are there in every pattern
+    :param feature_sets: numpy array of bools, feature sets x features
+    :param penalty: float, ridge penalty on the (standardised) coefficients
+    :param max_bytes: int, about the most memory to use for the Gram matrices of the feature sets fitted at once
+    :return: (coefficients, n, cv_rmse, r2), arrays of feature sets x groups (x features + 1), nan for groups with too
+        few rows
+    """
+    n_folds, n_groups, n_patterns, size, _ = grams.shape
+    n_features = patterns.shape[1]
+    bits = 1 << np.arange(n_features, dtype=np.int64)
+    pattern_codes, set_codes = patterns.astype(np.int64) @ bits, feature_sets.astype(np.int64) @ bits
+    by_pattern = np.ascontiguousarray(np.moveaxis(grams, 2, 0))
+
+    group_bytes = 3 * (n_folds + 1) * size * size * 8  # per feature set
+    if n_features * 2 ** n_features > len(feature_sets) * n_patterns:
+        set_step = max(int(max_bytes // group_bytes), 1)
+        sets_in_memory = min(set_step, len(feature_sets))
+    else:
+        set_step, sets_in_memory = len(feature_sets), 2 ** n_features
+    group_step = max(int(max_bytes // (group_bytes * sets_in_memory)), 1)
+
+    coefficients = np.empty((len(feature_sets), n_groups, size - 1))
+    n, cv_rmse, r2 = (np.empty((len(feature_sets), n_groups)) for _ in range(3))
+    for s in range(0, len(feature_sets), set_step):
+        for g in range(0, n_groups, group_step):
+            chunk = set_grams(by_pattern[:, :, g:g + group_step], pattern_codes, set_codes[s:s + set_step], n_features)
+            chunk = _fit_chunk(chunk, feature_sets[s:s + set_step], penalty)
+            for result, part in zip((coefficients, n, cv_rmse, r2), chunk):
+                result[s:s + set_step, g:g + group_step] = part
+    return coefficients, n, cv_rmse, r2
+
+
+def fit_all(grams, patterns, feature_sets, penalty, jobs=1):
+    """
+    fit_feature_sets for all feature sets, spread over jobs processes
+    :return: (coefficients, n, cv_rmse, r2), see fit_feature_sets
+    """
+    if jobs == 1 or len(feature_sets) < 2:
+        return fit_feature_sets(grams, patterns, feature_sets, penalty)
+    chunks = [chunk for chunk in np.array_split(feature_sets, min(len(feature_sets), 4 * jobs)) if len(chunk)]
+    with ProcessPoolExecutor(jobs) as executor:
+        results = list(executor.map(fit_feature_sets, *zip(*[(grams, patterns, chunk, penalty) for chunk in chunks])))
+    return [np.concatenate([result[i] for result in results]) for i in range(4)]
+
+
+def train_models(frame, features, group_by=GROUP_COLUMNS, feature_sets=None, penalty=DEFAULT_PENALTY, n_folds=5,
+                 seed=0, jobs=1):
+    """
+    :param frame: pd dataframe, see model_frame
+    :param features: list of feature names
+    :param group_by: list of columns, a model is fitted per group of rows
+    :param feature_sets: numpy array of bools, feature sets x features, default all_feature_sets(features)
+    :param penalty: float, ridge penalty, 0 for ordinary least squares
+    :param n_folds: int, number of folds of the cross-validation
+    :param seed: int, seed of the assignment of countries to folds
+    :param jobs: int, number of processes to fit on
+    :return: ModelBundle
+    """
+    group_by = list(group_by)
+    feature_sets = all_feature_sets(features) if feature_sets is None else np.asarray(feature_sets, dtype=bool)
+    x = np.column_stack([feature_values(frame, feature) for feature in features])
+    y = frame["rate"].values.astype(np.float64)
+    keys = frame[group_by].astype(str).where(frame[group_by].notnull())
+    valid = np.isfinite(y) & keys.notnull().all(axis=1).values & ~np.isnan(x).all(axis=1)
+    x, y, keys, countries = x[valid], y[valid], keys[valid], frame["country"].values[valid]
+
+    means, scales = np.nanmean(x, axis=0), np.nanstd(x, axis=0)
+    scales = np.where(scales > 0, scales, 1.)
+    x = (x - means) / scales
+
+    group, group_keys = pd.MultiIndex.from_frame(keys).factorize()
+    country, unique_countries = pd.factorize(countries)
+    fold_of_country = np.random.default_rng(seed).permutation(len(unique_countries)) % n_folds
+    bits = 1 << np.arange(len(features), dtype=np.int64)
+    pattern, unique_patterns = pd.factorize((~np.isnan(x)).astype(np.int64) @ bits)  # which features are there
+    patterns = (unique_patterns[:, None] & bits) > 0
+
+    n_groups, n_patterns = len(group_keys), len(patterns)
+    cells = (fold_of_country[country] * n_groups + group) * n_patterns + pattern
+    grams = augmented_grams(x, y, cells, n_folds * n_groups * n_patterns)
+    grams = grams.reshape(n_folds, n_groups, n_patterns, len(features) + 2, len(features) + 2)
+    coefficients, n, cv_rmse, r2 = fit_all(grams, patterns, feature_sets, penalty, jobs)
+
+    best = np.argmin(np.where(np.isnan(cv_rmse), np.inf, cv_rmse), axis=0)
+    return ModelBundle(group_by=np.array(group_by), group_keys=np.array(list(group_keys), dtype=str).reshape(
+        n_groups, len(group_by)), features=np.array(features), means=means, scales=scales, feature_sets=feature_sets,
+        coefficients=coefficients.transpose(1, 0, 2), n=n.T, cv_rmse=cv_rmse.T, r2=r2.T, best=best,
+        penalty=np.float64(penalty))
+
+
+def save_bundle(bundle, path=MODEL_FILE):
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    np.savez_compressed(path, **bundle._asdict())
+
+
+def load_bundle(path=MODEL_FILE):
+    with np.load(path, allow_pickle=False) as arrays:
+        return ModelBundle(**{field: arrays[field] for field in ModelBundle._fields})
+
+
+def summary(bundle, best_only=True):
+    """
+    :param bundle: ModelBundle
+    :param best_only: bool, only the feature set with the lowest error of every group
+    :return: pd dataframe, one row per group (and feature set), with the number of rows, the errors and the
+        coefficients (per unit of the feature, not standardised)
+    """
+    names = feature_set_names(bundle.feature_sets, bundle.features)
+    rows = []
+    for g, key in enumerate(bundle.group_keys):
+        for s in [bundle.best[g]] if best_only else range(len(names)):
+            slopes = bundle.coefficients[g, s, 1:] / bundle.scales
+            intercept = bundle.coefficients[g, s, 0] - (slopes * bundle.means).sum()
+            row = dict(zip(bundle.group_by, key), feature_set=names[s], n=int(bundle.n[g, s]),
+                       cv_rmse=bundle.cv_rmse[g, s], r2=bundle.r2[g, s], intercept=intercept)
+            row.update({feature: slope for feature, slope, used in zip(bundle.features, slopes, bundle.feature_sets[s])
+                        if used})
+            rows.append(row)
+    return pd.DataFrame(rows)
+
+
+@click.command()
+@click.option("--input-dir", type=click.Path(exists=True, file_okay=False), default=load_dataset.PROCESSED_DIR,
+              show_default=True, help="Directory with the year-country data and the cleaned meta data.")
+@click.option("--store-dir", type=click.Path(file_okay=False), default=STORE_DIR, show_default=True,
+              help="Indicator store with the indicators of the features, see src/features/indicator_store.py.")
+@click.option("--feature", "features", multiple=True, default=DEFAULT_FEATURES, show_default=True,
+              help="Indicator in the store, or log_<indicator> for its log. Repeat for several, every non-empty set "
+                   "of them is fitted.")
+@click.option("--group-by", type=click.Choice(GROUP_COLUMNS), multiple=True, default=GROUP_COLUMNS,
+              show_default=True, help="Fit a model per group of country-years, repeat for several.")
+@click.option("--max-set-size", type=int, default=None, help="Largest number of features in a set.")
+@click.option("--penalty", type=float, default=DEFAULT_PENALTY, show_default=True,
+              help="Ridge penalty on the standardised coefficients, 0 for ordinary least squares.")
+@click.option("--folds", "n_folds", type=click.IntRange(min=2), default=5, show_default=True)
+@click.option("--seed", type=int, default=0, show_default=True)
+@click.option("--jobs", type=click.IntRange(min=1), default=1, show_default=True)
+@click.option("--output", type=click.Path(dir_okay=False), default=MODEL_FILE, show_default=True)
+def main(input_dir, store_dir, features, group_by, max_set_size, penalty, n_folds, seed, jobs, output):
+    """ Fit a linear model of the suicide rate for every group and set of features, and save them. """
+    features = list(dict.fromkeys(features))
+    frame = model_frame(load_dataset.load_dataset("year_country", processed_dir=input_dir),
+                        load_dataset.load_dataset("meta", processed_dir=input_dir), IndicatorStore(store_dir),
+                        features)
+    bundle = train_models(frame, features, list(dict.fromkeys(group_by)), all_feature_sets(features, max_set_size),
+                          penalty, n_folds, seed, jobs)
+    save_bundle(bundle, output)
+    logger.info(f"saved {bundle.coefficients.shape[0]} x {bundle.coefficients.shape[1]} models to {output}")
+    click.echo(summary(bundle).to_string(index=False, float_format=lambda x: f"{x:.3g}"))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    main()
@@ -0,0 +1,137 @@
+"""
+Client of the query service in server.py, standing in for a dashboard. It keeps one connection open for all its
+requests, and remembers the responses it got together with their ETag: asking for the same data again only costs a
+revalidation (a 304 Not Modified without a body) as long as the data on the server did not change.
+
+Only uses the standard library, so that it is cheap to import (e.g. in the processes of the load test).
+
+    with QueryClient() as client:
+        client.series("France", by="sex", **{"from": 1990})
+"""
+import http.client
+import json
+from urllib.parse import quote, urlencode
+
+DEFAULT_HOST = "127.0.0.1"  # also the defaults of the server
+DEFAULT_PORT = 8050
+
+
+def request_target(path, params):
+    """
+    :param path: string, path of an endpoint, e.g. /countries/France
+    :param params: dictionary, parameters of the query string, None values are left out
+    :return: string, the path and query string to request
+    """
+    params = {name: value for name, value in params.items() if value is not None}
+    return quote(path) + (f"?{urlencode(params)}" if params else "")
+
+
+class QueryError(Exception):
+    """ The service answered with an error """
+
+    def __init__(self, status, message):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+
+
+class QueryClient:
+    """
+    Client of the query service, for use from a single thread
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=10., revalidate=True):
+        """
+        :param host: string, host of the service
+        :param port: int, port of the service
+        :param timeout: float, seconds to wait for a response
+        :param revalidate: bool, remember responses and revalidate them with their ETag instead of getting them again
+        """
+        self.connection = http.client.HTTPConnection(host, port, timeout=timeout)
+        self.revalidate = revalidate
+        self.not_modified = 0  # number of responses that were revalidated
+        self._responses = {}
+
+    def get(self, path, **params):
+        """
+        :param path: string, path of an endpoint, e.g. /countries/France
+        :param params: parameters of the query string, None values are left out
+        :return: the decoded json response
+        """
+        status, body = self.request(request_target(path, params))
+        if status >= 400:
+            raise QueryError(status, json.loads(body.decode("utf-8")).get("error"))
+        return json.loads(body.decode("utf-8"))
+
+    def request(self, target):
+        """
+        Send a request, revalidating the remembered response if there is one
+        :param target: string, path and query string
+        :return: (int, bytes), status and body of the response (the remembered body for a 304)
+        """
+        headers = {}
+        remembered = self._responses.get(target)
+        if remembered is not None:
+            headers["If-None-Match"] = remembered[0]
+        try:
+            self.connection.request("GET", target, headers=headers)
+            response = self.connection.getresponse()
+        except (ConnectionError, http.client.HTTPException):
+            self.connection.close()  # the server closed the connection, e.g. after a restart. Try once more
+            self.connection.request("GET", target, headers=headers)
+            response = self.connection.getresponse()
+        body = response.read()
+        if response.status == 304:
+            self.not_modified += 1
+            return 200, remembered[1]
+        etag = response.getheader("ETag")
+        if self.revalidate and response.status == 200 and etag is not None:
+            self._responses[target] = (etag, body)
+        return response.status, body
+
+    def health(self):
+        return self.get("/health")
+
+    def countries(self):
+        """
+        :return: dictionary with lists country, code, suicides_no, population, rate and years
+        """
+        return self.get("/countries")["data"]
+
+    def series(self, country, by=None, sex=None, age=None, **years):
+        """
+        :param country: string, name or alpha-3 code
+        :param by: string, "sex", "age" or "sex,age" to split by these too
+        :param sex: string, only this sex
+        :param age: string, only this age group
+        :param years: from and/or to, only these years (both included)
+        :return: dictionary with the columns of the time series
+        """
+        return self.get(f"/countries/{country}", by=by, sex=sex, age=age, **years)["data"]
+
+    def cross_section(self, year, sex=None, age=None, min_years=None):
+        """
+        :param year: int
+        :param sex: string, only this sex
+        :param age: string, only this age group
+        :param min_years: int, only countries with at least this many years of data
+        :return: dictionary with the columns of the cross-section, one row per country
+        """
+        return self.get(f"/years/{year}", sex=sex, age=age, min_years=min_years)["data"]
+
+    def breakdown(self, country=None, year=None, **years):
+        """
+        :param country: string, name or alpha-3 code, None for all countries
+        :param year: int, None for all years
+        :param years: from and/or to, only these years (both included)
+        :return: dictionary with the columns of the breakdown, one row per sex and age group
+        """
+        return self.get("/breakdown", country=country, year=year, **years)["data"]
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
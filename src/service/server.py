@@ -0,0 +1,392 @@
+"""
+A small read-only HTTP/JSON service over the processed data, for dashboards that would otherwise each load the
+processed csv files themselves. The data is held in memory as an aggregate cube (see src/features/aggregate_cube.py),
+so every request is a few numpy indexing operations. Encoded responses are kept in an LRU cache, with an ETag so that
+clients can revalidate them (If-None-Match) without the body being sent again.
+
+Endpoints, all GET and all answering with json. Every data endpoint returns its data column-wise, as lists of equal
+length under "data", with the suicides, population and suicides per 100,000 (rate) summed over everything not in by:
+
+    /health                                  data version and cache statistics
+    /countries                               countries with their alpha-3 code and number of years with data
+    /countries/<name or code>                time series of a country, by year
+        ?by=sex,age                              also split by sex and/or age group
+        ?sex=female&age=15-24 years              only this sex and/or age group
+        ?from=1990&to=2010                       only these years (both included)
+    /years/<year>                            cross-section of all countries in a year, by country
+        ?sex=..&age=..                           only this sex and/or age group
+        ?min_years=20                            only countries with at least this many years of data
+    /breakdown                               numbers by sex and age group
+        ?country=<name or code>&year=2000        of one country and/or year, the whole world in all years otherwise
+        ?from=..&to=..                           only these years
+
+The service watches the processed files, and when they changed (and stayed the same for one polling interval, so that
+we don't read half-written files) it builds a new cube and swaps it in at once. Requests are served from the old data
+until then, the response cache is replaced together with the data.
+
+    python src/service/server.py --port 8050
+"""
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+import click
+import numpy as np
+
+from src.data import load_dataset
+from src.features.aggregate_cube import CUBE_FILE, load_cube
+from src.service.client import DEFAULT_HOST, DEFAULT_PORT
+
+CACHE_SIZE = 4096
+RELOAD_INTERVAL = 2.  # seconds between checks of the processed files
+WATCHED_DATASETS = ("enriched", "choropleth")  # the cube is built from these
+
+# an encoded response: http status, json body as bytes and its ETag (None for errors)
+Response = namedtuple("Response", ["status", "body", "etag"])
+# the data we serve from: aggregate cube, version of the processed files it was built from, the cache of responses,
+# a dictionary from lower-cased country names and codes to the country name, a dictionary from country name to code
+# and a dictionary from dimension to the set of its labels
+Snapshot = namedtuple("Snapshot", ["cube", "version", "cache", "countries", "codes", "labels"])
+
+logger = logging.getLogger(__name__)
+
+
+class QueryError(Exception):
+    """ A request we can't answer, with the http status to answer it with """
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class LRUCache:
+    """
+    Least recently used cache of responses, safe to use from several threads
+    """
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        """
+        :param maxsize: int, maximum number of responses to keep
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        :return: the cached value of key, or None
+        """
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            if len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def __len__(self):
+        return len(self._items)
+
+
+def _json_column(values):
+    """
+    :param values: numpy array
+    :return: list, with None instead of nan (json has no nan)
+    """
+    if values.dtype.kind == "f":
+        return np.where(np.isnan(values), None, values).tolist()
+    return values.tolist()
+
+
+def _int_parameter(params, name):
+    value = params.get(name)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise QueryError(HTTPStatus.BAD_REQUEST, f"{name} should be an integer, not {value}")
+
+
+class QueryService:
+    """
+    Answers queries on the processed data, independent of http so that it can be used (and tested) without a server
+    """
+
+    def __init__(self, processed_dir=load_dataset.PROCESSED_DIR, cube_file=CUBE_FILE, cache_size=CACHE_SIZE):
+        """
+        :param processed_dir: directory with the processed data, output of make_dataset.py
+        :param cube_file: path of the aggregate cube of the processed data, it is (re)built when needed
+        :param cache_size: int, maximum number of responses to cache
+        """
+        self.processed_dir = processed_dir
+        self.cube_file = cube_file
+        self.cache_size = cache_size
+        self.reloads = 0
+        self._snapshot = None
+        self._reload_lock = threading.Lock()
+        self._pending_version = None
+        self.reload()
+
+    @property
+    def snapshot(self):
+        return self._snapshot
+
+    def data_version(self):
+        """
+        :return: string, changes whenever one of the processed files the cube is built from changes (of the layout
+            load_dataset reads, see load_dataset.dataset_source)
+        """
+        sha = hashlib.sha256()
+        for name in WATCHED_DATASETS:
+            path = load_dataset.dataset_source(name, self.processed_dir)
+            if path is not None:
+                stat = path.stat()
+                sha.update(f"{name}:{path.name}:{stat.st_mtime_ns}:{stat.st_size};".encode("utf-8"))
+        return sha.hexdigest()[:16]
+
+    def reload(self, version=None):
+        """
+        Build the cube of the current processed data and serve from it, requests keep being served from the previous
+        data until the new data is complete
+        :param version: string, data version of the processed files, None to determine it here
+        """
+        with self._reload_lock:
+            version = self.data_version() if version is None else version
+            cube = load_cube(self.cube_file, rebuild=self._snapshot is not None, processed_dir=self.processed_dir)
+            codes = dict(zip(cube.axes["country"], cube.codes))
+            countries = {country.lower(): country for country in codes}
+            for country, code in codes.items():
+                if code:
+                    countries.setdefault(code.lower(), country)
+            labels = {dim: set(axis.tolist()) for dim, axis in cube.axes.items()}
+            self._snapshot = Snapshot(cube, version, LRUCache(self.cache_size), countries, codes, labels)
+            self.reloads += 1
+            logger.info(f"serving data version {version}")
+
+    def check_for_changes(self):
+        """
+        Reload if the processed files changed, and did not change anymore since the previous check
+        :return: bool, whether the data was reloaded
+        """
+        version = self.data_version()
+        if version == self._snapshot.version:
+            self._pending_version = None
+            return False
+        if version != self._pending_version:
+            self._pending_version = version  # still being written, maybe. Wait for the next check
+            return False
+        try:
+            self.reload(version)
+        except Exception:
+            logger.exception("could not reload the processed data, still serving the previous version")
+            return False
+        return True
+
+    def watch(self, interval=RELOAD_INTERVAL):
+        """
+        Check for changes of the processed files every interval seconds, in a daemon thread
+        :return: threading.Event, set it to stop watching
+        """
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                self.check_for_changes()
+
+        threading.Thread(target=run, name="reload", daemon=True).start()
+        return stop
+
+    def get(self, target, if_none_match=None):
+        """
+        :param target: string, the path and query string of the request, e.g. /countries/France?by=sex
+        :param if_none_match: string, value of the If-None-Match header of the request, or None
+        :return: Response
+        """
+        snapshot = self._snapshot
+        if target == "/health":  # changes with every request, never cached
+            body = json.dumps({"version": snapshot.version, "reloads": self.reloads, "cached": len(snapshot.cache),
+                               "hits": snapshot.cache.hits, "misses": snapshot.cache.misses}).encode("utf-8")
+            return Response(HTTPStatus.OK, body, None)
+        response = snapshot.cache.get(target)
+        if response is None:
+            try:
+                body = json.dumps(self.query(snapshot, target), separators=(",", ":")).encode("utf-8")
+            except QueryError as error:
+                body = json.dumps({"error": str(error)}).encode("utf-8")
+                return Response(error.status, body, None)
+            etag = f'"{hashlib.sha1(body).hexdigest()[:20]}"'
+            response = Response(HTTPStatus.OK, body, etag)
+            snapshot.cache.put(target, response)
+        if if_none_match is not None and response.etag in if_none_match:
+            return Response(HTTPStatus.NOT_MODIFIED, b"", response.etag)
+        return response
+
+    def query(self, snapshot, target):
+        """
+        :param snapshot: Snapshot to answer the query from
+        :param target: string, the path and query string of the request
+        :return: dictionary, to be encoded as json
+        """
+        url = urlsplit(target)
+        parts = [unquote(part) for part in url.path.strip("/").split("/")]
+        params = dict(parse_qsl(url.query))
+        if parts == ["countries"]:
+            response = self._rows(snapshot, ("country",), {}, None)
+            response["data"]["years"] = _json_column(snapshot.cube.coverage().values)
+            return response
+        if len(parts) == 2 and parts[0] == "countries":
+            country = self._country(snapshot, parts[1])
+            by = ("year",) + self._by(params, allowed=("sex", "age"))
+            selection = self._selection(snapshot, params, ["year", "sex", "age"])
+            selection["country"] = country
+            response = self._rows(snapshot, by, selection, None)
+            response.update(country=country, code=snapshot.codes[country])
+            return response
+        if len(parts) == 2 and parts[0] == "years":
+            year = _int_parameter({"year": parts[1]}, "year")
+            if year not in snapshot.labels["year"]:
+                raise QueryError(HTTPStatus.NOT_FOUND, f"no data for year {year}")
+            selection = self._selection(snapshot, params, ["sex", "age"])
+            selection["year"] = year
+            response = self._rows(snapshot, ("country",), selection, _int_parameter(params, "min_years"))
+            response.update(year=year)
+            return response
+        if parts == ["breakdown"]:
+            selection = self._selection(snapshot, params, ["year"])
+            if "country" in params:
+                selection["country"] = self._country(snapshot, params["country"])
+            return self._rows(snapshot, ("sex", "age"), selection, None)
+        raise QueryError(HTTPStatus.NOT_FOUND, f"unknown path {url.path}, see the docstring of {__name__}")
+
+    @staticmethod
+    def _country(snapshot, name):
+        country = snapshot.countries.get(name.lower())
+        if country is None:
+            raise QueryError(HTTPStatus.NOT_FOUND, f"unknown country {name}")
+        return country
+
+    @staticmethod
+    def _by(params, allowed):
+        by = tuple(dim for dim in params.get("by", "").split(",") if dim)
+        unknown = set(by) - set(allowed)
+        if unknown:
+            raise QueryError(HTTPStatus.BAD_REQUEST, f"can't split by {sorted(unknown)}, only by {list(allowed)}")
+        return by
+
+    @staticmethod
+    def _selection(snapshot, params, dims):
+        """
+        :return: dictionary, dimension -> selector (see AggregateCube.query) for the parameters of the request
+        """
+        selection = {}
+        for dim in dims:
+            if dim == "year":
+                year = _int_parameter(params, "year")
+                if year is not None:
+                    selection["year"] = year
+                    continue
+                start, stop = _int_parameter(params, "from"), _int_parameter(params, "to")
+                if start is not None or stop is not None:
+                    selection["year"] = slice(start, stop)
+            elif dim in params:
+                selection[dim] = params[dim]
+        for dim, label in selection.items():
+            if not isinstance(label, slice) and label not in snapshot.labels[dim]:
+                raise QueryError(HTTPStatus.NOT_FOUND, f"no data for {dim} {label}")
+        return selection
+
+    def _rows(self, snapshot, by, selection, min_years):
+        """
+        :return: dictionary with by and the columns of the rolled up data
+        """
+        labels, sums = snapshot.cube.query(by, min_years, **selection)
+        population = np.where(sums["population"] > 0, sums["population"], np.nan)
+        data = {dim: _json_column(values) for dim, values in labels.items()}
+        data.update({value: _json_column(sums[value]) for value in ["suicides_no", "population"]})
+        data["rate"] = _json_column(np.round(sums["suicides_no"] / population * 100000, 2))
+        return {"by": list(by), "data": data}
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """
+    Http front end of a QueryService. Keeps connections open (http/1.1), so that a client can send many requests over
+    one connection
+    """
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, without this the body waits for the ack of the headers (40ms)
+    disable_nagle_algorithm = True
+    service = None  # set by make_server
+
+    def do_GET(self):
+        response = self.service.get(self.path, self.headers.get("If-None-Match"))
+        self.send_response(response.status)
+        self.send_header("Content-Type", "application/json")
+        if response.etag is not None:
+            self.send_header("ETag", response.etag)
+            self.send_header("Cache-Control", "no-cache")  # clients may keep responses, but have to revalidate them
+        if response.status != HTTPStatus.NOT_MODIFIED:
+            self.send_header("Content-Length", str(len(response.body)))
+        self.end_headers()
+        self.wfile.write(response.body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def make_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """
+    :param service: QueryService
+    :param host: string, address to listen on
+    :param port: int, port to listen on, 0 for any free port
+    :return: ThreadingHTTPServer, call serve_forever to start serving
+    """
+    handler = type("BoundQueryHandler", (QueryHandler,), {"service": service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+@click.command()
+@click.option("--host", default=DEFAULT_HOST, show_default=True)
+@click.option("--port", type=int, default=DEFAULT_PORT, show_default=True)
+@click.option("--processed-dir", type=click.Path(exists=True, file_okay=False), default=load_dataset.PROCESSED_DIR,
+              show_default=True, help="Directory with the output of make_dataset.py.")
+@click.option("--cube-file", type=click.Path(dir_okay=False), default=CUBE_FILE, show_default=True)
+@click.option("--cache-size", type=int, default=CACHE_SIZE, show_default=True,
+              help="Maximum number of responses to cache.")
+@click.option("--reload-interval", type=float, default=RELOAD_INTERVAL, show_default=True,
+              help="Seconds between checks for changed processed files, 0 to never reload.")
+def main(host, port, processed_dir, cube_file, cache_size, reload_interval):
+    """ Serve the processed data as json over http. """
+    service = QueryService(processed_dir, cube_file, cache_size)
+    if reload_interval > 0:
+        service.watch(reload_interval)
+    server = make_server(service, host, port)
+    logger.info(f"serving on http://{host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    main()
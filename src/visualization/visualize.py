@@ -0,0 +1,535 @@
+"""
+Animated choropleth world maps of suicide rates per year, built from the year-country data. The data of every
+animation frame is computed once for all metrics (male, female and overall rate, and the male/female ratio) and kept
+in a compact form: one rounded float32 array of shape (years, countries) per metric, with the countries (their ISO-3
+codes and names) stored once. These frames are cached on disk by a hash of the input data, so switching between
+metrics only assembles a figure from arrays that are already there.
+
+Figures only carry the country codes and names in their base trace, every animation frame only holds the values that
+change from year to year. Together with loading plotly.js from a CDN this keeps exported html files small.
+
+    frames = load_frames()
+    frames.show("male")
+    frames.to_html("overall", "reports/figures/overall_rate.html")
+
+The static figures of the report (worldwide trend, countries with the highest and lowest rates, rates by age group
+overall and for every country) are declared by figure_set and rendered with matplotlib by render_figures, on a process
+pool. A manifest next to the figures holds a key of every figure, a hash of its data, title, style and plotting code,
+and figures whose key did not change are not rendered again.
+
+    python src/visualization/visualize.py --jobs 4
+"""
+import hashlib
+import json
+import logging
+import re
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import click
+import numpy as np
+import pandas as pd
+
+from src.data import load_dataset
+from src.data.stage_cache import hash_code
+from src.features.aggregate_cube import age_order
+
+FRAME_CACHE_DIR = "./data/interim/choropleth_frames"
+FRAME_VERSION = "1"  # bump when the way frames are computed changes, this invalidates the cache
+DECIMALS = 2
+
+# a map we can draw: title, column with the values, column shown when hovering, color scale and the minimum population
+# of a country to be shown (the ratio is very noisy for small countries)
+Metric = namedtuple("Metric", ["title", "column", "hover_column", "color_scale", "min_population"])
+
+METRICS = {
+    "male": Metric("Male suicides per 100,000", "male_rate", "male_pop", "Reds", 0),
+    "female": Metric("Female suicides per 100,000", "female_rate", "female_pop", "Reds", 0),
+    "overall": Metric("Suicides per 100,000", "overall_rate", "population", "Reds", 0),
+    "ratio": Metric("Ratio of male to female suicide rate", "ratio_male_female", "population", "Picnic", 10 ** 6),
+}
+
+FIGURE_DIR = "./reports/figures"
+FIGURE_MANIFEST = "manifest.json"
+RECENT_YEARS_FROM = 2010
+# style of the static figures, part of the key of every figure: changing it renders all figures again
+STYLE = {
+    "dpi": 150,
+    "wide_size": [20, 6],
+    "line_size": [25, 8],
+    "bar_size": [15, 7],
+    "title_size": 25,
+    "label_size": 20,
+    "legend_size": 18,
+    "line_width": 3,
+    "colors": {"female": "#dd8452", "male": "#4c72b0"},
+}
+
+# a static figure: file name (relative to the figure directory), function plot(data, title, style) returning a
+# matplotlib figure, the (small, aggregated) data it shows and its title
+Figure = namedtuple("Figure", ["name", "plot", "data", "title"])
+
+logger = logging.getLogger(__name__)
+
+
+def data_hash(data_frame):
+    """
+    :param data_frame: pd dataframe
+    :return: string, hex digest of a hash of the contents (and column names) of the dataframe
+    """
+    sha = hashlib.sha256(FRAME_VERSION.encode("utf-8"))
+    sha.update(",".join(map(str, data_frame.columns)).encode("utf-8"))
+    sha.update(pd.util.hash_pandas_object(data_frame, index=False).values.tobytes())
+    return sha.hexdigest()
+
+
+class ChoroplethFrames:
+    """
+    Per-year values of every metric, for a fixed set of countries
+    """
+
+    def __init__(self, years, codes, countries, values, hover):
+        """
+        :param years: numpy array of ints, the years (one animation frame each)
+        :param codes: numpy array of strings, ISO-3 codes of the countries
+        :param countries: numpy array of strings, names of the countries
+        :param values: dictionary, metric -> float32 numpy array of shape (years, countries), nan where there is no data
+        :param hover: dictionary, metric -> float32 numpy array of shape (years, countries), shown when hovering
+        """
+        self.years = years
+        self.codes = codes
+        self.countries = countries
+        self.values = values
+        self.hover = hover
+
+    @classmethod
+    def build(cls, year_country_df):
+        """
+        :param year_country_df: pd dataframe, the year-country data (see reshape.year_country_frame)
+        :return: ChoroplethFrames
+        """
+        df = year_country_df[year_country_df["code"].fillna("").astype(str) != ""].copy()
+        female_rate = df["female_rate"].where(df["female_rate"] != 0)
+        df["ratio_male_female"] = df["male_rate"] / female_rate
+
+        # countries that share a code (if any) are drawn as the first one
+        df = df.drop_duplicates(["year", "code"])
+        year_index, years = pd.factorize(df["year"].astype(int), sort=True)
+        code_index, codes = pd.factorize(df["code"].astype(str), sort=True)
+        countries = df.drop_duplicates("code").set_index("code")["country"].astype(str).reindex(codes)
+
+        values, hover = {}, {}
+        for name, metric in METRICS.items():
+            shown = df[metric.column].where(df["population"].fillna(0) >= metric.min_population)
+            for store, column in [(values, shown), (hover, df[metric.hover_column])]:
+                grid = np.full((len(years), len(codes)), np.nan, dtype=np.float32)
+                grid[year_index, code_index] = np.round(column.values.astype(np.float64), DECIMALS)
+                store[name] = grid
+        return cls(np.asarray(years), np.asarray(codes, dtype=str), countries.values.astype(str), values, hover)
+
+    def save(self, path):
+        """
+        :param path: path of the npz file to write
+        """
+        arrays = {"years": self.years, "codes": self.codes, "countries": self.countries}
+        for name in METRICS:
+            arrays[f"values__{name}"] = self.values[name]
+            arrays[f"hover__{name}"] = self.hover[name]
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = Path(path).with_name(Path(path).name + ".tmp.npz")
+        np.savez_compressed(tmp_path, **arrays)
+        tmp_path.replace(path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        :param path: path of an npz file written by save
+        :return: ChoroplethFrames
+        """
+        with np.load(path) as arrays:
+            return cls(arrays["years"], arrays["codes"], arrays["countries"],
+                       {name: arrays[f"values__{name}"] for name in METRICS},
+                       {name: arrays[f"hover__{name}"] for name in METRICS})
+
+    def _frame_arrays(self, metric, year_position):
+        """
+        Values as float64 lists, rounded again: float32 values would show up in the json as 12.300000190734863
+        """
+        z = np.round(self.values[metric][year_position].astype(np.float64), DECIMALS)
+        customdata = np.round(self.hover[metric][year_position].astype(np.float64), DECIMALS)
+        return z, customdata[:, None]
+
+    def figure_dict(self, metric="overall"):
+        """
+        Assemble an animated choropleth figure, with one frame per year, as a plain dictionary. Building a plotly
+        Figure object validates every frame, which takes seconds, plotly.io can show and export the dictionary as is.
+        :param metric: string, one of METRICS
+        :return: dictionary with data, layout and frames
+        """
+        spec = METRICS[metric]
+        finite = self.values[metric][np.isfinite(self.values[metric])]
+        zmin, zmax = (round(float(finite.min()), DECIMALS), round(float(finite.max()), DECIMALS)) if len(finite) \
+            else (0., 1.)
+        hovertemplate = (f"<b>%{{text}}</b><br>{spec.title}: %{{z}}<br>{spec.hover_column}: %{{customdata[0]:,.0f}}"
+                         "<extra></extra>")
+
+        z, customdata = self._frame_arrays(metric, 0)
+        base = {"type": "choropleth", "locations": self.codes, "text": self.countries, "z": z,
+                "customdata": customdata, "zmin": zmin, "zmax": zmax, "colorscale": spec.color_scale,
+                "colorbar": {"title": {"text": metric}}, "hovertemplate": hovertemplate}
+        frames = []
+        for position, year in enumerate(self.years):
+            z, customdata = self._frame_arrays(metric, position)
+            frames.append({"name": str(year), "data": [{"type": "choropleth", "z": z, "customdata": customdata}]})
+
+        steps = [{"label": str(year), "method": "animate",
+                  "args": [[str(year)], {"mode": "immediate", "frame": {"duration": 0, "redraw": True}}]}
+                 for year in self.years]
+        buttons = [
+            {"label": "&#9654;", "method": "animate",
+             "args": [None, {"frame": {"duration": 500, "redraw": True}, "fromcurrent": True}]},
+            {"label": "&#9724;", "method": "animate",
+             "args": [[None], {"mode": "immediate", "frame": {"duration": 0, "redraw": True}}]},
+        ]
+        layout = {
+            "title": {"text": spec.title},
+            "geo": {"showframe": False, "projection": {"type": "natural earth"}},
+            "sliders": [{"steps": steps, "currentvalue": {"prefix": "year: "}, "x": 0.1, "len": 0.9}],
+            "updatemenus": [{"type": "buttons", "buttons": buttons, "direction": "left", "x": 0.1, "xanchor": "right",
+                             "y": 0, "yanchor": "top", "showactive": False}],
+        }
+        return {"data": [base], "layout": layout, "frames": frames}
+
+    def figure(self, metric="overall"):
+        """
+        :param metric: string, one of METRICS
+        :return: plotly.graph_objects.Figure, see figure_dict. Use show or to_html if you don't need to change it
+        """
+        import plotly.graph_objects as go
+
+        return go.Figure(self.figure_dict(metric))
+
+    def show(self, metric="overall"):
+        """
+        Show the figure of a metric, e.g. in a notebook
+        :param metric: string, one of METRICS
+        """
+        import plotly.io
+
+        plotly.io.show(self.figure_dict(metric), validate=False)
+
+    def to_html(self, metric, path=None, include_plotlyjs="cdn"):
+        """
+        :param metric: string, one of METRICS
+        :param path: path of the html file to write, None to only return the html
+        :param include_plotlyjs: "cdn" to load plotly.js from the internet, True to put it in the file (3MB more)
+        :return: string, the html
+        """
+        import plotly.io
+
+        html = plotly.io.to_html(self.figure_dict(metric), include_plotlyjs=include_plotlyjs, full_html=True,
+                                 validate=False)
+        if path is not None:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            Path(path).write_text(html, encoding="utf-8")
+        return html
+
+
+def load_frames(year_country_df=None, cache_dir=FRAME_CACHE_DIR):
+    """
+    Get the choropleth frames of the year-country data, from the cache if they were built for the same data before
+    :param year_country_df: pd dataframe, the year-country data. None to load the processed year-country data
+    :param cache_dir: directory with cached frames, None to not use a cache
+    :return: ChoroplethFrames
+    """
+    if year_country_df is None:
+        year_country_df = load_dataset.load_dataset("year_country")
+    if cache_dir is None:
+        return ChoroplethFrames.build(year_country_df)
+
+    path = Path(cache_dir) / f"frames-{data_hash(year_country_df)[:20]}.npz"
+    if path.is_file():
+        return ChoroplethFrames.load(path)
+    logger.info(f"building choropleth frames {path}")
+    frames = ChoroplethFrames.build(year_country_df)
+    frames.save(path)
+    return frames
+
+
+def pooled_rates(data_frame, by):
+    """
+    :param data_frame: pd dataframe with suicides_no and population columns
+    :param by: list of columns
+    :return: pd dataframe, the suicides and population summed per group, and the rate per 100,000 of the sums
+    """
+    known = data_frame[data_frame["suicides_no"].notnull() & (data_frame["population"] > 0)]
+    pooled = known.groupby(by, observed=True)[["suicides_no", "population"]].sum().reset_index()
+    return pooled.assign(rate=pooled["suicides_no"] / pooled["population"] * 100000)
+
+
+def extreme_countries(year_country_df, highest=True, n=5, min_population=10 ** 6, min_years=20):
+    """
+    The countries with the highest (or lowest) overall rate in any year, and their rate in every year. The lowest rates
+    are only taken from countries with a large enough population and enough years of data, zeros are left out
+    :param year_country_df: pd dataframe, the year-country data
+    :param highest: bool, the highest rates, or the lowest
+    :param n: int, number of countries
+    :param min_population: int, lowest population of a country-year to consider for the lowest rates
+    :param min_years: int, fewest years of data of a country to consider for the lowest rates
+    :return: pd dataframe with columns year, country and rate (nan where it is 0, probably missing data)
+    """
+    df = year_country_df[["year", "country", "overall_rate", "suicides_no", "population"]].rename(
+        columns={"overall_rate": "rate"}).dropna(subset=["rate"])
+    df = df.assign(country=df["country"].astype(str))
+    candidates = df
+    if not highest:
+        years = df.groupby("country")["year"].count()
+        candidates = df[(df["suicides_no"] > 0) & (df["population"] > min_population)
+                        & df["country"].isin(years[years >= min_years].index)]
+    countries = candidates.sort_values("rate", ascending=not highest, kind="mergesort").drop_duplicates(
+        "country")["country"].iloc[:n]
+    selected = df[df["country"].isin(countries)].sort_values(["country", "year"]).reset_index(drop=True)
+    return selected.assign(rate=selected["rate"].where(selected["rate"] != 0))[["year", "country", "rate"]]
+
+
+def age_rates(enriched_df):
+    """
+    :param enriched_df: pd dataframe, the enriched data (rows of a country, year, sex and age group)
+    :return: pd dataframe, the mean rate per 100,000 of the rows of every age group and sex
+    """
+    df = enriched_df[enriched_df["population"] > 0]
+    rows = pd.DataFrame({"age": df["age"].astype(str).values, "sex": df["sex"].astype(str).values,
+                         "rate": (df["suicides_no"] / df["population"] * 100000).values})
+    return rows.groupby(["age", "sex"])["rate"].mean().reset_index()
+
+
+def file_slug(text):
+    """
+    :param text: string, e.g. a country name
+    :return: string, lowercase with every run of other characters than letters and digits replaced by _
+    """
+    return re.sub(r"[^a-z0-9]+", "_", text.lower()).strip("_")
+
+
+def _decorate(ax, title, xlabel, ylabel, style, legend_loc=None):
+    ax.set_title(title, fontsize=style["title_size"])
+    ax.set_xlabel(xlabel, fontsize=style["label_size"])
+    ax.set_ylabel(ylabel, fontsize=style["label_size"])
+    ax.tick_params(labelsize=style["label_size"])
+    if legend_loc is not None and ax.get_legend_handles_labels()[0]:
+        ax.legend(loc=legend_loc, prop={"size": style["legend_size"]})
+
+
+def plot_trend(data, title, style):
+    """
+    :param data: pd dataframe with columns year and rate
+    """
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=style["wide_size"])
+    ax.plot(data["year"], data["rate"], color="k", marker="o", lw=style["line_width"])
+    _decorate(ax, title, "year", "suicides per 100,000", style)
+    return fig
+
+
+def plot_country_lines(data, title, style):
+    """
+    :param data: pd dataframe with columns year, country and rate, see extreme_countries
+    """
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=style["line_size"])
+    for country, rows in data.groupby("country", sort=False):
+        ax.plot(rows["year"], rows["rate"], lw=style["line_width"], label=country)
+    _decorate(ax, title, "year", "suicides per 100,000", style, legend_loc="best")
+    return fig
+
+
+def plot_top_bars(data, title, style):
+    """
+    :param data: pd dataframe with columns period, country and rate, a panel of horizontal bars for every period
+    """
+    import matplotlib.pyplot as plt
+
+    periods = list(pd.unique(data["period"]))
+    fig, axs = plt.subplots(1, len(periods), figsize=style["bar_size"], squeeze=False)
+    for ax, period, colors in zip(axs[0], periods, ["Greens_r", "Reds_r"] * len(periods)):
+        rows = data[data["period"] == period]
+        ax.barh(np.arange(len(rows)), rows["rate"], color=plt.get_cmap(colors)(np.linspace(0.1, 0.6, len(rows))))
+        ax.set_yticks(np.arange(len(rows)))
+        ax.set_yticklabels(rows["country"])
+        ax.invert_yaxis()
+        _decorate(ax, f"{title}, {period}", "suicides per 100,000", "", style)
+    fig.tight_layout()
+    return fig
+
+
+def plot_age_bars(data, title, style):
+    """
+    :param data: pd dataframe with columns age, sex and rate, see age_rates
+    """
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=style["wide_size"])
+    ages = age_order(data["age"].astype(str).unique())
+    sexes = sorted(data["sex"].unique())
+    width = 0.8 / max(len(sexes), 1)
+    for i, sex in enumerate(sexes):
+        rates = data[data["sex"] == sex].assign(age=lambda df: df["age"].astype(str)).set_index("age")["rate"]
+        ax.bar(np.arange(len(ages)) + (i - (len(sexes) - 1) / 2) * width, rates.reindex(ages).values, width, label=sex,
+               color=style["colors"].get(sex))
+    ax.set_xticks(np.arange(len(ages)))
+    ax.set_xticklabels(ages)
+    _decorate(ax, title, "age range", "suicides per 100,000", style, legend_loc="upper left")
+    return fig
+
+
+def figure_set(enriched_df, year_country_df, countries=None):
+    """
+    Declare the static figures of the report
+    :param enriched_df: pd dataframe, the enriched data
+    :param year_country_df: pd dataframe, the year-country data
+    :param countries: list of countries to make an age group figure of, None for all of them
+    :return: list of Figure
+    """
+    first, last = int(year_country_df["year"].min()), int(year_country_df["year"].max())
+    by_country = pooled_rates(year_country_df, ["country"])
+    recent = pooled_rates(year_country_df[year_country_df["year"] >= RECENT_YEARS_FROM], ["country"])
+    top = pd.concat([rates.nlargest(5, "rate").assign(period=period)[["period", "country", "rate"]]
+                     for rates, period in [(by_country, f"{first}-{last}"), (recent, f"{RECENT_YEARS_FROM}-{last}")]],
+                    ignore_index=True)
+    figures = [
+        Figure("worldwide.png", plot_trend, pooled_rates(year_country_df, ["year"])[["year", "rate"]],
+               "Worldwide suicide rates"),
+        Figure("top_5_highest.png", plot_country_lines, extreme_countries(year_country_df),
+               f"Countries with highest overall suicide rates from {first}-{last}"),
+        Figure("top_5_lowest.png", plot_country_lines, extreme_countries(year_country_df, highest=False),
+               f"Countries with lowest overall suicide rates from {first}-{last}"),
+        Figure("highest_rates.png", plot_top_bars, top.assign(country=top["country"].astype(str)),
+               "Countries with highest rates"),
+        Figure("age_overall.png", plot_age_bars, age_rates(enriched_df),
+               "Suicide rates per 100,000 by age group across all countries"),
+    ]
+
+    names = enriched_df["country"].astype(str)
+    wanted = sorted(names.unique()) if countries is None else list(countries)
+    positions = pd.Series(np.arange(len(names))).groupby(names.values).indices
+    for country in wanted:
+        if country not in positions:
+            raise ValueError(f"no data of {country}")
+        figures.append(Figure(f"age/{file_slug(country)}.png", plot_age_bars,
+                              age_rates(enriched_df.iloc[positions[country]]),
+                              f"Suicide rates per 100,000 by age group in {country}"))
+    return figures
+
+
+def figure_key(figure, style, code_key=None):
+    """
+    :param figure: Figure
+    :param style: dictionary, see STYLE
+    :param code_key: string, hash_code of figure.plot, if already known
+    :return: string, hex digest of a hash of everything the rendered figure depends on: its data, title and style, and
+        the source of the modules its plot function depends on (so also of the helpers it calls, see
+        stage_cache.code_files)
+    """
+    code_key = hash_code(figure.plot) if code_key is None else code_key
+    sha = hashlib.sha256(data_hash(figure.data).encode("utf-8"))
+    for part in [figure.title, json.dumps(style, sort_keys=True), code_key]:
+        sha.update(part.encode("utf-8"))
+    return sha.hexdigest()
+
+
+def read_manifest(output_dir):
+    path = Path(output_dir) / FIGURE_MANIFEST
+    return json.loads(path.read_text(encoding="utf-8")) if path.is_file() else {}
+
+
+def write_manifest(output_dir, manifest):
+    path = Path(output_dir) / FIGURE_MANIFEST
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(json.dumps(manifest, indent=1, sort_keys=True), encoding="utf-8")
+    tmp_path.replace(path)
+
+
+def render_figure(figure, style, path):
+    """
+    Render a figure to a file with the non-interactive Agg backend, runs in a worker process
+    :param figure: Figure
+    :param style: dictionary, see STYLE
+    :param path: path of the png file to write
+    :return: string, name of the figure
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig = figure.plot(figure.data, figure.title, style)
+    tmp_path = Path(path).with_name(Path(path).stem + ".tmp.png")
+    try:
+        fig.savefig(tmp_path, dpi=style["dpi"], bbox_inches="tight")
+    finally:
+        plt.close(fig)
+    tmp_path.replace(path)
+    return figure.name
+
+
+def render_figures(figures, output_dir=FIGURE_DIR, style=None, jobs=1, force=False):
+    """
+    Render the figures that changed since they were last rendered to output_dir
+    :param figures: list of Figure, see figure_set
+    :param output_dir: directory to write the figures and the manifest to
+    :param style: dictionary, see STYLE. None for STYLE
+    :param jobs: int, number of processes to render on
+    :param force: bool, render every figure
+    :return: list of names of the figures that were rendered
+    """
+    style = STYLE if style is None else style
+    manifest = read_manifest(output_dir)
+    code_keys = {plot: hash_code(plot) for plot in {figure.plot for figure in figures}}
+    keys = {figure.name: figure_key(figure, style, code_keys[figure.plot]) for figure in figures}
+    stale = [figure for figure in figures if force or manifest.get(figure.name) != keys[figure.name]
+             or not (Path(output_dir) / figure.name).is_file()]
+    logger.info(f"rendering {len(stale)} of {len(figures)} figures")
+    for figure in stale:
+        (Path(output_dir) / figure.name).parent.mkdir(parents=True, exist_ok=True)
+
+    arguments = (stale, [style] * len(stale), [Path(output_dir) / figure.name for figure in stale])
+    rendered = []
+    executor = ProcessPoolExecutor(jobs) if jobs > 1 and len(stale) > 1 else None
+    try:
+        if executor is None:
+            names = map(render_figure, *arguments)
+        else:
+            names = executor.map(render_figure, *arguments, chunksize=max(len(stale) // (4 * jobs), 1))
+        for name in names:
+            manifest[name] = keys[name]
+            rendered.append(name)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if rendered:
+            write_manifest(output_dir, manifest)
+    return rendered
+
+
+@click.command()
+@click.option("--input-dir", type=click.Path(exists=True, file_okay=False), default=load_dataset.PROCESSED_DIR,
+              show_default=True, help="Directory with the enriched and year-country data.")
+@click.option("--output-dir", type=click.Path(file_okay=False), default=FIGURE_DIR, show_default=True)
+@click.option("--country", "countries", multiple=True,
+              help="Country to make an age group figure of, repeat for several. Default all countries.")
+@click.option("--jobs", type=click.IntRange(min=1), default=1, show_default=True)
+@click.option("--dpi", type=click.IntRange(min=1), default=STYLE["dpi"], show_default=True)
+@click.option("--force", is_flag=True, help="Render every figure, also the ones that did not change.")
+def main(input_dir, output_dir, countries, jobs, dpi, force):
+    """ Render the static figures of the report, skipping the ones that did not change since the last run. """
+    figures = figure_set(load_dataset.load_dataset("enriched", processed_dir=input_dir),
+                         load_dataset.load_dataset("year_country", processed_dir=input_dir), countries or None)
+    rendered = render_figures(figures, output_dir, dict(STYLE, dpi=dpi), jobs, force)
+    logger.info(f"rendered {len(rendered)} figures, {len(figures) - len(rendered)} were up to date")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    main()
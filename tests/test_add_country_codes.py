@@ -0,0 +1,36 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from src.data import add_country_codes
+
+
+def test_get_alpha3_codes_matches_single_lookup(tmp_path):
+    names = pd.Series(["France", "Macau", "Reunion", "France", "Iran (Islamic Rep of)"], index=[10, 11, 12, 13, 14])
+    lookup = add_country_codes.get_alpha3_codes(names, cache_file=tmp_path / "codes.json")
+
+    expected = [add_country_codes.get_alpha3_code(name) for name in names]
+    assert lookup.codes.tolist() == expected
+    assert lookup.codes.index.tolist() == names.index.tolist()
+    assert len(lookup.unresolved) == 0
+
+
+def test_get_alpha3_codes_caches_misses(tmp_path):
+    cache_file = tmp_path / "codes.json"
+    lookup = add_country_codes.get_alpha3_codes(np.array(["Atlantis", "France", "Atlantis"]), cache_file=cache_file)
+
+    assert isinstance(lookup.codes, np.ndarray)
+    assert lookup.codes.tolist() == ["", "FRA", ""]
+    assert lookup.unresolved.to_dict("records") == [{"country": "Atlantis", "rows": 2}]
+
+    with open(cache_file) as f:
+        cached = json.load(f)
+    assert cached["codes"] == {"Atlantis": ""}  # France is found in the in-memory index, no need to cache it
+
+    # a cache written by another pycountry version is ignored
+    cached["pycountry_version"] = "0.0"
+    cached["codes"]["Atlantis"] = "ATL"
+    with open(cache_file, "w") as f:
+        json.dump(cached, f)
+    assert add_country_codes.get_alpha3_codes(["Atlantis"], cache_file=cache_file).codes.tolist() == [""]
@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data import synthetic
+from src.features.aggregate_cube import AggregateCube
+
+
+@pytest.fixture
+def enriched_df():
+    data = synthetic.make_synthetic_data(n_countries=12, n_years=10)
+    return data.suicides, data.codes
+
+
+def test_rollup_matches_groupby(enriched_df, tmp_path):
+    df, codes = enriched_df
+    cube = AggregateCube.build(df, codes)
+    cube.save(tmp_path / "cube.npz")
+    cube = AggregateCube.load(tmp_path / "cube.npz")
+
+    valid = df.dropna(subset=["suicides_no", "population"])
+    selected = valid[(valid["year"] >= 2010) & (valid["year"] <= 2012) & (valid["sex"] == "male")]
+    expected = selected.groupby(["year", "country"])[["suicides_no", "population"]].sum().reset_index()
+    result = cube.rollup(["country", "year"], year=slice(2010, 2012), sex="male")
+    result = result[result["cells"] > 0].reset_index(drop=True)
+
+    pd.testing.assert_frame_equal(result[["year", "country", "suicides_no", "population"]], expected,
+                                  check_dtype=False)
+    assert (result["code"] == result["country"].map(codes)).all()
+    np.testing.assert_allclose(result["suicides per 100,000"],
+                               expected["suicides_no"] / expected["population"] * 100000)
+
+
+def test_coverage_filter(enriched_df):
+    df, codes = enriched_df
+    cube = AggregateCube.build(df, codes)
+    years = df.dropna(subset=["suicides_no", "population"]).groupby("country")["year"].nunique()
+    pd.testing.assert_series_equal(cube.coverage(), years.rename("years"), check_names=False, check_dtype=False)
+
+    min_years = int(years.median())
+    result = cube.rollup(["country"], min_years=min_years)
+    assert set(result["country"]) == set(years[years >= min_years].index)
+    assert list(cube.rollup(["age"])["age"][:2]) == ["5-14 years", "15-24 years"]
+
+    with pytest.raises(KeyError):
+        cube.rollup(["region"])
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data import synthetic
+from src.features import build_features
+
+
+@pytest.fixture
+def enriched_df():
+    df = synthetic.make_synthetic_data(n_countries=10, n_years=15).suicides
+    return df[~((df["country"] == df["country"].iloc[0]) & (df["year"] == 2008))]  # a gap in a series
+
+
+def test_trends_match_per_series_fits(enriched_df):
+    matrix = build_features.series_matrix(enriched_df, by=["country", "sex"])
+    features = build_features.trend_features(matrix)
+
+    valid = enriched_df.dropna(subset=["suicides_no", "population"])
+    yearly = valid.groupby(["country", "sex", "year"], observed=True)[["suicides_no", "population"]].sum()
+    yearly = yearly[yearly["population"] > 0].reset_index()
+    yearly["rate"] = yearly["suicides_no"] / yearly["population"] * 100000
+    assert len(features) == len(yearly.groupby(["country", "sex"]))
+    for row in features.itertuples():
+        series = yearly[(yearly["country"] == row.country) & (yearly["sex"] == row.sex)]
+        (slope, intercept), covariance = np.polyfit(series["year"] - 2009.0, series["rate"], 1, cov="unscaled")
+        residuals = ((series["rate"] - slope * (series["year"] - 2009.0) - intercept) ** 2).sum()
+        assert row.n_years == len(series) and row.first_year == series["year"].min()
+        assert row.slope == pytest.approx(slope) and row.intercept == pytest.approx(intercept)
+        assert row.slope_se == pytest.approx(np.sqrt(covariance[0, 0] * residuals / (len(series) - 2)))
+        assert row.overall_rate == pytest.approx(series["suicides_no"].sum() / series["population"].sum() * 100000)
+        recent = series[series["year"] > 2011]
+        assert row.recent_rate == pytest.approx(recent["suicides_no"].sum() / recent["population"].sum() * 100000)
+
+    yearly_features = build_features.yearly_features(matrix, window=3)
+    assert len(yearly_features) == len(yearly)
+    first = yearly_features[(yearly_features["country"] == features["country"][0])
+                            & (yearly_features["sex"] == features["sex"][0])].set_index("year")
+    full = first.reindex(range(2002, 2017))
+    rolling = full[["suicides_no", "population"]].rolling(3, min_periods=2).sum()
+    np.testing.assert_allclose(first["rolling_rate"],
+                               (rolling["suicides_no"] / rolling["population"] * 100000).reindex(first.index))
+    np.testing.assert_allclose(first["change"], (full["rate"] - full["rate"].shift()).reindex(first.index))
+    assert np.isnan(first.loc[2009, "change"])  # no data in 2008
+
+
+def test_change_point_found():
+    years = np.arange(1980, 2020)
+    rates = np.where(years < 2000, 10 + 0.5 * (years - 1980), 20 - 0.3 * (years - 2000))
+    df = pd.DataFrame({"country": "A", "year": years, "suicides_no": rates * 1000, "population": 1e8})
+    df = pd.concat([df, df.assign(country="B", suicides_no=(10 + 0.1 * (years - 1980)) * 1000)], ignore_index=True)
+    df = pd.concat([df, pd.DataFrame({"country": ["C"], "year": [2000], "suicides_no": [5.], "population": [1e5]})])
+
+    points = build_features.change_points(build_features.series_matrix(df, by=["country"])).set_index("country")
+    assert points.loc["A", "change_year"] == 2000
+    assert points.loc["A", "slope_before"] == pytest.approx(0.5)
+    assert points.loc["A", "slope_after"] == pytest.approx(-0.3)
+    assert points.loc["A", "fit_gain"] == pytest.approx(1.)
+    assert points.loc["B", "fit_gain"] == pytest.approx(0., abs=1e-6)  # a straight line doesn't change
+    assert np.isnan(points.loc["C", "change_year"])  # a single year can't be split
+
+
+def test_profile_features_match_groupby(enriched_df):
+    profiles = build_features.profile_features(enriched_df).set_index("country")
+    valid = enriched_df.dropna(subset=["suicides_no", "population"])
+    sums = valid.groupby(["country", "sex", "age"])[["suicides_no", "population"]].sum()
+    rates = (sums["suicides_no"] / sums["population"] * 100000).unstack(["sex", "age"])
+    for (sex, age), expected in rates.items():
+        np.testing.assert_allclose(profiles[f"{sex} {age}"], expected.reindex(profiles.index))
+    assert list(profiles.columns[:2]) == ["female 5-14 years", "female 15-24 years"]
+    assert list(profiles.columns[-2:]) == build_features.PROFILE_TRENDS
+
+    decades = build_features.profile_features(enriched_df, decades=True)
+    assert set(decades["decade"]) == set(enriched_df["year"] // 10 * 10)
+    assert len(decades) == len(valid.assign(decade=valid["year"] // 10).groupby(["country", "decade"]))
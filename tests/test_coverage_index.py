@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data import hive, load_dataset, pipeline, synthetic
+from src.features.coverage_index import CoverageIndex, load_index
+
+
+@pytest.fixture
+def data():
+    data = synthetic.make_synthetic_data(n_countries=15, n_years=12)
+    suicides = data.suicides
+    country = suicides["country"].unique()[0]
+    # a year with the population of only a few age groups, and a country-year without data
+    suicides.loc[(suicides["country"] == country) & (suicides["year"] == 2010) & (suicides["sex"] == "male"),
+                 "population"] = np.nan
+    suicides = suicides[~((suicides["country"] == country) & (suicides["year"] == 2011))].reset_index(drop=True)
+    return data._replace(suicides=suicides)
+
+
+def complete_country_years(df):
+    complete = df.dropna(subset=["suicides_no", "population"]).groupby(["country", "year"]).size() == 12
+    return complete[complete].reset_index()[["country", "year"]]
+
+
+def test_coverage_questions_match_groupby(data):
+    df = data.suicides
+    index = CoverageIndex.build(df)
+    complete = complete_country_years(df)
+
+    years = complete.groupby("country").size().reindex(index.axes["country"], fill_value=0)
+    pd.testing.assert_series_equal(index.years_per_country(), years.rename("years"), check_dtype=False,
+                                   check_names=False)
+    assert sorted(index.countries_with_years(12)) == sorted(years.index[years >= 12])
+
+    shares = complete.groupby("year").size().reindex(index.axes["year"], fill_value=0) / df["country"].nunique()
+    np.testing.assert_allclose(index.year_coverage().values, shares.values)
+    assert list(index.years_with_coverage(shares.max())) == list(shares.index[shares >= shares.max()])
+
+    counts = df.dropna(subset=["population"]).groupby(["country", "year"]).size()
+    partial = counts[counts % 12 != 0].reset_index()[["country", "year"]]
+    pd.testing.assert_frame_equal(index.partial_years(), partial, check_dtype=False)
+
+
+def test_imputed_layer(data, tmp_path):
+    df = data.suicides
+    df_population = pipeline.clean_population_stats(data.population)
+    age_stats = pipeline.get_age_group_stats(pipeline.add_age_group_fractions(df))
+    enriched_df = pipeline.impute_missing_populations(df, df_population, age_stats)
+
+    index = CoverageIndex.build(df, enriched_df)
+    index.save(tmp_path / "coverage.npz")
+    loaded = CoverageIndex.load(tmp_path / "coverage.npz")
+    for layer, bits in index.layers.items():
+        np.testing.assert_array_equal(loaded.layers[layer], bits)
+
+    keys = ["country", "year", "age", "sex"]
+    imputed = enriched_df[df["population"].isnull().values & enriched_df["population"].notnull().values]
+    expected = imputed[keys].astype({"country": str, "age": str, "sex": str}).sort_values(keys)
+    result = loaded.imputed_cells().sort_values(keys)
+    pd.testing.assert_frame_equal(result.reset_index(drop=True), expected.reset_index(drop=True), check_dtype=False)
+    assert (loaded.years_per_country(imputed=True) >= loaded.years_per_country()).all()
+
+
+def test_load_index_builds_once(data, tmp_path):
+    synthetic.write_raw_archive(data, tmp_path / "data.zip")
+    index = load_index(tmp_path / "coverage.npz", archive=tmp_path / "data.zip", processed_dir=tmp_path)
+    assert (tmp_path / "coverage.npz").is_file()
+    assert not index.layers["imputed"].any()  # no enriched data yet
+    again = load_index(tmp_path / "coverage.npz", archive=tmp_path / "data.zip", processed_dir=tmp_path)
+    np.testing.assert_array_equal(again.layers["rows"], index.layers["rows"])
+
+    # the enriched data written partitioned, by make_dataset.py all --partition-by year
+    df_population = pipeline.clean_population_stats(data.population)
+    age_stats = pipeline.get_age_group_stats(pipeline.add_age_group_fractions(data.suicides))
+    enriched_df = pipeline.impute_missing_populations(data.suicides, df_population, age_stats)
+    hive.write_partitioned(enriched_df, load_dataset.partitioned_path("enriched", tmp_path), ["year"])
+    rebuilt = load_index(tmp_path / "coverage.npz", archive=tmp_path / "data.zip", processed_dir=tmp_path)
+    assert rebuilt.layers["imputed"].any()
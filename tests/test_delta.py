@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+import pytest
+from click.testing import CliRunner
+
+from src.data import add_country_codes, delta, load_dataset, make_dataset, pipeline, raw_data, synthetic
+
+
+def new_release(data):
+    """
+    A new release of the synthetic data: a revised suicide number, a year added for two countries, a key taken out, a
+    revised age distribution and a revised total population of a country with missing populations
+    """
+    suicides, population = data.suicides.copy(), data.population.copy()
+    countries = suicides["country"].unique()
+    first_year = suicides["year"].min()
+    suicides.loc[(suicides["country"] == countries[0]) & (suicides["year"] == 2010), "suicides_no"] += 3
+    suicides = suicides[~((suicides["country"] == countries[1]) & (suicides["year"] == first_year))]
+    with_population = suicides.dropna(subset=["population"])
+    suicides.loc[with_population.index[0], "population"] *= 1.5
+    imputed = suicides[suicides["population"].isnull()].iloc[0]
+    population.loc[population["Country Name"] == imputed["country"], str(imputed["year"])] *= 1.1
+    return data._replace(suicides=suicides.reset_index(drop=True), population=population)
+
+
+def previous_release(data):
+    suicides = data.suicides
+    added = suicides["country"].isin(suicides["country"].unique()[2:4]) & (suicides["year"] == 2014)
+    return data._replace(suicides=suicides[~added].reset_index(drop=True))
+
+
+@pytest.mark.parametrize("output_format,imputation", [("csv", "global"), ("parquet", "interpolated")])
+def test_delta_run_matches_full_run(tmp_path, monkeypatch, output_format, imputation):
+    monkeypatch.chdir(tmp_path)
+    data = synthetic.make_synthetic_data(n_countries=12, n_years=8)
+    add_country_codes.write_code_cache(add_country_codes.COUNTRY_CODE_CACHE_FILE, data.codes)
+    synthetic.write_raw_archive(previous_release(data), "data.zip")
+    runner = CliRunner()
+
+    def run(*args):
+        result = runner.invoke(make_dataset.main, ["all", "--raw-archive", "data.zip", "--output-format",
+                                                   output_format, "--imputation", imputation] + list(args))
+        assert result.exit_code == 0, result.output
+        return result
+
+    run("--delta", "--output-dir", "delta")
+    assert (tmp_path / delta.SNAPSHOT_DIR / delta.STATE_FILE).is_file()
+
+    synthetic.write_raw_archive(new_release(data), "data.zip")
+    result = run("--delta", "--output-dir", "delta")
+    assert "age_fractions" not in result.output  # a stage of a full run only
+    snapshot = delta.read_snapshot(tmp_path / delta.SNAPSHOT_DIR)
+    suicide_df = raw_data.read_raw(raw_data.SUICIDE_MEMBER, "data.zip")
+    assert len(snapshot.keys) == len(suicide_df.groupby(["country", "year"], observed=True))
+
+    run("--output-dir", "full")
+    for name, output_file in make_dataset.OUTPUTS:
+        file_name = (tmp_path / output_file).with_suffix(load_dataset.FORMAT_EXTENSIONS[output_format]).name
+        expected = load_dataset.read_dataset(tmp_path / "full" / file_name)
+        result = load_dataset.read_dataset(tmp_path / "delta" / file_name)
+        pd.testing.assert_frame_equal(result, expected, check_dtype=False, check_categorical=False,
+                                      check_less_precise=12)  # statistics updated from sums, not means
+
+
+def test_diff_recomputes_only_changed_keys():
+    data = synthetic.make_synthetic_data(n_countries=20, n_years=10)
+    suicide_df = data.suicides
+    df_pop = pipeline.clean_population_stats(data.population)
+    old_keys = delta.key_table(suicide_df, df_pop)
+
+    revised = suicide_df.copy()
+    country = revised["country"].iloc[0]
+    revised.loc[(revised["country"] == country) & (revised["year"] == 2012), "suicides_no"] += 1
+    new_keys = delta.key_table(revised, df_pop)
+    changed = delta.changed_keys(old_keys, new_keys)
+    assert changed.tolist() == [(country, 2012)]
+
+    change = delta.diff_keys(old_keys, new_keys, changed, "global", age_stats_changed=False)
+    assert change.refreshed.tolist() == [(country, 2012)] and len(change.removed) == 0
+    change = delta.diff_keys(old_keys, new_keys, changed, "interpolated", age_stats_changed=False)
+    assert set(change.refreshed.get_level_values("country")) == {country} and len(change.refreshed) == 10
+    change = delta.diff_keys(old_keys, new_keys, changed, "global", age_stats_changed=True)
+    assert set(change.refreshed) == {(country, 2012)} | set(delta.key_index(new_keys[new_keys["imputed"]]))
+
+    shuffled = revised.iloc[np.r_[1, 0, 2:len(revised)]]  # rows of a key in another order
+    assert delta.changed_keys(new_keys, delta.key_table(shuffled, df_pop)).tolist() == [(country, 2007)]
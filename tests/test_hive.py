@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data import hive, load_dataset, synthetic
+
+
+def sort_rows(data_frame):
+    data_frame = data_frame.astype({column: object for column in data_frame.columns
+                                    if data_frame[column].dtype.name == "category"})
+    return data_frame.sort_values(["country", "year", "sex", "age"]).reset_index(drop=True)
+
+
+@pytest.fixture
+def suicides():
+    data = synthetic.make_synthetic_data(n_countries=12, n_years=6)
+    regions = data.meta.set_index("Country Code")["Region"]
+    df = data.suicides.assign(region=data.suicides["country"].map(data.codes).map(regions))
+    df.loc[df["country"] == df["country"].iloc[0], "region"] = np.nan  # a country without a region
+    return df
+
+
+@pytest.mark.parametrize("filters", [
+    [("year", "==", 2014)],
+    [("year", ">=", 2014), ("country", "in", {"France", "Peru", "Atlantis"})],
+    [[("region", "==", "South Asia")], [("sex", "!=", "male"), ("year", "<", 2013)]],
+    [("country", "not in", ["France"]), ("suicides_no", ">", 100.)],
+    [("year", ">", 2100)],
+])
+def test_filtered_reads_match_pandas(tmp_path, suicides, filters):
+    hive.write_partitioned(suicides, tmp_path / "suicides", ["year", "region"], row_group_size=20)
+    result = hive.read_partitioned(tmp_path / "suicides", filters=filters)
+    assert result.columns.tolist() == suicides.columns.tolist()
+    assert result["year"].dtype == suicides["year"].dtype and result["country"].dtype.name == "category"
+    expected = suicides[hive.filter_mask(suicides, filters)]
+    pd.testing.assert_frame_equal(sort_rows(result), sort_rows(expected), check_categorical=False)
+
+
+def test_reads_only_the_partitions_and_row_groups_needed(tmp_path, suicides):
+    hive.write_partitioned(suicides, tmp_path / "suicides", ["year"], row_group_size=24)
+    everything = hive.plan_scan(tmp_path / "suicides")
+    assert len(everything.pieces) == suicides["year"].nunique()
+
+    one_year = hive.plan_scan(tmp_path / "suicides", [("year", "==", 2014)])
+    assert [piece.partition for piece in one_year.pieces] == [{"year": 2014}]
+    country = suicides["country"].iloc[-1]
+    one_country = hive.plan_scan(tmp_path / "suicides", [("year", "==", 2014), ("country", "==", country)],
+                                 columns=["population"])
+    assert len(one_country.pieces[0].row_groups) < len(one_year.pieces[0].row_groups)
+    assert one_country.bytes_read < one_year.bytes_read < everything.bytes_read / 3
+    assert hive.read_partitioned(tmp_path / "suicides", columns=["population"],
+                                 filters=[("country", "==", country)]).columns.tolist() == ["population"]
+
+    with pytest.raises(KeyError):
+        hive.read_partitioned(tmp_path / "suicides", filters=[("income", "==", "High income")])
+    with pytest.raises(ValueError):
+        hive.read_partitioned(tmp_path / "suicides", filters=[("year", "~", 2014)])
+
+
+def test_load_dataset_filters_any_layout(tmp_path, suicides):
+    filters = [("year", "<", 2013), ("sex", "==", "female")]
+    expected = sort_rows(suicides[hive.filter_mask(suicides, filters)][["country", "year", "sex", "age"]])
+
+    load_dataset.save_dataset(suicides, load_dataset.dataset_path("enriched", "feather", tmp_path), "feather")
+    result = load_dataset.load_dataset("enriched", columns=["country", "year", "age"], filters=filters,
+                                       processed_dir=tmp_path)
+    assert result.columns.tolist() == ["country", "year", "age"]
+    assert len(result) == len(expected)
+
+    hive.write_partitioned(suicides, load_dataset.partitioned_path("enriched", tmp_path), ["year"])
+    result = load_dataset.load_dataset("enriched", filters=filters, processed_dir=tmp_path)
+    pd.testing.assert_frame_equal(sort_rows(result)[expected.columns], expected)
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data import impute, pipeline, raw_data, synthetic
+
+
+@pytest.fixture
+def raw_frames(tmp_path):
+    data = synthetic.make_synthetic_data(n_countries=20, n_years=8)
+    archive = tmp_path / "data.zip"
+    synthetic.write_raw_archive(data, archive)
+    df = raw_data.read_raw(raw_data.SUICIDE_MEMBER, archive=archive)
+    df_population = pipeline.clean_population_stats(raw_data.read_raw(raw_data.POPULATION_MEMBER, archive=archive))
+    age_stats = pipeline.get_age_group_stats(pipeline.add_age_group_fractions(df))
+    return df, df_population, age_stats
+
+
+def test_global_matches_merges(raw_frames):
+    df, df_population, age_stats = raw_frames
+    assert df["population"].isnull().any()
+    expected = pipeline.fill_in_missing_populations(df, df_population, age_stats)
+    pd.testing.assert_frame_equal(impute.impute_populations(df, df_population, age_stats), expected)
+
+    # string keys instead of categoricals, and rows in another order
+    shuffled = df.astype({"country": str, "sex": str, "age": str}).sample(frac=1, random_state=0)
+    pd.testing.assert_frame_equal(impute.impute_populations(shuffled, df_population, age_stats),
+                                  pipeline.fill_in_missing_populations(shuffled, df_population, age_stats))
+
+
+def test_interpolated_between_years():
+    groups = [("female", "young"), ("female", "old"), ("male", "young"), ("male", "old")]
+    distributions = {2000: [0.4, 0.1, 0.4, 0.1], 2004: [0.2, 0.3, 0.2, 0.3]}
+    rows = []
+    for year in range(1999, 2005):
+        for (sex, age), fraction in zip(groups, distributions.get(year, [np.nan] * 4)):
+            rows.append(("A", year, sex, age, fraction * 1000))
+            rows.append(("B", year, sex, age, np.nan))  # never known, falls back to the global average
+    df = pd.DataFrame(rows, columns=["country", "year", "sex", "age", "population"])
+    df_population = pd.DataFrame({"country": ["A"] * 6 + ["B"] * 6, "year": list(range(1999, 2005)) * 2,
+                                  "total_population": 100.})
+    age_stats = pd.DataFrame(groups, columns=["sex", "age"]).assign(fraction_pop=0.25)
+
+    result = impute.impute_populations(df, df_population, age_stats, strategy="interpolated")
+    result = result.set_index(["country", "year", "sex", "age"])["population"]
+    assert result[("A", 2002, "female", "young")] == pytest.approx(30.)  # halfway between 40 and 20
+    assert result[("A", 2001, "male", "old")] == pytest.approx(15.)  # a quarter of the way from 10 to 30
+    assert result[("A", 1999, "female", "old")] == pytest.approx(10.)  # before the first year: the nearest one
+    assert result[("A", 2000, "female", "old")] == pytest.approx(100.)  # known populations are kept
+    assert (result["B"] == 25.).all()
+    assert result["A"].groupby("year").sum().drop([2000, 2004]).values == pytest.approx(100.)
+
+    with pytest.raises(ValueError):
+        impute.impute_populations(df, df_population, age_stats, strategy="median")
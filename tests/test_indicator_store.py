@@ -0,0 +1,70 @@
+import zipfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data import synthetic
+from src.features.indicator_store import IndicatorStore
+
+SUNSHINE = (
+    "Country \tCity \tJan \tFeb \tYear \tRef.\n"
+    "France \tParis \t62.5 \t79.2 \t1,661.6 \t?\n"
+    "France \tNice \t150.0 \t160.0 \t2,700.0 \t[1]\n"
+    "Japan \tTokyo \t184.5 \t165.8 \t1,876.7 \t?\n"
+)
+
+
+@pytest.fixture
+def store(tmp_path):
+    data = synthetic.make_synthetic_data(n_countries=5, n_years=6)
+    population = data.population.assign(**{"Indicator Code": "NY.GDP.PCAP.PP.KD"})
+    population.iloc[0, -1] = np.nan  # last year missing for the first country
+    archive = tmp_path / "API_NY.GDP.PCAP.PP.KD_DS2_en_csv_v2_1.zip"
+    with zipfile.ZipFile(archive, "w") as zipped:
+        zipped.writestr("Metadata_Country.csv", "")
+        zipped.writestr("API_NY.GDP.PCAP.PP.KD_DS2_en_csv_v2_1.csv", synthetic._world_bank_csv(population))
+    sunshine = tmp_path / "sunshine.txt"
+    sunshine.write_text(SUNSHINE, encoding="utf-8")
+
+    store = IndicatorStore(tmp_path / "store")
+    store.ingest_world_bank(archive, name="gdp")
+    store.ingest_sunshine(sunshine, name="sun")
+    return store, data
+
+
+def test_join_matches_merge(store):
+    store, data = store
+    assert sorted(store.indicators) == ["gdp", "sun_feb", "sun_jan", "sun_year"]
+
+    long = data.population.melt(id_vars=["Country Code"], value_vars=[str(year) for year in range(2011, 2017)],
+                                var_name="year", value_name="gdp").rename(columns={"Country Code": "code"})
+    long["year"] = long["year"].astype(int)
+    long.loc[(long["code"] == data.population["Country Code"].iat[0]) & (long["year"] == 2016), "gdp"] = np.nan
+    frame = long[["code", "year"]].sample(frac=1, random_state=0).reset_index(drop=True)
+    frame = frame.append(pd.DataFrame({"code": ["XXX", "FRA", "JPN"], "year": [2012, 2000, 1990]}), ignore_index=True)
+
+    result = IndicatorStore(store.store_dir).join(frame, ["gdp", "sun_year"])  # reads the persisted store
+    expected = pd.merge(frame, long, on=["code", "year"], how="left")
+    np.testing.assert_array_equal(result["gdp"].values, expected["gdp"].values)
+
+    sun = result.set_index("code")["sun_year"]
+    assert sun["FRA"] == pytest.approx((1661.6 + 2700.) / 2)  # thousands separators, mean over cities
+    assert sun["JPN"] == pytest.approx(1876.7)
+    assert np.isnan(sun["XXX"])
+
+
+def test_asof_join_and_reingest(store):
+    store, data = store
+    code = data.population["Country Code"].iat[0]
+    frame = pd.DataFrame({"code": [code] * 3, "year": [2016, 2016, 2010]})
+
+    exact = store.join(frame, ["gdp"])["gdp"]
+    asof = store.join(frame, ["gdp"], how="asof")["gdp"]
+    assert np.isnan(exact[0]) and np.isnan(asof[2])
+    assert asof[0] == data.population.loc[0, "2015"]
+    assert np.isnan(store.join(frame, ["gdp"], how="asof", tolerance=0)["gdp"][0])
+
+    mtime = (store.store_dir / "gdp.feather").stat().st_mtime_ns
+    store.ingest_world_bank(store.index["sources"]["gdp"]["path"], name="gdp")  # unchanged, not read again
+    assert (store.store_dir / "gdp.feather").stat().st_mtime_ns == mtime
@@ -0,0 +1,34 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from src.data.instrumentation import PROFILE_COLUMNS, StageProfiler
+
+
+def fill_nans(data_frame):
+    return data_frame.fillna({"population": 0.})
+
+
+def test_stage_profiler_records_every_call(tmp_path):
+    profiler = StageProfiler(trace_memory=True, cprofile_dir=tmp_path / "cprofile")
+    fill = profiler.wrap("fill", fill_nans, imputed_column="population")
+    df = pd.DataFrame({"population": [1., np.nan, np.nan], "country": ["a", "b", "c"]})
+
+    pd.testing.assert_frame_equal(fill(df), fill_nans(df))
+    fill(df.iloc[:2])
+
+    summary = profiler.summary()
+    assert list(summary.columns) == PROFILE_COLUMNS
+    assert summary.loc[0, ["stage", "calls", "rows_in", "rows_out", "nulls_imputed"]].tolist() == ["fill", 2, 5, 5, 3]
+    assert summary.loc[0, "traced_peak_mb"] > 0
+    assert (tmp_path / "cprofile" / "fill.prof").is_file()
+
+    profiler.write(tmp_path / "profile.json")
+    with open(tmp_path / "profile.json") as f:
+        profile = json.load(f)
+    assert profile["stages"][0]["nulls_imputed"] == 3
+    assert len(profile["calls"]) == 2
+
+    profiler.write(tmp_path / "profile.csv")
+    pd.testing.assert_frame_equal(pd.read_csv(tmp_path / "profile.csv"), summary, check_dtype=False)
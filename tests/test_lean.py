@@ -0,0 +1,64 @@
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import pytest
+from click.testing import CliRunner
+
+from src.data import add_country_codes, lean, load_dataset, make_dataset, pipeline, raw_data, reshape, synthetic
+
+
+def assert_same_numbers(result, expected):
+    """ The same frames, up to the last few bits of the floats (sums and means may be taken in another order) """
+    floats = [column for column in expected.columns if expected[column].dtype.kind == "f"]
+    pd.testing.assert_frame_equal(result.drop(columns=floats), expected.drop(columns=floats), check_dtype=False,
+                                  check_categorical=False)
+    for column in floats:
+        np.testing.assert_allclose(result[column].values.astype(float), expected[column].values, rtol=1e-12,
+                                   err_msg=column)
+
+
+@pytest.mark.parametrize("imputation", ["global", "interpolated"])
+def test_lean_stages_match_stages(tmp_path, imputation):
+    data = synthetic.make_synthetic_data(n_countries=15, n_years=8)
+    synthetic.write_raw_archive(data, tmp_path / "data.zip")
+    df = raw_data.read_raw(raw_data.SUICIDE_MEMBER, archive=tmp_path / "data.zip")
+    original = df.copy()
+    df_population = pipeline.clean_population_stats(data.population)
+
+    age_stats = pipeline.get_age_group_stats(pipeline.add_age_group_fractions(df))
+    assert_same_numbers(lean.get_age_group_stats(lean.add_age_group_fractions(df)), age_stats)
+
+    enriched_df = pipeline.IMPUTERS[imputation](df, df_population, age_stats)
+    lean_enriched_df = lean.IMPUTERS[imputation](df, df_population, age_stats)
+    assert_same_numbers(lean_enriched_df, enriched_df)
+    assert lean_enriched_df.memory_usage(deep=True).sum() < enriched_df.memory_usage(deep=True).sum()
+    pd.testing.assert_frame_equal(df, original)  # the suicide data it shares columns with is untouched
+
+    assert_same_numbers(lean.choropleth_frame(lean_enriched_df), reshape.choropleth_frame(enriched_df))
+
+
+def test_lean_run_matches_default_run_with_lower_peak(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    data = synthetic.make_synthetic_data(n_countries=40, n_years=15)
+    add_country_codes.write_code_cache(add_country_codes.COUNTRY_CODE_CACHE_FILE, data.codes)
+    synthetic.write_raw_archive(data, "data.zip")
+    runner = CliRunner()
+
+    peaks = {}
+    for mode in ["default", "lean"]:
+        args = ["all", "--raw-archive", "data.zip", "--output-dir", mode, "--force"]
+        tracemalloc.start()
+        result = runner.invoke(make_dataset.main, args + (["--lean"] if mode == "lean" else []))
+        peaks[mode] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        assert result.exit_code == 0, result.output
+    assert peaks["lean"] < peaks["default"]
+
+    for _, output_file in make_dataset.OUTPUTS:
+        file_name = (tmp_path / output_file).with_suffix(".csv").name
+        assert_same_numbers(load_dataset.read_dataset(tmp_path / "lean" / file_name),
+                            load_dataset.read_dataset(tmp_path / "default" / file_name))
+
+    result = runner.invoke(make_dataset.main, ["all", "--raw-archive", "data.zip", "--lean", "--jobs", "2"])
+    assert result.exit_code != 0
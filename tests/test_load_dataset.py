@@ -0,0 +1,33 @@
+import pandas as pd
+import pytest
+
+from src.data import load_dataset
+
+CHOROPLETH_FILE = "./tests/data/choropleth_df.csv"
+
+
+@pytest.mark.parametrize("output_format", load_dataset.COLUMNAR_FORMATS)
+def test_columnar_round_trip_keeps_dtypes(tmp_path, output_format):
+    df = pd.read_csv(CHOROPLETH_FILE)
+    df["population"] = df["population"].astype("float32")
+    df["year"] = df["year"].astype("int16")
+
+    load_dataset.save_dataset(df, load_dataset.dataset_path("choropleth", output_format, tmp_path), output_format)
+    loaded = load_dataset.load_dataset("choropleth", processed_dir=tmp_path)
+
+    assert loaded["country"].dtype.name == "category"
+    assert loaded["population"].dtype.name == "float32"
+    assert loaded["year"].dtype.name == "int16"
+    pd.testing.assert_frame_equal(loaded.astype({"sex": object, "country": object, "code": object}), df)
+
+    projected = load_dataset.load_dataset("choropleth", columns=["year", "code"], processed_dir=tmp_path)
+    assert projected.columns.tolist() == ["year", "code"]
+
+
+def test_load_dataset_falls_back_to_csv(tmp_path):
+    df = pd.read_csv(CHOROPLETH_FILE)
+    load_dataset.save_dataset(df, load_dataset.dataset_path("choropleth", "csv", tmp_path), "csv")
+    pd.testing.assert_frame_equal(load_dataset.load_dataset("choropleth", processed_dir=tmp_path), df)
+
+    with pytest.raises(FileNotFoundError):
+        load_dataset.load_dataset("enriched", processed_dir=tmp_path)
@@ -0,0 +1,86 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pandas as pd
+from click.testing import CliRunner
+
+from src.data import add_country_codes, impute, load_dataset, make_dataset, raw_data, synthetic, validation
+
+
+def test_help_does_not_import_pandas():
+    code = "import sys; from src.data import make_dataset; print('pandas' in sys.modules, 'numpy' in sys.modules)"
+    output = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, check=True).stdout
+    assert output.decode().split() == ["False", "False"]
+
+    result = CliRunner().invoke(make_dataset.main, ["--help"])
+    assert result.exit_code == 0
+    for command in ["all", "enrich", "meta", "choropleth", "year-country"]:
+        assert command in result.output
+
+
+def test_copied_constants_match():
+    assert make_dataset.RAW_ARCHIVE == raw_data.RAW_ARCHIVE
+    assert make_dataset.FORMAT_EXTENSIONS == load_dataset.FORMAT_EXTENSIONS
+    assert make_dataset.IMPUTATION_STRATEGIES == impute.STRATEGIES
+    assert make_dataset.VALIDATION_LEVEL_ENV_VAR == validation.LEVEL_ENV_VAR
+    assert make_dataset.VALIDATION_LEVELS == validation.LEVELS
+    assert make_dataset.DEFAULT_VALIDATION_LEVEL == validation.DEFAULT_LEVEL
+
+
+def test_single_stages_match_all(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    data = synthetic.make_synthetic_data(n_countries=8, n_years=4)
+    synthetic.write_raw_archive(data, "data.zip")
+    add_country_codes.write_code_cache(add_country_codes.COUNTRY_CODE_CACHE_FILE, data.codes)
+    runner = CliRunner()
+
+    def run(*args):
+        result = runner.invoke(make_dataset.main, ["--project-dir", str(tmp_path)] + list(args))
+        assert result.exit_code == 0, result.output
+        return result
+
+    run("all", "--raw-archive", "data.zip", "--output-dir", "all", "--output-format", "feather")
+    stage_files = {"enriched": "stages/enriched.feather", "meta": "stages/meta.csv",
+                   "choropleth": "stages/choropleth.csv", "year_country": "stages/year_country.feather"}
+    run("enrich", "--raw-archive", "data.zip", "--output", stage_files["enriched"])
+    run("meta", "--raw-archive", "data.zip", "--output", stage_files["meta"])
+    run("choropleth", "--input", stage_files["enriched"], "--output", stage_files["choropleth"])
+    run("year-country", "--input", stage_files["choropleth"], "--output", stage_files["year_country"])
+
+    for name, output_file in make_dataset.OUTPUTS:
+        expected = load_dataset.read_dataset(Path("all") / Path(output_file).with_suffix(".feather").name)
+        result = load_dataset.read_dataset(stage_files[name])
+        pd.testing.assert_frame_equal(result.astype(str), expected.astype(str))  # csv files lose the dtypes
+
+    result = run("choropleth", "--input", "stages/enriched.feather", "--output", "stages/choropleth.csv")
+    assert "loaded from the cache" in result.output
+    result = runner.invoke(make_dataset.main, ["choropleth", "--input", "stages/enriched.feather", "--output", "x.txt"])
+    assert result.exit_code != 0
+
+
+def test_partitioned_outputs(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    data = synthetic.make_synthetic_data(n_countries=8, n_years=4)
+    synthetic.write_raw_archive(data, "data.zip")
+    add_country_codes.write_code_cache(add_country_codes.COUNTRY_CODE_CACHE_FILE, data.codes)
+    runner = CliRunner()
+    partition_by = ["--partition-by", "year", "--partition-by", "region"]
+    for output_dir, options in [("single", []), ("partitioned", partition_by)]:
+        result = runner.invoke(make_dataset.main, ["all", "--raw-archive", "data.zip", "--output-dir", output_dir,
+                                                   "--output-format", "parquet"] + options)
+        assert result.exit_code == 0, result.output
+    assert (tmp_path / "partitioned" / "choropleth_df" / "year=2014").is_dir()
+
+    filters = [("year", "==", 2014)]
+    for name in ["enriched", "choropleth", "year_country"]:
+        expected = load_dataset.load_dataset(name, filters=filters, processed_dir="single").astype(str)
+        result = load_dataset.load_dataset(name, columns=list(expected.columns), filters=filters,
+                                           processed_dir="partitioned").astype(str)
+        pd.testing.assert_frame_equal(result.sort_values(list(result.columns)).reset_index(drop=True),
+                                      expected.sort_values(list(expected.columns)).reset_index(drop=True))
+    regions = load_dataset.load_dataset("choropleth", columns=["region"], processed_dir="partitioned")
+    assert regions["region"].notnull().all()
+
+    result = runner.invoke(make_dataset.main, ["all", "--raw-archive", "data.zip", "--partition-by", "year"])
+    assert result.exit_code != 0 and "--output-format parquet" in result.output
@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data import synthetic
+from src.features.indicator_store import IndicatorStore
+from src.models import predict_model, train_model
+
+FEATURES = ["log_gdp", "sunshine", "urban"]
+
+
+@pytest.fixture
+def frame():
+    rng = np.random.default_rng(0)
+    n_countries, n_years = 40, 15
+    countries = np.repeat([f"country {i}" for i in range(n_countries)], n_years)
+    df = pd.DataFrame({
+        "country": countries,
+        "year": np.tile(np.arange(2000, 2000 + n_years), n_countries),
+        "region": np.repeat(rng.choice(["Europe", "Asia", "Africa"], n_countries), n_years),
+        "income": np.repeat(rng.choice(["High income", "Low income"], n_countries), n_years),
+        "gdp": np.exp(rng.normal(9, 1, len(countries))),
+        "sunshine": rng.normal(2000, 400, len(countries)),
+        "urban": rng.uniform(20, 90, len(countries)),
+    })
+    df = pd.concat([df.assign(sex=sex) for sex in ["female", "male"]], ignore_index=True)
+    slope = df["region"].map({"Europe": 3., "Asia": -1., "Africa": 0.5}) * np.where(df["sex"] == "male", 2, 1)
+    df["rate"] = 10 + slope * np.log(df["gdp"]) - 0.002 * df["sunshine"] + rng.normal(0, 1, len(df))
+    df.loc[rng.uniform(size=len(df)) < 0.1, "sunshine"] = np.nan  # some missing features
+    df.loc[rng.uniform(size=len(df)) < 0.05, "rate"] = np.nan
+    return df
+
+
+def test_batched_fits_match_single_fits(frame):
+    bundle = train_model.train_models(frame, FEATURES, group_by=["region", "sex"], penalty=0., n_folds=4)
+    assert bundle.coefficients.shape == (6, 7, 4)
+    names = train_model.feature_set_names(bundle.feature_sets, bundle.features)
+    models = train_model.summary(bundle, best_only=False).set_index(["region", "sex", "feature_set"])
+
+    for region, sex, feature_set in [("Europe", "male", "log_gdp+sunshine"), ("Asia", "female", "urban")]:
+        features = feature_set.split("+")
+        rows = frame[(frame["region"] == region) & (frame["sex"] == sex)]
+        x = np.column_stack([train_model.feature_values(rows, feature) for feature in features])
+        complete = ~np.isnan(x).any(axis=1) & rows["rate"].notnull().values
+        design = np.column_stack([np.ones(complete.sum()), x[complete]])
+        coefficients = np.linalg.lstsq(design, rows["rate"].values[complete], rcond=None)[0]
+        model = models.loc[(region, sex, feature_set)]
+        assert model["n"] == complete.sum()
+        assert model["intercept"] == pytest.approx(coefficients[0])
+        np.testing.assert_allclose(model[features].values.astype(float), coefficients[1:], rtol=1e-6)
+    assert set(train_model.summary(bundle)["feature_set"]) <= set(names)
+
+    # more penalty, smaller (standardised) coefficients
+    ridge = train_model.train_models(frame, FEATURES, group_by=["region", "sex"], penalty=1000., n_folds=4)
+    assert (np.abs(ridge.coefficients[..., 1:]) <= np.abs(bundle.coefficients[..., 1:]) + 1e-12).all()
+
+
+def test_cross_validation_matches_refitting(frame):
+    bundle = train_model.train_models(frame, ["log_gdp"], group_by=["sex"], penalty=2., n_folds=3, seed=5)
+    parallel = train_model.train_models(frame, ["log_gdp"], group_by=["sex"], penalty=2., n_folds=3, seed=5, jobs=2)
+    np.testing.assert_allclose(parallel.cv_rmse, bundle.cv_rmse)
+
+    # refit by hand, leaving out every fold of countries
+    rows = frame[(frame["sex"] == "female") & frame["rate"].notnull()]
+    countries = pd.unique(frame["country"][frame["rate"].notnull()])  # in the order train_models sees them
+    fold_of = dict(zip(countries, np.random.default_rng(5).permutation(len(countries)) % 3))
+    fold = rows["country"].map(fold_of).values
+    x = (np.log(rows["gdp"].values) - bundle.means[0]) / bundle.scales[0]
+    y = rows["rate"].values
+    errors = []
+    for f in range(3):
+        design = np.column_stack([np.ones((fold != f).sum()), x[fold != f]])
+        beta = np.linalg.solve(design.T @ design + np.diag([0., 2.]), design.T @ y[fold != f])
+        errors.append(y[fold == f] - beta[0] - beta[1] * x[fold == f])
+    group = list(map(tuple, bundle.group_keys)).index(("female",))
+    assert bundle.cv_rmse[group, 0] == pytest.approx(np.sqrt(np.mean(np.concatenate(errors) ** 2)))
+
+
+@pytest.mark.parametrize("suffix", [".csv", ".parquet"])
+def test_streamed_scoring_matches_predict(tmp_path, frame, suffix):
+    bundle = train_model.train_models(frame.rename(columns={"gdp": "gdp_per_capita"}), ["log_gdp_per_capita"],
+                                      group_by=["region", "sex"])
+    train_model.save_bundle(bundle, tmp_path / "models.npz")
+    loaded = train_model.load_bundle(tmp_path / "models.npz")
+    for field in train_model.ModelBundle._fields:
+        np.testing.assert_array_equal(getattr(loaded, field), getattr(bundle, field))
+
+    data = synthetic.make_synthetic_data(n_countries=10, n_years=5)
+    codes = pd.Series(data.codes)
+    year_country_df = pd.DataFrame({"country": np.repeat(codes.index, 5), "code": np.repeat(codes.values, 5),
+                                    "year": np.tile(np.arange(2010, 2015), 10)})
+    for column in train_model.RATE_COLUMNS.values():
+        year_country_df[column] = np.random.default_rng(1).uniform(5, 20, len(year_country_df))
+    meta = data.meta.rename(columns={"Country Code": "code", "Region": "region", "IncomeGroup": "income"})
+    meta.loc[0, "region"] = "Europe"
+    (tmp_path / "gdp.csv").write_text("made up")
+    store = IndicatorStore(tmp_path / "store")
+    store.add("gdp", tmp_path / "gdp.csv", year_country_df[["code", "year"]].assign(
+        indicator="gdp_per_capita", value=np.exp(np.random.default_rng(2).normal(9, 1, len(year_country_df)))))
+
+    year_country_df.to_csv(tmp_path / "year_country.csv", index=False)
+    rows = predict_model.score_file(loaded, tmp_path / "year_country.csv", tmp_path / f"predictions{suffix}",
+                                    meta, store, chunksize=7)
+    scored = pd.read_csv(tmp_path / "predictions.csv") if suffix == ".csv" else \
+        pd.read_parquet(tmp_path / "predictions.parquet")
+    assert rows == len(scored) == 3 * len(year_country_df)
+
+    whole = train_model.model_frame(year_country_df, meta, store, ["log_gdp_per_capita"])
+    predicted, _ = predict_model.predict(bundle, whole)
+    assert np.isfinite(predicted).any() and np.isnan(predicted).any()  # only Europe has models
+    keys = ["country", "year", "sex"]
+    scored = scored.assign(country=scored["country"].astype(str), sex=scored["sex"].astype(str))
+    expected = whole[keys].assign(predicted=predicted).merge(scored, on=keys, suffixes=("", "_streamed"))
+    assert len(expected) == len(scored)
+    np.testing.assert_allclose(expected["predicted_streamed"], expected["predicted"])
+    with pytest.raises(ValueError):
+        predict_model.predict(bundle, whole, feature_set="sunshine")
@@ -0,0 +1,37 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from src.data import add_country_codes, parallel, pipeline, raw_data, reshape, synthetic
+
+
+def test_shard_positions_keeps_countries_together():
+    keys = pd.Series(["a"] * 5 + ["b"] * 2 + ["c"] * 3 + ["a"])
+    shards = parallel.shard_positions(keys, 2)
+
+    assert sorted(np.concatenate(shards)) == list(range(len(keys)))
+    assert [sorted(set(keys.iloc[shard])) for shard in shards] == [["a"], ["b", "c"]]
+    assert len(parallel.shard_positions(keys, 10)) == 3  # no empty shards
+
+
+def test_parallel_runners_match_serial_stages(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    data = synthetic.make_synthetic_data(n_countries=30, n_years=6)
+    synthetic.write_raw_archive(data, "data.zip")
+    add_country_codes.write_code_cache(add_country_codes.COUNTRY_CODE_CACHE_FILE, data.codes)
+
+    df = raw_data.read_raw(raw_data.SUICIDE_MEMBER, archive="data.zip")
+    df_population = pipeline.clean_population_stats(raw_data.read_raw(raw_data.POPULATION_MEMBER,
+                                                                      archive="data.zip"))
+    age_stats = pipeline.get_age_group_stats(pipeline.add_age_group_fractions(df))
+
+    enriched_df = pipeline.fill_in_missing_populations(df, df_population, age_stats)
+    choropleth_df = reshape.choropleth_frame(enriched_df)
+    year_country_df = pipeline.year_country_with_intervals(choropleth_df)
+
+    with ProcessPoolExecutor(2) as executor:
+        runners = pipeline.parallel_runners(executor, 3)
+        pd.testing.assert_frame_equal(runners["enriched"](df, df_population, age_stats), enriched_df)
+        pd.testing.assert_frame_equal(runners["choropleth"](enriched_df), choropleth_df)
+        pd.testing.assert_frame_equal(runners["year_country"](choropleth_df), year_country_df)
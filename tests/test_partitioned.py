@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data import partitioned, pipeline, synthetic
+
+
+def chunked(data_frame, chunksize):
+    return (data_frame.iloc[start:start + chunksize] for start in range(0, len(data_frame), chunksize))
+
+
+def test_iter_partitions_keeps_countries_together():
+    df = synthetic.make_synthetic_data(n_countries=7, n_years=5).suicides  # 60 rows per country
+    partitions = list(partitioned.iter_partitions(chunked(df, 50)))
+
+    assert sum(len(partition) for partition in partitions) == len(df)
+    countries = [set(partition["country"]) for partition in partitions]
+    assert sum(len(c) for c in countries) == 7  # no country is in more than one partition
+    pd.testing.assert_frame_equal(pd.concat(partitions, ignore_index=True), df)
+
+    with pytest.raises(ValueError):
+        list(partitioned.iter_partitions(chunked(pd.concat([df, df.iloc[:12]], ignore_index=True), 50)))
+
+
+def test_get_age_group_stats_partitioned():
+    df = synthetic.make_synthetic_data(n_countries=20, n_years=8).suicides
+    expected = pipeline.get_age_group_stats(pipeline.add_age_group_fractions(df))
+
+    result = pipeline.get_age_group_stats_partitioned(partitioned.iter_partitions(chunked(df, 100)))
+    np.testing.assert_array_equal(result[["age", "sex"]].values, expected[["age", "sex"]].values)
+    np.testing.assert_allclose(result["fraction_pop"], expected["fraction_pop"], rtol=1e-12)
@@ -0,0 +1,23 @@
+from src.data import raw_data
+
+RAW_ARCHIVE = "./data/raw/data.zip"
+
+
+def test_read_raw_applies_schema():
+    df = raw_data.read_raw(raw_data.SUICIDE_MEMBER, archive=RAW_ARCHIVE)
+    assert df.dtypes.astype(str).to_dict() == {"country": "category", "year": "int16", "sex": "category",
+                                               "age": "category", "suicides_no": "float32", "population": "float64"}
+    assert len(df) % 12 == 0
+
+    df_population = raw_data.read_raw(raw_data.POPULATION_MEMBER, archive=RAW_ARCHIVE)
+    assert "Indicator Name" not in df_population
+    assert df_population.columns[0] == "Country Name"
+
+    meta = raw_data.read_raw(raw_data.META_DATA_MEMBER, archive=RAW_ARCHIVE)
+    assert meta.columns.tolist() == ["Country Code", "Region", "IncomeGroup"]
+
+
+def test_read_raw_in_chunks():
+    chunks = raw_data.read_raw(raw_data.SUICIDE_MEMBER, archive=RAW_ARCHIVE, chunksize=10000)
+    assert sum(len(chunk) for chunk in chunks) == len(raw_data.read_raw(raw_data.SUICIDE_MEMBER, archive=RAW_ARCHIVE))
+    assert raw_data.fingerprint(raw_data.SUICIDE_MEMBER, archive=RAW_ARCHIVE).startswith("zip-")
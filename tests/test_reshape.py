@@ -0,0 +1,30 @@
+from pathlib import Path
+
+import pandas as pd
+
+from src.data import pipeline, raw_data, reshape
+
+CHOROPLETH_FILE = "./tests/data/choropleth_df.csv"
+RAW_ARCHIVE = Path("./data/raw/data.zip").resolve()
+
+
+def test_choropleth_frame_matches_prepare_data_for_choropleth(tmp_path, monkeypatch):
+    df = raw_data.read_raw(raw_data.SUICIDE_MEMBER, archive=RAW_ARCHIVE)
+    df_population = pipeline.clean_population_stats(raw_data.read_raw(raw_data.POPULATION_MEMBER,
+                                                                      archive=RAW_ARCHIVE))
+    age_stats = pipeline.get_age_group_stats(pipeline.add_age_group_fractions(df))
+    enriched_df = pipeline.fill_in_missing_populations(df, df_population, age_stats)
+
+    monkeypatch.chdir(tmp_path)  # the country code cache is written relative to the working directory
+    expected = pipeline.prepare_data_for_choropleth(enriched_df)
+    pd.testing.assert_frame_equal(reshape.choropleth_frame(enriched_df), expected)
+
+
+def test_year_country_frame_matches_make_df_nicer_format():
+    df_choropleth = pd.read_csv(CHOROPLETH_FILE)
+
+    expected = pipeline.make_df_nicer_format(df_choropleth)
+    expected["year"] = expected["year"].astype(int)  # make_df_nicer_format turns year into a string
+    result = reshape.year_country_frame(df_choropleth)
+
+    pd.testing.assert_frame_equal(result, expected, check_names=False)  # check_names: columns are called "sex"
@@ -0,0 +1,83 @@
+import json
+import threading
+from http import HTTPStatus
+
+import pytest
+
+from src.data import hive, load_dataset, synthetic
+from src.service import client as query_client
+from src.service.server import QueryService, make_server
+
+
+def write_processed(processed_dir, data):
+    load_dataset.save_dataset(data.suicides, load_dataset.dataset_path("enriched", "feather", processed_dir), "feather")
+    codes = data.suicides[["country"]].drop_duplicates().assign(code=lambda df: df["country"].map(data.codes))
+    load_dataset.save_dataset(codes, load_dataset.dataset_path("choropleth", "feather", processed_dir), "feather")
+
+
+@pytest.fixture
+def service(tmp_path):
+    data = synthetic.make_synthetic_data(n_countries=6, n_years=5)
+    write_processed(tmp_path, data)
+    return QueryService(tmp_path, tmp_path / "cube.npz"), data
+
+
+def test_series_matches_data(service):
+    service, data = service
+    country = data.suicides["country"].iloc[0]
+    response = service.get(f"/countries/{data.codes[country]}?by=sex")
+    assert response.status == HTTPStatus.OK
+    result = json.loads(response.body.decode("utf-8"))
+    assert result["country"] == country and result["by"] == ["year", "sex"]
+
+    valid = data.suicides.dropna(subset=["suicides_no", "population"])
+    expected = valid[valid["country"] == country].groupby(["year", "sex"])["suicides_no"].sum()
+    totals = dict(zip(zip(result["data"]["year"], result["data"]["sex"]), result["data"]["suicides_no"]))
+    assert {key: totals[key] for key in expected.index} == pytest.approx(expected.to_dict())
+
+
+def test_etag_errors_and_reload(service, tmp_path):
+    service, data = service
+    response = service.get("/years/2015")
+    assert service.get("/years/2015", if_none_match=response.etag).status == HTTPStatus.NOT_MODIFIED
+    assert service.get("/countries/Atlantis").status == HTTPStatus.NOT_FOUND
+    assert service.get("/years/abc").status == HTTPStatus.BAD_REQUEST
+    assert service.get(f"/countries/{data.suicides['country'].iloc[0]}?by=year").status == HTTPStatus.BAD_REQUEST
+
+    write_processed(tmp_path, synthetic.make_synthetic_data(n_countries=3, n_years=5, seed=1))
+    assert not service.check_for_changes()  # waits until the files stopped changing
+    assert service.check_for_changes()
+    assert service.get("/years/2015", if_none_match=response.etag).status == HTTPStatus.OK
+    assert len(json.loads(service.get("/countries").body.decode("utf-8"))["data"]["country"]) == 3
+
+
+def test_reloads_partitioned_data(service, tmp_path):
+    service, _ = service
+    suicides = synthetic.make_synthetic_data(n_countries=3, n_years=5, seed=1).suicides
+    for n_countries in [3, 2]:
+        if n_countries == 2:
+            load_dataset.dataset_path("enriched", "feather", tmp_path).unlink()  # the partitioned data is all there is
+        countries = suicides["country"].unique()[:n_countries]
+        hive.write_partitioned(suicides[suicides["country"].isin(countries)],
+                               load_dataset.partitioned_path("enriched", tmp_path), ["year"])
+        assert not service.check_for_changes()
+        assert service.check_for_changes()
+        assert len(json.loads(service.get("/countries").body.decode("utf-8"))["data"]["country"]) == n_countries
+
+
+def test_client_over_http(service):
+    service, data = service
+    server = make_server(service, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with query_client.QueryClient(port=server.server_address[1]) as client:
+            countries = client.countries()
+            assert countries["code"] == [data.codes[country] for country in countries["country"]]
+            breakdown = client.breakdown(country=countries["country"][0])
+            assert client.breakdown(country=countries["country"][0]) == breakdown
+            assert client.not_modified == 1
+            with pytest.raises(query_client.QueryError):
+                client.series("Atlantis")
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data import load_dataset, synthetic
+from src.features import similarity_index
+from src.features.similarity_index import SimilarityIndex, load_similarity_index
+
+
+@pytest.fixture
+def profiles():
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=(300, 6)) * [1, 2, 3, 1, 1, 5] + 10
+    values[rng.uniform(size=values.shape) < 0.02] = np.nan
+    profiles = pd.DataFrame(values, columns=[f"feature {i}" for i in range(6)])
+    profiles.insert(0, "country", [f"country {i}" for i in range(len(values))])
+    return profiles
+
+
+def brute_force(profiles, metric):
+    values = profiles.drop(columns="country").values
+    z = np.nan_to_num((values - np.nanmean(values, axis=0)) / np.nanstd(values, axis=0))
+    if metric == "cosine":
+        z = z / np.linalg.norm(z, axis=1, keepdims=True)
+        distances = 1 - z @ z.T
+    else:
+        distances = np.sqrt(((z[:, None, :] - z[None, :, :]) ** 2).sum(axis=2))
+    np.fill_diagonal(distances, np.inf)
+    return distances
+
+
+@pytest.mark.parametrize("metric", ["cosine", "euclidean"])
+def test_exact_index_matches_brute_force(tmp_path, profiles, metric):
+    index = SimilarityIndex.build(profiles, ["country"], metric=metric, n_neighbours=10)
+    index.save(tmp_path / "index.npz")
+    index = SimilarityIndex.load(tmp_path / "index.npz")
+    distances = brute_force(profiles, metric)
+
+    for position in [0, 17, 299]:
+        for k in [5, 25]:  # from the stored neighbours, and searched for
+            similar = index.similar(f"country {position}", k)
+            expected = np.argsort(distances[position], kind="stable")[:k]
+            assert similar["country"].tolist() == profiles["country"].values[expected].tolist()
+            np.testing.assert_allclose(similar["distance"], distances[position, expected], atol=1e-9)
+
+    # profiles from outside, e.g. another decade: a unit in the index is at distance 0 of itself
+    queried = index.query(profiles.iloc[[3, 4]], k=2)
+    assert queried["query"].tolist() == [0, 0, 1, 1]
+    assert queried["country"].tolist()[::2] == ["country 3", "country 4"]
+    np.testing.assert_allclose(queried["distance"].values[::2], 0, atol=1e-9)
+    with pytest.raises(KeyError):
+        index.similar("Atlantis")
+
+
+def test_approximate_index_finds_most_neighbours(profiles):
+    index = SimilarityIndex.build(profiles, ["country"], metric="cosine", approximate=True, n_tables=8, n_planes=6)
+    assert index.neighbours is None
+    distances = brute_force(profiles, "cosine")
+    found = 0
+    for position in range(0, 300, 10):
+        similar = index.similar(f"country {position}", 5)
+        assert len(similar) == 5 and f"country {position}" not in similar["country"].tolist()
+        assert (np.diff(similar["distance"]) >= 0).all()
+        found += len(set(similar["country"]) & set(profiles["country"].values[np.argsort(distances[position])[:5]]))
+    assert found / (30 * 5) > 0.8
+
+
+def test_index_only_rebuilt_when_enriched_data_changes(tmp_path, monkeypatch):
+    df = synthetic.make_synthetic_data(n_countries=12, n_years=10).suicides
+    load_dataset.save_dataset(df, load_dataset.dataset_path("enriched", "csv", tmp_path), "csv")
+    builds = []
+    build = SimilarityIndex.build.__func__
+
+    def counting_build(cls, *args, **kwargs):
+        builds.append(1)
+        return build(cls, *args, **kwargs)
+
+    monkeypatch.setattr(SimilarityIndex, "build", classmethod(counting_build))
+
+    index = load_similarity_index(tmp_path / "index.npz", processed_dir=tmp_path)
+    country = df["country"].iloc[0]
+    assert len(index.similar(country, 3)) == 3
+    load_dataset.save_dataset(df, load_dataset.dataset_path("enriched", "csv", tmp_path), "csv")  # written again
+    load_similarity_index(tmp_path / "index.npz", processed_dir=tmp_path)
+    assert len(builds) == 1
+    load_similarity_index(tmp_path / "index.npz", processed_dir=tmp_path, decades=True)
+    assert len(builds) == 2
+
+    df.loc[df["country"] == country, "suicides_no"] *= 3
+    load_dataset.save_dataset(df, load_dataset.dataset_path("enriched", "csv", tmp_path), "csv")
+    index = load_similarity_index(tmp_path / "index.npz", processed_dir=tmp_path)
+    assert len(builds) == 3 and index.fingerprint == similarity_index.index_fingerprint(
+        tmp_path, decades=False, metric="cosine", approximate=False)
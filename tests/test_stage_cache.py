@@ -0,0 +1,78 @@
+import pandas as pd
+
+from src.data.stage_cache import Source, Stage, StageGraph
+
+
+def double(df):
+    return df * 2
+
+
+def total(df, other):
+    return pd.DataFrame({"total": [df["a"].sum() + other["b"].sum()]})
+
+
+def make_graph(tmp_path):
+    sources = [Source("a_raw", tmp_path / "a.csv", pd.read_csv), Source("b_raw", tmp_path / "b.csv", pd.read_csv)]
+    stages = [Stage("a", double, ["a_raw"]), Stage("b", double, ["b_raw"]), Stage("total", total, ["a", "b"])]
+    return StageGraph(sources, stages, cache_dir=tmp_path / "cache")
+
+
+def test_stage_graph_only_recomputes_stale_stages(tmp_path):
+    pd.DataFrame({"a": [1, 2]}).to_csv(tmp_path / "a.csv", index=False)
+    pd.DataFrame({"b": [10]}).to_csv(tmp_path / "b.csv", index=False)
+
+    graph = make_graph(tmp_path)
+    assert graph.get("total")["total"].tolist() == [26]
+    assert sorted(graph.recomputed) == ["a", "b", "total"]
+
+    graph = make_graph(tmp_path)
+    assert graph.get("total")["total"].tolist() == [26]
+    assert graph.recomputed == []
+
+    pd.DataFrame({"b": [20]}).to_csv(tmp_path / "b.csv", index=False)
+    graph = make_graph(tmp_path)
+    assert graph.get("total")["total"].tolist() == [46]
+    assert sorted(graph.recomputed) == ["b", "total"]
+    assert len(list((tmp_path / "cache").glob("b-*.pkl"))) == 1  # outdated output was removed
+
+
+def test_stage_graph_release_lets_go_of_used_outputs(tmp_path):
+    pd.DataFrame({"a": [1, 2]}).to_csv(tmp_path / "a.csv", index=False)
+    pd.DataFrame({"b": [10]}).to_csv(tmp_path / "b.csv", index=False)
+
+    graph = make_graph(tmp_path)
+    graph.release = True
+    assert graph.get("total")["total"].tolist() == [26]
+    assert graph._results == {}  # a, b and the raw data were only needed for total, which nothing needs
+    assert graph.get("a")["a"].tolist() == [2, 4]  # read again, from the cache
+    assert graph.recomputed == ["a", "b", "total"]
+
+
+def test_stage_graph_recomputes_when_an_imported_module_changes(tmp_path, monkeypatch):
+    package = tmp_path / "stage_package"
+    package.mkdir()
+    (package / "__init__.py").write_text("")
+    (package / "helpers.py").write_text("FACTOR = 2\n")
+    (package / "stages.py").write_text("from stage_package.helpers import FACTOR\n"
+                                       "from stage_package import helpers\n\n\n"
+                                       "def scale(df):\n    return df * helpers.FACTOR\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    from stage_package import stages
+
+    pd.DataFrame({"a": [1, 2]}).to_csv(tmp_path / "a.csv", index=False)
+
+    def make_scale_graph():
+        return StageGraph([Source("a_raw", tmp_path / "a.csv", pd.read_csv)], [Stage("a", stages.scale, ["a_raw"])],
+                          cache_dir=tmp_path / "cache")
+
+    graph = make_scale_graph()
+    graph.get("a")
+    assert graph.recomputed == ["a"]
+    graph = make_scale_graph()
+    graph.get("a")
+    assert graph.recomputed == []
+
+    (package / "helpers.py").write_text("FACTOR = 3  # a constant, not a function of the stage\n")
+    graph = make_scale_graph()
+    graph.get("a")
+    assert graph.recomputed == ["a"]
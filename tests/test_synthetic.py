@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+
+from src.data import pipeline, raw_data, reshape, synthetic
+
+
+def test_synthetic_data_runs_through_pipeline(tmp_path):
+    data = synthetic.make_synthetic_data(n_countries=30, n_years=10)
+    archive = tmp_path / "data.zip"
+    synthetic.write_raw_archive(data, archive)
+
+    df = raw_data.read_raw(raw_data.SUICIDE_MEMBER, archive=archive)
+    df_population = pipeline.clean_population_stats(raw_data.read_raw(raw_data.POPULATION_MEMBER,
+                                                                      archive=archive))
+    meta = pipeline.clean_meta_data(raw_data.read_raw(raw_data.META_DATA_MEMBER, archive=archive))
+    assert len(df) == 30 * 10 * 12
+    assert meta.columns.tolist() == ["code", "region", "income"]
+
+    age_stats = pipeline.get_age_group_stats(pipeline.add_age_group_fractions(df))
+    assert len(age_stats) == 12
+    np.testing.assert_allclose(age_stats["fraction_pop"].sum(), 1)
+
+    enriched_df = pipeline.fill_in_missing_populations(df, df_population, age_stats)
+    assert enriched_df["population"].isnull().sum() < df["population"].isnull().sum()
+
+    choropleth_df = reshape.choropleth_frame(enriched_df)
+    year_country_df = reshape.year_country_frame(choropleth_df)
+    assert (choropleth_df["code"] != "").all()
+    totals = choropleth_df.groupby(["year", "country"], observed=True)["suicides_no"].sum().reset_index()
+    merged = pd.merge(totals, year_country_df, on=["year", "country"], suffixes=("", "_combined"))
+    assert len(merged) == len(year_country_df)
+    np.testing.assert_allclose(merged["suicides_no"], merged["suicides_no_combined"])
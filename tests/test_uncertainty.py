@@ -0,0 +1,76 @@
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data import pipeline, reshape, synthetic, uncertainty
+
+
+def test_exact_intervals():
+    lower, upper = uncertainty.poisson_intervals([0, 1, 10, np.nan, 5], [1e5, 1e5, 1e6, 1e5, 0])
+    # the Garwood interval, e.g. in tables of Poisson confidence limits
+    np.testing.assert_allclose(lower[:3], [0, 0.0253178, 0.479539], rtol=1e-5)
+    np.testing.assert_allclose(upper[:3], [3.688879, 5.571643, 1.839036], rtol=1e-5)
+    assert np.isnan(lower[3:]).all() and np.isnan(upper[3:]).all()  # no count, no population
+
+    rng = np.random.default_rng(0)
+    true_rate = 3.
+    counts = rng.poisson(true_rate, size=20000)
+    lower, upper = uncertainty.poisson_intervals(counts, np.full(len(counts), 1e5), level=0.9)
+    assert ((lower <= true_rate) & (true_rate <= upper)).mean() >= 0.9  # exact intervals cover at least the level
+
+
+def test_monte_carlo_intervals():
+    counts = np.array([30., 40., 500., 70., 2000., 0.])  # large enough counts for the two to agree
+    populations = np.array([1e5, 2e5, 1e6, 5e4, 1e6, 1e4])
+    groups = np.array([0, 0, 1, 2, 1, 2])
+    lower, upper = uncertainty.monte_carlo_intervals(counts, populations, groups, n_draws=20000, seed=3)
+    exact_lower, exact_upper = uncertainty.poisson_intervals(np.bincount(groups, counts),
+                                                             np.bincount(groups, populations))
+    np.testing.assert_allclose(lower, exact_lower, rtol=0.05)
+    np.testing.assert_allclose(upper, exact_upper, rtol=0.05)
+
+    again = uncertainty.monte_carlo_intervals(counts, populations, groups, n_draws=20000, seed=3)
+    np.testing.assert_array_equal(again[0], lower)
+    other = uncertainty.monte_carlo_intervals(counts, populations, groups, n_draws=20000, seed=4)
+    assert not np.array_equal(other[1], upper)
+
+
+def test_monte_carlo_memory_is_bounded():
+    n_groups, n_draws, max_bytes = 4000, 2000, 4 * 2 ** 20
+    counts = np.random.default_rng(1).poisson(20, size=n_groups * 12).astype(float)
+    groups = np.repeat(np.arange(n_groups), 12)  # every draw of every cell at once would take 768 MB
+    tracemalloc.start()
+    try:
+        lower, upper = uncertainty.monte_carlo_intervals(counts, np.full(len(counts), 1e5), groups, n_draws=n_draws,
+                                                         seed=0, max_bytes=max_bytes)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert peak < 2 * max_bytes
+    assert len(lower) == n_groups and (lower < upper).all()
+
+
+def test_rate_intervals_per_group():
+    df = synthetic.make_synthetic_data(n_countries=5, n_years=4).suicides
+    exact = uncertainty.rate_intervals(df, by=["country", "year", "sex"])
+    simulated = uncertainty.rate_intervals(df, by=["country", "year", "sex"], method="monte_carlo", n_draws=5000,
+                                           seed=1)
+    pd.testing.assert_frame_equal(exact.drop(columns=["lower", "upper"]), simulated.drop(columns=["lower", "upper"]))
+    assert ((exact["lower"] <= exact["rate"]) & (exact["rate"] <= exact["upper"])).all()
+    np.testing.assert_allclose(simulated["upper"], exact["upper"], rtol=0.1)
+    with pytest.raises(ValueError):
+        uncertainty.rate_intervals(df, by=["country"], method="bayes")
+
+
+def test_year_country_intervals():
+    with_intervals = uncertainty.add_rate_intervals(pd.read_csv("tests/data/year_country_data.csv"))
+    for rate in uncertainty.YEAR_COUNTRY_RATES:
+        lower, upper = with_intervals[f"{rate}_lower"], with_intervals[f"{rate}_upper"]
+        rates = with_intervals[rate]
+        assert ((lower <= rates + 0.01) & (rates - 0.01 <= upper)).all()  # female and male rates are rounded
+
+    data = synthetic.make_synthetic_data(n_countries=4, n_years=3)
+    year_country_df = pipeline.year_country_with_intervals(reshape.choropleth_frame(data.suicides))
+    assert {"overall_rate_lower", "overall_rate_upper"} <= set(year_country_df.columns)
@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data import pipeline, synthetic, validation
+from src.data.validation import Columns, GroupSize, NotNull, Range, SumsTo, ValidationError, validate
+
+
+def test_validate_collects_all_violations():
+    df = pd.DataFrame({"fraction_pop": [0.2, 1.5, -0.1, np.nan], "key": ["a", "a", "b", "b"]})
+    checks = [Columns(["fraction_pop", "total_population"]), Range("fraction_pop", 0, 1), NotNull("fraction_pop"),
+              GroupSize(["key"], multiple=3), SumsTo("fraction_pop", total=1.)]
+
+    with pytest.raises(ValidationError) as error:
+        validate(df, checks, name="test", level="full")
+    violations = error.value.report.to_frame().set_index("check")
+
+    assert len(violations) == 5
+    assert violations.loc["0 <= value <= 1", "rows"] == 2
+    assert violations.loc["0 <= value <= 1", "examples"] == [1.5, -0.1]
+    assert violations.loc["not null", "rows"] == 1
+    assert violations.loc["required columns", "column"] == "total_population"
+    assert violations.loc["group size multiple of 3", "rows"] == 2
+
+    assert validate(df, checks, level="off").ok
+    assert not validate(df, checks, level="sampled", raise_errors=False).ok  # small frames are checked in full
+
+
+def test_sampled_level_samples_rows_but_checks_whole_frame(monkeypatch):
+    df = pd.DataFrame({"fraction_pop": np.full(validation.SAMPLE_ROWS * 2, 0.5),
+                       "key": np.arange(validation.SAMPLE_ROWS * 2) // 12})  # the last group is incomplete
+    df.loc[[3, 1500], "fraction_pop"] = 2.
+    checks = [Range("fraction_pop", 0, 1), SumsTo("fraction_pop", total=1.), GroupSize(["key"], multiple=12)]
+    report = validate(df, checks, level="sampled", raise_errors=False)
+    assert report.rows_checked == validation.SAMPLE_ROWS and report.skipped == []
+    assert {violation.check for violation in report.violations} >= {"sums to 1.0 +- 0.01", "group size multiple of 12"}
+    again = validate(df, checks, level="sampled", raise_errors=False)
+    assert again.to_frame().equals(report.to_frame())  # the same sample every time
+
+    monkeypatch.setenv(validation.LEVEL_ENV_VAR, "full")
+    report = validate(df, checks, raise_errors=False)
+    assert report.rows_checked == len(df) and report.to_frame().set_index("check").loc["0 <= value <= 1", "rows"] == 2
+
+
+def test_add_age_group_fractions_checks_complete_groups():
+    df = synthetic.make_synthetic_data(n_countries=3, n_years=2).suicides
+    pipeline.add_age_group_fractions(df)
+    with pytest.raises(ValidationError):
+        pipeline.add_age_group_fractions(df.iloc[1:])
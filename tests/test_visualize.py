@@ -0,0 +1,108 @@
+import re
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data import reshape, synthetic
+from src.visualization import visualize
+
+CHOROPLETH_FILE = "./tests/data/choropleth_df.csv"
+YEAR_COUNTRY_FILE = "./tests/data/year_country_data.csv"
+
+
+@pytest.fixture
+def year_country_df():
+    return reshape.year_country_frame(pd.read_csv(CHOROPLETH_FILE))
+
+
+def test_frames_hold_every_metric_per_year(year_country_df):
+    frames = visualize.ChoroplethFrames.build(year_country_df)
+    with_code = year_country_df[year_country_df["code"].fillna("") != ""]
+
+    assert list(frames.years) == sorted(with_code["year"].unique())
+    assert len(frames.codes) == with_code["code"].nunique()
+    for name in visualize.METRICS:
+        assert frames.values[name].shape == (len(frames.years), len(frames.codes))
+        assert frames.values[name].dtype == np.float32
+
+    row = with_code.iloc[0]
+    year, code = np.searchsorted(frames.years, row["year"]), np.searchsorted(frames.codes, row["code"])
+    assert frames.values["male"][year, code] == np.float32(round(row["male_rate"], 2))
+    small = with_code["population"] < visualize.METRICS["ratio"].min_population
+    assert np.isfinite(frames.values["ratio"]).sum() <= (~small).sum()
+
+
+def test_load_frames_caches_by_data_hash(year_country_df, tmp_path):
+    frames = visualize.load_frames(year_country_df, cache_dir=tmp_path)
+    assert len(list(tmp_path.glob("frames-*.npz"))) == 1
+    cached = visualize.load_frames(year_country_df.copy(), cache_dir=tmp_path)
+    np.testing.assert_array_equal(cached.values["overall"], frames.values["overall"])
+
+    visualize.load_frames(year_country_df.iloc[1:], cache_dir=tmp_path)
+    assert len(list(tmp_path.glob("frames-*.npz"))) == 2
+
+
+def test_to_html(year_country_df):
+    pytest.importorskip("plotly")
+    frames = visualize.ChoroplethFrames.build(year_country_df)
+    html = frames.to_html("female")
+    assert html.count('"locations"') == 1  # countries only in the base trace, not in every frame
+    assert not re.search(r"\d\.\d{6,}", html.split('"z"', 1)[1][:5000])  # no float32 noise like 12.300000190734863
+
+
+def test_render_figures_skips_unchanged_figures(tmp_path):
+    pytest.importorskip("matplotlib")
+    enriched_df = synthetic.make_synthetic_data(n_countries=3, n_years=4).suicides
+    year_country_df = pd.read_csv(YEAR_COUNTRY_FILE)
+    countries = sorted(enriched_df["country"].unique())[:2]
+    style = dict(visualize.STYLE, dpi=20)
+
+    figures = visualize.figure_set(enriched_df, year_country_df, countries)
+    assert len(figures) == 5 + 2
+    rendered = visualize.render_figures(figures, tmp_path, style, jobs=2)
+    assert sorted(rendered) == sorted(figure.name for figure in figures)
+    assert (tmp_path / f"age/{visualize.file_slug(countries[0])}.png").is_file()
+    assert set(visualize.read_manifest(tmp_path)) == set(rendered)
+    assert visualize.render_figures(figures, tmp_path, style) == []
+
+    # new data of one country only renders the figures of that country again
+    changed = enriched_df["country"] == countries[1]
+    enriched_df.loc[changed, "suicides_no"] = enriched_df.loc[changed, "suicides_no"] + 1
+    figures = visualize.figure_set(enriched_df, year_country_df, countries)
+    assert visualize.render_figures(figures, tmp_path, style) == ["age_overall.png",
+                                                                  f"age/{visualize.file_slug(countries[1])}.png"]
+    (tmp_path / "worldwide.png").unlink()
+    assert visualize.render_figures(figures, tmp_path, style) == ["worldwide.png"]
+    assert len(visualize.render_figures(figures, tmp_path, dict(style, dpi=30))) == len(figures)
+    with pytest.raises(ValueError):
+        visualize.figure_set(enriched_df, year_country_df, ["Atlantis"])
+
+
+def test_age_bars_show_every_age_group_in_order():
+    pytest.importorskip("matplotlib")
+    import matplotlib.pyplot as plt
+
+    data = pd.DataFrame({"age": ["75+ years", "85+ years", "5-14 years", "75+ years"],
+                         "sex": ["female", "female", "male", "male"], "rate": [3., 4., 1., 2.]})
+    fig = visualize.plot_age_bars(data, "rates", dict(visualize.STYLE, dpi=20))
+    labels = [label.get_text() for label in fig.axes[0].get_xticklabels()]
+    plt.close(fig)
+    assert labels == ["5-14 years", "75+ years", "85+ years"]  # an age group of other data is not dropped
+
+
+def test_figure_key_changes_with_the_helpers_of_the_plot(tmp_path, monkeypatch):
+    package = tmp_path / "plot_package"
+    package.mkdir()
+    (package / "__init__.py").write_text("")
+    (package / "helpers.py").write_text("def decorate(ax):\n    ax.grid(True)\n")
+    (package / "plots.py").write_text("from plot_package.helpers import decorate\n\n\n"
+                                      "def plot(ax, data, title, style):\n    decorate(ax)\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    from plot_package import plots
+
+    figure = visualize.Figure("figure.png", plots.plot, pd.DataFrame({"a": [1.]}), "title")
+    key = visualize.figure_key(figure, visualize.STYLE)
+    assert visualize.figure_key(figure, visualize.STYLE) == key
+    (package / "helpers.py").write_text("def decorate(ax):\n    ax.grid(False)\n")
+    assert visualize.figure_key(figure, visualize.STYLE) != key